@@ -1,18 +1,34 @@
 """ App initialization module."""
 
 import logging
+import time
 from logging.config import dictConfig
 from os import path
 import yaml
-from flask import Flask
+from flask import Flask, g, request
 from .relays_manager import relays_manager_service
 from .extension import api
 from .rest_api.relays_manager import bp as relays_manager_bp
+from .rest_api.health import bp as health_bp
+from .rest_api.metrics import bp as metrics_bp
+from .rest_api.tracing import bp as tracing_bp
 from .common import RpiElectricalPanelException, handle_rpi_electrical_panel_exception
+from .common.async_logging import async_logging
+from .common.metrics import metrics_registry
+from .common.tracing import tracer, new_correlation_id
 
 
 logger = logging.getLogger(__name__)
 
+REQUEST_DURATION = metrics_registry.histogram(
+    "http_request_duration_seconds",
+    "REST requests duration (streamed responses until the response is returned)",
+    ("method", "route", "status"),
+)
+
+CORRELATION_ID_HEADER = "X-Correlation-ID"
+MAX_CORRELATION_ID_LENGTH = 64
+
 
 def create_app(
     config_dir: str = path.join(path.dirname(path.abspath(__file__)), "config"),
@@ -35,10 +51,21 @@ def create_app(
     # Load configuration
     app.config.from_file(app_config, load=yaml.full_load)
 
+    # Log records written by a background thread, out of the commands path
+    if app.config["LOGGING_ASYNC_ENABLED"]:
+        async_logging.start(
+            queue_max_size=app.config["LOGGING_QUEUE_MAX_SIZE"],
+            rate_limits=app.config["LOGGING_RATE_LIMITS"],
+        )
+
     # Register extensions
     register_extensions(app)
     # Register blueprints for REST API
     register_blueprints(app)
+    # Measure REST requests duration
+    register_request_metrics(app)
+    # Correlate REST requests with the relays commands
+    register_request_tracing(app)
 
     logger.info("App ready!!")
 
@@ -69,6 +96,8 @@ def register_extensions(app):
         },
     )
 
+    # Commands tracing extension
+    tracer.init_app(app=app)
     # Wifi bands manager extension
     relays_manager_service.init_app(app=app)
 
@@ -79,3 +108,58 @@ def register_blueprints(app: Flask):
     app.register_error_handler(RpiElectricalPanelException, handle_rpi_electrical_panel_exception)
     # Register REST blueprints
     api.register_blueprint(relays_manager_bp)
+    api.register_blueprint(health_bp)
+    api.register_blueprint(metrics_bp)
+    api.register_blueprint(tracing_bp)
+
+
+def register_request_metrics(app: Flask):
+    """Measure the duration of the REST requests, per route"""
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def observe_request_duration(response):
+        start = g.get("request_start")
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+            REQUEST_DURATION.labels(request.method, route, response.status_code).observe(
+                time.perf_counter() - start
+            )
+        return response
+
+
+def register_request_tracing(app: Flask):
+    """
+    Give each REST request a correlation id (X-Correlation-ID header if given), echoed in the
+    response. The commands sent by the request carry it
+    """
+
+    @app.before_request
+    def set_correlation_id():
+        # Bounded, the correlation id is carried by the MQTT messages
+        g.correlation_id = (
+            request.headers.get(CORRELATION_ID_HEADER, "")[:MAX_CORRELATION_ID_LENGTH]
+            or new_correlation_id()
+        )
+        g.request_started_at = time.time()
+
+    @app.after_request
+    def echo_correlation_id(response):
+        correlation_id = g.get("correlation_id")
+        if correlation_id is not None:
+            response.headers[CORRELATION_ID_HEADER] = correlation_id
+            if request.method != "GET":
+                started_at = g.request_started_at
+                tracer.record(
+                    correlation_id,
+                    "rest.request",
+                    started_at,
+                    time.time() - started_at,
+                    method=request.method,
+                    path=request.path,
+                    status=response.status_code,
+                )
+        return response
@@ -0,0 +1,209 @@
+"""
+Non blocking logging
+
+The loggers handlers are moved behind a bounded queue, records are formatted and written by a
+background writer thread (the log file I/O is out of the commands path), their message is merged
+when queued. Under pressure the oldest records are dropped and counted. The records of noisy
+loggers can be rate limited, the warnings and errors are never rate limited
+"""
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from typing import Dict, List, Optional
+from .metrics import metrics_registry
+
+LOG_RECORDS_DROPPED = metrics_registry.counter(
+    "log_records_dropped_total", "Log records dropped, logging queue full", ("level",)
+)
+LOG_RECORDS_RATE_LIMITED = metrics_registry.counter(
+    "log_records_rate_limited_total", "Log records discarded by rate limiting", ("logger",)
+)
+
+
+class DropOldestQueue(queue.Queue):
+    """Bounded queue, putting in a full queue drops its oldest item"""
+
+    def put_nowait(self, item):
+        """Put item, return the dropped item if the queue was full"""
+
+        dropped = None
+        with self.mutex:
+            if 0 < self.maxsize <= self._qsize():
+                dropped = self._get()
+                self.unfinished_tasks -= 1
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+        return dropped
+
+
+class RateLimiter:
+    """Token bucket, rate records per second with bursts up to burst records"""
+
+    __slots__ = ("rate", "burst", "_tokens", "_updated_at", "_lock")
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self._tokens = self.burst
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        """Take a token, return False if none is available"""
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler merging the records messages (formatted by the writer thread), with rate
+    limiting per logger (a limit applies to the logger and its children)
+    """
+
+    def __init__(self, log_queue: DropOldestQueue, rate_limits: Dict[str, float] = None):
+        super().__init__(log_queue)
+        self._rate_limiters = {
+            name: RateLimiter(rate) for name, rate in (rate_limits or {}).items()
+        }
+        # Rate limiter of each logger name, resolved once
+        self._logger_rate_limiters: Dict[str, Optional[RateLimiter]] = {}
+
+    def _get_rate_limiter(self, name: str) -> Optional[RateLimiter]:
+        """Get the rate limiter of the logger or of its closest configured parent"""
+
+        try:
+            return self._logger_rate_limiters[name]
+        except KeyError:
+            pass
+        rate_limiter = None
+        parent_name = name
+        while parent_name:
+            rate_limiter = self._rate_limiters.get(parent_name)
+            if rate_limiter is not None:
+                break
+            parent_name = parent_name.rpartition(".")[0]
+        self._logger_rate_limiters[name] = rate_limiter
+        return rate_limiter
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Merge the message arguments (they may change or not be thread-safe once the call
+        returns) and format the exception (its traceback must not outlive the call), the record
+        is formatted by the writer thread
+        """
+
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record: logging.LogRecord):
+        # Queued once, the writer thread follows the propagation to the loggers handlers
+        if getattr(record, "queued", False):
+            return
+        record.queued = True
+        if record.levelno < logging.WARNING:
+            rate_limiter = self._get_rate_limiter(record.name)
+            if rate_limiter is not None and not rate_limiter.acquire():
+                LOG_RECORDS_RATE_LIMITED.labels(record.name).inc()
+                return
+        try:
+            dropped = self.queue.put_nowait(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+            return
+        if dropped is not None:
+            LOG_RECORDS_DROPPED.labels(dropped.levelname).inc()
+
+
+class AsyncLogging:
+    """Move the handlers of the configured loggers behind a queue and a writer thread"""
+
+    def __init__(self):
+        self._listener = None
+        self.log_queue = None
+
+    def start(self, queue_max_size: int = 10000, rate_limits: Dict[str, float] = None):
+        """
+        Start the writer thread, the handlers of the root logger and of the configured loggers
+        are replaced by a queue handler. rate_limits gives the records per second allowed for
+        a logger name (and its children)
+        """
+
+        if self._listener is not None:
+            return
+        self.log_queue = DropOldestQueue(maxsize=queue_max_size)
+        queue_handler = AsyncQueueHandler(self.log_queue, rate_limits)
+
+        loggers: List[logging.Logger] = [logging.getLogger()] + [
+            logger
+            for logger in logging.Logger.manager.loggerDict.values()
+            if isinstance(logger, logging.Logger) and logger.handlers
+        ]
+        handlers_by_logger = {}
+        for logger in loggers:
+            handlers_by_logger[logger.name] = list(logger.handlers)
+            for handler in handlers_by_logger[logger.name]:
+                logger.removeHandler(handler)
+            logger.addHandler(queue_handler)
+        self._listener = _LoggersQueueListener(self.log_queue, handlers_by_logger)
+        self._listener.start()
+        # The queued records are written when the service exits
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the writer thread, the queued records are written"""
+
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
+
+class _LoggersQueueListener(logging.handlers.QueueListener):
+    """Queue listener dispatching the records to the handlers their loggers had"""
+
+    def __init__(self, log_queue: queue.Queue, handlers_by_logger: Dict[str, list]):
+        super().__init__(log_queue, respect_handler_level=True)
+        self._handlers_by_logger = handlers_by_logger
+        self._logger_handlers: Dict[str, list] = {}
+
+    def _get_handlers(self, name: str) -> list:
+        """Get the handlers of the logger and of its parents, following the propagation"""
+
+        try:
+            return self._logger_handlers[name]
+        except KeyError:
+            pass
+        handlers = []
+        logger = logging.getLogger(name) if name != "root" else logging.getLogger()
+        while logger is not None:
+            handlers.extend(self._handlers_by_logger.get(logger.name, ()))
+            if not logger.propagate:
+                break
+            logger = logger.parent
+        self._logger_handlers[name] = handlers
+        return handlers
+
+    def handle(self, record: logging.LogRecord):
+        for handler in self._get_handlers(record.name):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+async_logging: AsyncLogging = AsyncLogging()
+""" Async logging singleton"""
@@ -10,6 +10,11 @@ class ErrorCode(Enum):
     UNEXPECTED_ERROR = (0, 500, "Unexpected error occurs")
     INVALID_RELAY_NUMBER = (1, 400, "Invalid relay number")
     RELAYS_NUMBER_DONT_MATCH = (2, 400, "Relay numbers dont match")
+    INVALID_RELAYS_BOARD = (3, 400, "Invalid relays board")
+    RELAYS_MANAGER_NOT_READY = (4, 503, "Relays manager not ready")
+    INVALID_RELAYS_PRESET = (5, 400, "Invalid relays preset")
+    INVALID_RELAYS_SCHEDULE = (6, 400, "Invalid relays schedule")
+    UNKNOWN_TRACE = (7, 404, "Unknown trace")
 
     # pylint: disable=unused-argument
     def __new__(cls, *args, **kwds):
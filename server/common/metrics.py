@@ -0,0 +1,279 @@
+"""
+Metrics registry
+
+Counters, gauges and histograms, with optional labels, rendered in the Prometheus text
+exposition format
+"""
+
+import bisect
+import math
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+
+
+def _format_value(value: float) -> str:
+    """Format a sample value"""
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape_label_value(value: str) -> str:
+    """Escape a label value"""
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    """Format labels as {name="value",...}"""
+    labels = ",".join(
+        f'{name}="{_escape_label_value(value)}"' for name, value in zip(names, values)
+    )
+    return f"{{{labels}}}" if labels else ""
+
+
+class Metric(ABC):
+    """Metric with optional labels, each labels values set has its own child"""
+
+    type_name: str
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    @abstractmethod
+    def _new_child(self):
+        """Create a child"""
+
+    def labels(self, *label_values):
+        """Get the child of the labels values"""
+
+        key = tuple(str(value) for value in label_values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.label_names):
+                raise ValueError(f"{self.name} expects labels {self.label_names}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    @abstractmethod
+    def _samples(self) -> List[Tuple[str, str, float]]:
+        """Return the samples (name suffix, formatted labels, value)"""
+
+    def render(self) -> str:
+        """Render the metric in the Prometheus text format"""
+
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        for suffix, labels, value in self._samples():
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class _Value:
+    """Thread-safe value"""
+
+    __slots__ = ("_lock", "value")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        """Increment the value"""
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        """Decrement the value"""
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        """Set the value"""
+        self.value = value
+
+
+class Counter(Metric):
+    """Monotonic counter, its name should end with _total"""
+
+    type_name = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        """Increment the counter without labels"""
+        self.labels().inc(amount)
+
+    def _samples(self):
+        return [
+            ("", _format_labels(self.label_names, key), child.value)
+            for key, child in list(self._children.items())
+        ]
+
+
+class Gauge(Metric):
+    """Gauge, its value can be given by a function (without labels)"""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, label_names)
+        self._function: Optional[Callable[[], float]] = None
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value: float):
+        """Set the gauge without labels"""
+        self.labels().set(value)
+
+    def set_function(self, function: Callable[[], float]):
+        """Get the gauge value from function when rendered"""
+        self._function = function
+
+    def _samples(self):
+        if self._function is not None:
+            try:
+                return [("", "", self._function())]
+            except Exception:
+                return []
+        return [
+            ("", _format_labels(self.label_names, key), child.value)
+            for key, child in list(self._children.items())
+        ]
+
+
+class _HistogramValue:
+    """Thread-safe histogram buckets"""
+
+    __slots__ = ("_lock", "_upper_bounds", "buckets", "sum", "count")
+
+    def __init__(self, upper_bounds: Tuple[float, ...]):
+        self._lock = threading.Lock()
+        self._upper_bounds = upper_bounds
+        self.buckets = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        """Observe a value"""
+        index = bisect.bisect_left(self._upper_bounds, value)
+        with self._lock:
+            self.buckets[index] += 1
+            self.sum += value
+            self.count += 1
+
+
+class Histogram(Metric):
+    """Histogram"""
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, label_names)
+        self.upper_bounds = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self.upper_bounds)
+
+    def observe(self, value: float):
+        """Observe a value without labels"""
+        self.labels().observe(value)
+
+    def _samples(self):
+        samples = []
+        le_names = self.label_names + ("le",)
+        for key, child in list(self._children.items()):
+            with child._lock:
+                buckets = list(child.buckets)
+                total, count = child.sum, child.count
+            cumulative = 0
+            for upper_bound, bucket_count in zip(self.upper_bounds + (math.inf,), buckets):
+                cumulative += bucket_count
+                labels = _format_labels(le_names, key + (_format_value(upper_bound),))
+                samples.append(("_bucket", labels, cumulative))
+            labels = _format_labels(self.label_names, key)
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, count))
+        return samples
+
+
+class MetricsRegistry:
+    """Metrics registry, a metric is created on first registration and shared afterwards"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, Metric] = {}
+
+    def _register(self, metric_class, name: str, *args, **kwargs):
+        """Register metric, return the registered one if it exists"""
+
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = metric_class(name, *args, **kwargs)
+                self._metrics[name] = metric
+            elif not isinstance(metric, metric_class):
+                raise ValueError(f"Metric {name} already registered as {metric.type_name}")
+            return metric
+
+    def counter(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()) -> Counter:
+        """Register counter"""
+        return self._register(Counter, name, documentation, label_names)
+
+    def gauge(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()) -> Gauge:
+        """Register gauge"""
+        return self._register(Gauge, name, documentation, label_names)
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_LATENCY_BUCKETS,
+    ) -> Histogram:
+        """Register histogram"""
+        return self._register(Histogram, name, documentation, label_names, buckets=buckets)
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "".join(metric.render() for metric in metrics)
+
+
+metrics_registry: MetricsRegistry = MetricsRegistry()
+""" Metrics registry singleton"""
@@ -0,0 +1,156 @@
+"""
+Commands tracing
+
+The relays commands are traced with spans sharing a correlation id (carried by the messages and
+echoed in the relays status publication). Spans are kept in a ring buffer and optionally
+exported to a JSON lines file by a background thread
+"""
+
+import json
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional
+from flask import Flask
+
+logger = logging.getLogger(__name__)
+
+
+def new_correlation_id() -> str:
+    """Generate a correlation id"""
+    return uuid.uuid4().hex[:16]
+
+
+def monotonic_to_epoch(monotonic_time: float) -> float:
+    """Convert a monotonic time to an epoch time"""
+    return time.time() - (time.monotonic() - monotonic_time)
+
+
+class Span:
+    """Trace span"""
+
+    __slots__ = ("correlation_id", "name", "start", "duration_in_secs", "attributes")
+
+    def __init__(
+        self,
+        correlation_id: str,
+        name: str,
+        start: float,
+        duration_in_secs: float,
+        attributes: dict = None,
+    ):
+        self.correlation_id = correlation_id
+        self.name = name
+        self.start = start
+        """ Epoch time """
+        self.duration_in_secs = duration_in_secs
+        self.attributes = attributes or {}
+
+    def to_json(self) -> dict:
+        """Return json dict that represents the Span instance"""
+        return {
+            "correlation_id": self.correlation_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_in_secs": self.duration_in_secs,
+            "attributes": self.attributes,
+        }
+
+
+class Tracer:
+    """Spans recorder with ring buffer and file exporter"""
+
+    enabled: bool
+    max_spans: int
+    export_file: Optional[str]
+
+    def __init__(self, app: Flask = None) -> None:
+        self.enabled = False
+        self._spans = deque()
+        self._export_queue = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """Initialize Tracer"""
+        if app is not None:
+            logger.debug("initializing the Tracer")
+            self.enabled = app.config["TRACING_ENABLED"]
+            self.max_spans = app.config["TRACING_MAX_SPANS"]
+            self.export_file = app.config["TRACING_EXPORT_FILE"]
+            self._spans = deque(maxlen=self.max_spans)
+
+            if self.enabled and self.export_file:
+                self._export_queue = queue.SimpleQueue()
+                threading.Thread(target=self._export, name="tracing-exporter", daemon=True).start()
+
+    def record(
+        self,
+        correlation_id: Optional[str],
+        name: str,
+        start: float,
+        duration_in_secs: float,
+        **attributes,
+    ):
+        """Record a span, start is an epoch time"""
+
+        if not self.enabled or correlation_id is None:
+            return
+        span = Span(correlation_id, name, start, max(0.0, duration_in_secs), attributes)
+        self._spans.append(span)
+        if self._export_queue is not None:
+            self._export_queue.put(span)
+
+    def record_monotonic(
+        self, correlation_id: Optional[str], name: str, start: float, end: float, **attributes
+    ):
+        """Record a span from its monotonic start and end times"""
+
+        if not self.enabled or correlation_id is None:
+            return
+        self.record(correlation_id, name, monotonic_to_epoch(start), end - start, **attributes)
+
+    def get_trace(self, correlation_id: str) -> List[Span]:
+        """Get the spans of a correlation id, ordered by start"""
+        spans = [span for span in list(self._spans) if span.correlation_id == correlation_id]
+        return sorted(spans, key=lambda span: span.start)
+
+    def get_traces(self, limit: int = 20) -> Dict[str, List[Span]]:
+        """Get the spans of the last correlation ids (most recent first)"""
+
+        traces: Dict[str, List[Span]] = OrderedDict()
+        for span in reversed(list(self._spans)):
+            if span.correlation_id not in traces:
+                if len(traces) >= limit:
+                    continue
+                traces[span.correlation_id] = []
+            traces[span.correlation_id].append(span)
+        for spans in traces.values():
+            spans.sort(key=lambda span: span.start)
+        return traces
+
+    def _export(self):
+        """Exporter thread, append the spans to the export file as JSON lines"""
+
+        while True:
+            spans = [self._export_queue.get()]
+            # Write the spans recorded meanwhile at once
+            try:
+                while True:
+                    spans.append(self._export_queue.get_nowait())
+            except queue.Empty:
+                pass
+            try:
+                with open(self.export_file, "a") as export_file:
+                    for span in spans:
+                        export_file.write(json.dumps(span.to_json(), separators=(",", ":")))
+                        export_file.write("\n")
+            except OSError:
+                logger.exception("Spans export failed")
+
+
+tracer: Tracer = Tracer()
+""" Tracer singleton"""
@@ -0,0 +1,10 @@
+"""I2C bus interface package"""
+
+from .backend import (
+    I2CBusBackend,
+    SMBusBackend,
+    SimulatedBusBackend,
+    RecordingBusBackend,
+    BusTransaction,
+    create_bus_backend,
+)
@@ -0,0 +1,204 @@
+"""
+I2C bus backends
+
+    smbus: hardware bus, through smbus2 (only available on the Raspberry Pi)
+    simulated: in-memory PCF8574 style expanders, with configurable per transaction latency,
+               jitter and error rate
+    recording: records the transactions of another backend
+"""
+
+import errno
+import logging
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+SMBUS_BACKEND = "smbus"
+SIMULATED_BACKEND = "simulated"
+RECORDING_BACKEND = "recording"
+
+
+class I2CBusBackend(ABC):
+    """I2C bus backend interface"""
+
+    @abstractmethod
+    def read_byte(self, address: int) -> int:
+        """Read a byte from the device at address"""
+
+    @abstractmethod
+    def write_byte(self, address: int, value: int):
+        """Write a byte to the device at address"""
+
+    def close(self):
+        """Release the bus"""
+
+
+class SMBusBackend(I2CBusBackend):
+    """Hardware I2C bus"""
+
+    def __init__(self, bus_number: int = 1):
+        # Imported here so the app can be imported and run off a Raspberry Pi
+        import smbus2
+
+        self.bus_number = bus_number
+        self._bus = smbus2.SMBus(bus_number)
+
+    def read_byte(self, address: int) -> int:
+        return self._bus.read_byte(address)
+
+    def write_byte(self, address: int, value: int):
+        self._bus.write_byte(address, value)
+
+    def close(self):
+        self._bus.close()
+
+
+class SimulatedBusBackend(I2CBusBackend):
+    """
+    In-memory bus of PCF8574 style expanders: a read returns the last byte written to the
+    address (0xFF at power on). Transactions are serialized as on a real bus
+    """
+
+    def __init__(
+        self,
+        latency_in_secs: float = 0,
+        jitter_in_secs: float = 0,
+        error_rate: float = 0,
+        seed: Optional[int] = None,
+    ):
+        self.latency_in_secs = latency_in_secs
+        self.jitter_in_secs = jitter_in_secs
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._registers = {}
+        self._lock = threading.Lock()
+
+    def _transaction(self, address: int):
+        """Simulate the bus transaction delay and errors, called with the bus lock held"""
+
+        delay = self.latency_in_secs
+        if self.jitter_in_secs:
+            delay += self._random.uniform(0, self.jitter_in_secs)
+        if delay > 0:
+            time.sleep(delay)
+        if self.error_rate and self._random.random() < self.error_rate:
+            raise OSError(errno.EIO, f"Simulated I2C error on address {hex(address)}")
+
+    def read_byte(self, address: int) -> int:
+        with self._lock:
+            self._transaction(address)
+            return self._registers.get(address, 0xFF)
+
+    def write_byte(self, address: int, value: int):
+        with self._lock:
+            self._transaction(address)
+            self._registers[address] = value & 0xFF
+
+    def set_register(self, address: int, value: int):
+        """Change the expander byte without bus transaction (simulates an external change)"""
+        with self._lock:
+            self._registers[address] = value & 0xFF
+
+
+class BusTransaction(NamedTuple):
+    """Recorded bus transaction"""
+
+    timestamp: float
+    operation: str
+    address: int
+    value: Optional[int]
+    duration_in_secs: float
+    error: Optional[str]
+
+
+class RecordingBusBackend(I2CBusBackend):
+    """Records the transactions of another backend (the last max_transactions are kept)"""
+
+    def __init__(self, backend: I2CBusBackend, max_transactions: int = 10000):
+        self.backend = backend
+        self._transactions = deque(maxlen=max_transactions)
+
+    def _record(self, operation: str, address: int, value: Optional[int], start: float, error):
+        """Record a transaction"""
+        self._transactions.append(
+            BusTransaction(
+                timestamp=time.time(),
+                operation=operation,
+                address=address,
+                value=value,
+                duration_in_secs=time.perf_counter() - start,
+                error=None if error is None else str(error),
+            )
+        )
+
+    def read_byte(self, address: int) -> int:
+        start = time.perf_counter()
+        try:
+            value = self.backend.read_byte(address)
+        except OSError as error:
+            self._record("read", address, None, start, error)
+            raise
+        self._record("read", address, value, start, None)
+        return value
+
+    def write_byte(self, address: int, value: int):
+        start = time.perf_counter()
+        try:
+            self.backend.write_byte(address, value)
+        except OSError as error:
+            self._record("write", address, value, start, error)
+            raise
+        self._record("write", address, value, start, None)
+
+    def close(self):
+        self.backend.close()
+
+    @property
+    def transactions(self) -> List[BusTransaction]:
+        """Recorded transactions, oldest first"""
+        return list(self._transactions)
+
+    def clear(self):
+        """Clear recorded transactions"""
+        self._transactions.clear()
+
+
+def create_bus_backend(
+    backend: str,
+    bus_number: int = 1,
+    simulated_latency_in_secs: float = 0,
+    simulated_jitter_in_secs: float = 0,
+    simulated_error_rate: float = 0,
+    recorded_backend: str = SIMULATED_BACKEND,
+    max_recorded_transactions: int = 10000,
+) -> I2CBusBackend:
+    """Create a bus backend by name"""
+
+    logger.info("Create %s I2C bus backend for bus %s", backend, bus_number)
+    if backend == SMBUS_BACKEND:
+        return SMBusBackend(bus_number=bus_number)
+    if backend == SIMULATED_BACKEND:
+        return SimulatedBusBackend(
+            latency_in_secs=simulated_latency_in_secs,
+            jitter_in_secs=simulated_jitter_in_secs,
+            error_rate=simulated_error_rate,
+        )
+    if backend == RECORDING_BACKEND:
+        if recorded_backend == RECORDING_BACKEND:
+            raise ValueError("The recording bus backend can not record itself")
+        return RecordingBusBackend(
+            backend=create_bus_backend(
+                backend=recorded_backend,
+                bus_number=bus_number,
+                simulated_latency_in_secs=simulated_latency_in_secs,
+                simulated_jitter_in_secs=simulated_jitter_in_secs,
+                simulated_error_rate=simulated_error_rate,
+            ),
+            max_transactions=max_recorded_transactions,
+        )
+    raise ValueError(f"Unknown I2C bus backend: {backend}")
@@ -3,4 +3,6 @@
 # TODO: this package must be a single library used by all the modules that use MQTT
 
 from .client import MQTTClient as mqtt_client_interface
-from .model import SingleRelayStatus, RelaysStatus
+from .model import SingleRelayStatus, RelaysStatus, RelaysScheduleCommand
+from .outbound import MQTTPublishError
+from .codec import BSON_CODEC, COMPACT_CODEC, serialize, deserialize
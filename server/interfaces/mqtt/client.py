@@ -1,13 +1,46 @@
 import logging
-from typing import Callable
+import threading
+from concurrent.futures import Future
+from typing import Callable, Union
 import time
-from socket import error as socket_error
-from socket import timeout as socket_timeout
 import paho.mqtt.client as mqtt
-from .model import Msg, serialize, deserialize
+from server.common.metrics import metrics_registry
+from server.common.tracing import tracer, new_correlation_id
+from .model import Msg, RelaysStatus
+from .codec import DEFAULT_CODEC, get_codec, deserialize
+from .outbound import OutboundMessage, OutboundQueue, MQTTPublishError
+from .topics import TopicTrie
 
 logger = logging.getLogger(__name__)
 
+PUBLISH_LATENCY = metrics_registry.histogram(
+    "mqtt_publish_latency_seconds", "MQTT messages latency from publish to PUBACK", ("topic",)
+)
+PUBACK_TIMEOUTS = metrics_registry.counter(
+    "mqtt_puback_timeouts_total", "MQTT messages without PUBACK in time", ("topic",)
+)
+PUBLISH_ERRORS = metrics_registry.counter(
+    "mqtt_publish_errors_total", "MQTT messages publication errors", ("topic",)
+)
+OUTBOUND_DROPPED = metrics_registry.counter(
+    "mqtt_outbound_dropped_total", "MQTT messages dropped, outbound queue full", ("topic",)
+)
+OUTBOUND_QUEUE_DEPTH = metrics_registry.gauge(
+    "mqtt_outbound_queue_depth", "MQTT messages waiting to be published"
+)
+MESSAGES_RECEIVED = metrics_registry.counter(
+    "mqtt_messages_received_total", "MQTT messages received", ("topic",)
+)
+MESSAGES_PROCESSING_ERRORS = metrics_registry.counter(
+    "mqtt_messages_processing_errors_total", "MQTT messages received not processed", ("topic",)
+)
+CONNECTED = metrics_registry.gauge("mqtt_connected", "MQTT client connected to broker (0 or 1)")
+CONNECTION_TRANSITIONS = metrics_registry.counter(
+    "mqtt_connection_transitions_total",
+    "MQTT client connection state transitions",
+    ("state",),
+)
+
 
 class MQTTClient:
     """Service class for MQTT client"""
@@ -21,21 +54,51 @@ class MQTTClient:
         qos: int = 1,
         reconnection_timeout_in_secs: int = 5,
         publish_timeout_in_secs: int = 1,
+        max_pending_messages: int = 100,
+        codecs: dict = None,
+        connection_callback: Callable[[bool], None] = None,
+        message_classes: dict = None,
+        broker_port: int = 1883,
+        raw_subscriptions: dict = None,
     ):
         uid = str(time.time_ns())
         self.username = f"{username}_{uid}"
         self.broker_address = broker_address
+        self.broker_port = broker_port
         self.password = password
         self.subscriptions = subscriptions
+        # Callbacks receiving the MQTT message not decoded: {topic filter: callback}
+        self.raw_subscriptions = raw_subscriptions
         self.qos = qos
-        self._callbacks = {}
+        # (callback, decode) of each topic filter subscribed
+        self._subscriptions = TopicTrie()
         self.connected = False
         self.reconnection_timeout_in_secs = reconnection_timeout_in_secs
         self.publish_timeout_in_secs = publish_timeout_in_secs
+        # Called with the connection state on connection and disconnection
+        self.connection_callback = connection_callback
+        # Codec used to publish on each topic: {topic: codec name}
+        self.codecs = {topic: get_codec(codec_name) for topic, codec_name in (codecs or {}).items()}
+        self.default_codec = get_codec(DEFAULT_CODEC)
+        # Class of the messages received on each topic: {topic: class}, RelaysStatus by default
+        self.message_classes = message_classes or {}
+
+        # Outbound messages, published by the sender thread
+        self._outbound_condition = threading.Condition()
+        self._outbound_queue = OutboundQueue(max_size=max_pending_messages)
+        # Messages waiting for PUBACK: [(message_info, outbound_message, deadline)], the deadline
+        # is None while the message is held by the network loop until reconnection
+        self._inflight = []
+        self._sender = None
+        OUTBOUND_QUEUE_DEPTH.set_function(lambda: len(self._outbound_queue))
 
         self._client = mqtt.Client(self.username)
         if password:
             self._client.username_pw_set(username=self.username, password=self.password)
+        # The network loop reconnects by itself when the connection is lost
+        self._client.reconnect_delay_set(
+            min_delay=reconnection_timeout_in_secs, max_delay=max(reconnection_timeout_in_secs, 60)
+        )
 
         def on_connect(client, userdata, flags, rc, qos=1):
             """When cnnection is established"""
@@ -44,62 +107,102 @@ class MQTTClient:
             if self.subscriptions is not None:
                 for topic, callback in self.subscriptions.items():
                     self.subscribe(topic, callback, qos)
-                    logger.info(f"Subscribed to topic: {topic} qos: {qos}")
-            self.connected = True
+                    logger.info("Subscribed to topic: %s qos: %s", topic, qos)
+            if self.raw_subscriptions is not None:
+                for topic, callback in self.raw_subscriptions.items():
+                    self.subscribe(topic, callback, qos, decode=False)
+                    logger.info("Subscribed to topic: %s qos: %s (raw)", topic, qos)
+            with self._outbound_condition:
+                self.connected = True
+                # The messages held by the network loop are sent again, their PUBACK timeout starts
+                self._start_inflight_deadlines()
+                self._outbound_condition.notify_all()
+            CONNECTED.set(1)
+            CONNECTION_TRANSITIONS.labels("connected").inc()
+            if self.connection_callback is not None:
+                self.connection_callback(True)
 
         def on_disconnect(client, userdata, reasonCode):
-            """Stop reading and notify upon disconnecting"""
+            """Notify upon disconnecting, outbound messages are buffered until reconnection"""
 
             logger.info("MQTT Client disconnected")
-            self.connected = False
-            self.loop_stop()
+            with self._outbound_condition:
+                self.connected = False
+                # Not acknowledged messages are held until reconnection, not failed meanwhile
+                self._inflight = [
+                    (message_info, outbound_message, None)
+                    for message_info, outbound_message, _ in self._inflight
+                ]
+            CONNECTED.set(0)
+            CONNECTION_TRANSITIONS.labels("disconnected").inc()
+            if self.connection_callback is not None:
+                self.connection_callback(False)
+
+        def on_connect_fail(client, userdata):
+            """Notify upon connection failure, the network loop retries"""
+
+            logger.warning("Connection to broker unsuccessful, retrying ...")
+            CONNECTION_TRANSITIONS.labels("connection_failed").inc()
+            if self.connection_callback is not None:
+                self.connection_callback(False)
 
         def on_subscribe(client, userdata, mid, granted_qos):
             """Notify upon subscription"""
 
-            logger.debug("Subscription done garanted_qos: " + str(granted_qos))
+            logger.debug("Subscription done garanted_qos: %s", granted_qos)
 
         def on_message(client, userdata, message):
-            """Notify upon message reception"""
-
-            logger.info(f"Message received on topic {message.topic}")
-            logger.debug(f"   mid : {message.mid}")
-            logger.debug(f"   duplicated : {message.dup}")
-            logger.debug(f"   qos : {message.qos}")
-            callback = self._callbacks[message.topic]
-            if callback:
+            """Notify upon message reception, dispatched to the matching subscriptions"""
+
+            subscriptions = self._subscriptions.match(message.topic)
+            # Counted by topic filter, the topics matched by wildcards are not bounded
+            topic_filter = subscriptions[0][0] if subscriptions else message.topic
+            MESSAGES_RECEIVED.labels(topic_filter).inc()
+            logger.debug(
+                "Message received on topic %s, mid: %s, duplicated: %s, qos: %s",
+                message.topic,
+                message.mid,
+                message.dup,
+                message.qos,
+            )
+            if not subscriptions:
+                logger.warning("Message received on topic %s not subscribed", message.topic)
+                return
+            for topic_filter, (callback, decode) in subscriptions:
+                if not callback:
+                    continue
                 try:
-                    msg = deserialize(message.payload)
-                    logger.info(f"Message : {str(msg)}")
-                    callback(msg)
+                    if decode:
+                        self._on_decoded_message(topic_filter, message, callback)
+                    else:
+                        callback(message)
                 except Exception:
+                    MESSAGES_PROCESSING_ERRORS.labels(topic_filter).inc()
                     logger.exception("Message processing failed")
                     raise
 
         def on_publish(client, userdata, mid):
             """Notify upon publishing message on queue"""
 
-            logger.debug("Message puback received for message mid: %s", str(mid))
+            logger.debug("Message puback received for message mid: %s", mid)
+            with self._outbound_condition:
+                self._outbound_condition.notify_all()
 
         self._client.on_connect = on_connect
         self._client.on_disconnect = on_disconnect
+        self._client.on_connect_fail = on_connect_fail
         self._client.on_subscribe = on_subscribe
         self._client.on_message = on_message
         self._client.on_publish = on_publish
 
     def connect(self):
-        """Connect to broker, retry if connection unsuccessful"""
-
-        try:
-            self._client.connect(self.broker_address)
-            time.sleep(1)
-            return
-        except (socket_error, socket_timeout):
-            self.connected = False
-            logger.exception("Connection to broker unsuccessful")
-            logger.info("Retrying connection ...")
-            time.sleep(self.reconnection_timeout_in_secs)
-            return self.connect()
+        """
+        Connect to broker without blocking: the connection is established by the network loop,
+        which retries every reconnection_timeout_in_secs while the broker is unreachable
+        """
+
+        logger.info("Connect to broker %s:%d", self.broker_address, self.broker_port)
+        self._client.connect_async(self.broker_address, self.broker_port)
 
     def disconnect(self):
         """Send disconnection message to broker"""
@@ -107,38 +210,181 @@ class MQTTClient:
         logger.info("Disconnect from broker")
         self._client.disconnect()
 
-    def publish(self, topic: str, message: Msg, qos=1):
+    def publish(
+        self, topic: str, message: Msg, qos=1, retain: bool = False, replace: bool = False
+    ) -> Future:
         """
-        Try to publish a message to the broker, if errorin publish launch reconnection
+        Queue a message to be published by the sender thread, return a future resolved with the
+        message mid on PUBACK, failed if no PUBACK is received within the publish timeout once the
+        message is sent (a QoS 1 message is held while disconnected, its future stays pending
+        until it is sent again on reconnection). If replace is True the message supersedes the
+        pending message of the same topic (the futures of both messages are resolved with the
+        same result)
         """
 
-        logger.info(f"Publish message on topic {topic}")
-        logger.info(f"Message : {str(message)}")
-        message_publish_info = self._client.publish(topic, serialize(message), qos)
-        logger.debug("trying to publish message mid: %s", str(message_publish_info.mid))
-        try:
-            message_publish_info.wait_for_publish(timeout=self.publish_timeout_in_secs)
-        except:
-            logger.exception(
-                f"Error when tryng to publish message mid: {message_publish_info.mid} launching"
-                " reconnection procedure"
+        logger.info("Publish message on topic %s", topic)
+        logger.debug("Message : %s", message)
+        return self.publish_payload(
+            topic=topic,
+            payload=self.codecs.get(topic, self.default_codec).encode(message),
+            qos=qos,
+            retain=retain,
+            replace=replace,
+        )
+
+    def publish_payload(
+        self, topic: str, payload: bytes, qos=1, retain: bool = False, replace: bool = False
+    ) -> Future:
+        """Queue an encoded payload to be published by the sender thread, see publish"""
+
+        outbound_message = OutboundMessage(
+            topic=topic,
+            payload=payload,
+            qos=qos,
+            retain=retain,
+            replace=replace,
+        )
+        future = outbound_message.futures[0]
+
+        with self._outbound_condition:
+            self._start_sender()
+            dropped = self._outbound_queue.put(outbound_message)
+            self._outbound_condition.notify_all()
+        if dropped is not None:
+            OUTBOUND_DROPPED.labels(dropped.topic).inc()
+            logger.warning("Outbound queue full, message on topic %s dropped", dropped.topic)
+            dropped.set_exception(MQTTPublishError("Message dropped, outbound queue full"))
+        return future
+
+    def _start_sender(self):
+        """Start the sender thread if not running"""
+
+        if self._sender is None or not self._sender.is_alive():
+            self._sender = threading.Thread(target=self._send_loop, name="mqtt-sender", daemon=True)
+            self._sender.start()
+
+    def _start_inflight_deadlines(self):
+        """Start the PUBACK timeout of the messages held, called with the condition held"""
+
+        deadline = time.monotonic() + self.publish_timeout_in_secs
+        self._inflight = [
+            (
+                message_info,
+                outbound_message,
+                deadline if message_deadline is None else message_deadline,
             )
-        if not message_publish_info._published:
-            logger.exception(f"The message mid: {message_publish_info.mid} could not be published")
-            logger.exception(f"Launching reconnection procedure")
-            try:
-                self.connect()
-                self.loop_start()
-            except socket_error:
-                return self.publish(topic, message)
-            return self.publish(topic, message)
-        return message_publish_info
-
-    def subscribe(self, topic: str, callback: Callable[[Msg], None], qos=1):
-        """Subscribe to a topic"""
-
-        logger.info(f"Subscribe to topic {topic}")
-        self._callbacks[topic] = callback
+            for message_info, outbound_message, message_deadline in self._inflight
+        ]
+
+    def _check_inflight(self):
+        """Resolve the acknowledged messages and fail the timed out ones"""
+
+        now = time.monotonic()
+        still_inflight = []
+        for message_info, outbound_message, deadline in self._inflight:
+            if message_info.is_published():
+                PUBLISH_LATENCY.labels(outbound_message.topic).observe(
+                    now - outbound_message.queued_at
+                )
+                outbound_message.set_result(message_info.mid)
+            elif deadline is not None and now >= deadline:
+                PUBACK_TIMEOUTS.labels(outbound_message.topic).inc()
+                logger.error("The message mid: %s could not be published", message_info.mid)
+                outbound_message.set_exception(
+                    MQTTPublishError(f"No PUBACK received for message mid: {message_info.mid}")
+                )
+            else:
+                still_inflight.append((message_info, outbound_message, deadline))
+        self._inflight = still_inflight
+
+    def _send_loop(self):
+        """Sender thread, publish the outbound messages when the client is connected"""
+
+        while True:
+            with self._outbound_condition:
+                self._check_inflight()
+                if not self.connected or len(self._outbound_queue) == 0:
+                    timeout = self.publish_timeout_in_secs
+                    deadlines = [
+                        deadline for _, _, deadline in self._inflight if deadline is not None
+                    ]
+                    if deadlines:
+                        timeout = max(0, min(deadlines) - time.monotonic())
+                    self._outbound_condition.wait(timeout=timeout)
+                    continue
+                outbound_message = self._outbound_queue.get()
+
+            message_info = self._client.publish(
+                outbound_message.topic,
+                outbound_message.payload,
+                outbound_message.qos,
+                outbound_message.retain,
+            )
+            logger.debug("trying to publish message mid: %s", message_info.mid)
+
+            with self._outbound_condition:
+                if message_info.rc == mqtt.MQTT_ERR_NO_CONN and outbound_message.qos == 0:
+                    # Not kept by the network loop, send it again once reconnected
+                    self.connected = False
+                    self._outbound_queue.put_front(outbound_message)
+                elif message_info.rc not in (mqtt.MQTT_ERR_SUCCESS, mqtt.MQTT_ERR_NO_CONN):
+                    PUBLISH_ERRORS.labels(outbound_message.topic).inc()
+                    logger.error(
+                        "Error when tryng to publish message mid: %s rc: %s",
+                        message_info.mid,
+                        message_info.rc,
+                    )
+                    outbound_message.set_exception(
+                        MQTTPublishError(f"Publish error rc: {message_info.rc}")
+                    )
+                else:
+                    # QoS > 0 messages are kept by the network loop and sent again on reconnection,
+                    # the PUBACK timeout starts once the message is sent
+                    sent = message_info.rc == mqtt.MQTT_ERR_SUCCESS and self.connected
+                    self._inflight.append(
+                        (
+                            message_info,
+                            outbound_message,
+                            time.monotonic() + self.publish_timeout_in_secs if sent else None,
+                        )
+                    )
+
+    def _on_decoded_message(
+        self, topic_filter: str, message: mqtt.MQTTMessage, callback: Callable[[Msg], None]
+    ):
+        """Decode the message payload and call the callback"""
+
+        received_at = time.time()
+        msg = deserialize(message.payload, self.message_classes.get(topic_filter, RelaysStatus))
+        logger.info("Message received on topic %s: %s", message.topic, msg)
+        if isinstance(msg, RelaysStatus):
+            if msg.correlation_id is None:
+                msg.correlation_id = new_correlation_id()
+            # From the sender timestamp (sender clock) to the reception
+            sent_at = msg.timestamp_ms() / 1000
+            tracer.record(
+                msg.correlation_id,
+                "mqtt.transit",
+                sent_at,
+                received_at - sent_at,
+                topic=message.topic,
+            )
+        callback(msg)
+
+    def subscribe(
+        self,
+        topic: str,
+        callback: Union[Callable[[Msg], None], Callable[[mqtt.MQTTMessage], None]],
+        qos=1,
+        decode: bool = True,
+    ):
+        """
+        Subscribe to a topic filter (+ and # wildcards allowed). The callback receives the
+        decoded message, or the MQTT message (topic, payload, mid, dup flag) if decode is False
+        """
+
+        logger.info("Subscribe to topic %s", topic)
+        self._subscriptions.insert(topic, (callback, decode))
 
         return self._client.subscribe(topic, qos)
 
@@ -146,7 +392,7 @@ class MQTTClient:
         """Run loop forever"""
 
         logger.info("Run infinite loop")
-        self._client.loop_forever()
+        self._client.loop_forever(retry_first_connection=True)
 
     def loop_start(self):
         """Run loop in dedicated thread"""
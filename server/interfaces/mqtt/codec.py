@@ -0,0 +1,157 @@
+"""
+MQTT messages codecs
+
+    bson: BSON document of the message json dict (default, kept for compatibility)
+    compact: fixed layout binary format
+        version (1 byte) | flags (1 byte, bit 0: command, bit 1: correlation id)
+        | timestamp (8 bytes, epoch millis) | masks length n (1 byte)
+        | relays status mask (n bytes) | relays validity mask (n bytes)
+        [| correlation id length m (1 byte) | correlation id (m bytes, utf-8)]
+        integers are little endian, bit i of the masks is relay i
+
+The codec of a received payload is detected, so both codecs can be used on any topic carrying
+relays status messages (the other messages are BSON only)
+"""
+
+import struct
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Dict
+import bson
+from .model import Msg, RelaysStatus
+
+BSON_CODEC = "bson"
+COMPACT_CODEC = "compact"
+DEFAULT_CODEC = BSON_CODEC
+
+
+class Codec(ABC):
+    """MQTT messages codec interface"""
+
+    name: str
+
+    @abstractmethod
+    def encode(self, msg: Msg) -> bytes:
+        """Encode message"""
+
+    @abstractmethod
+    def decode(self, payload: bytes, msg_class: type = RelaysStatus) -> Msg:
+        """Decode message, raise ValueError if the payload is not valid"""
+
+
+class BsonCodec(Codec):
+    """BSON codec"""
+
+    name = BSON_CODEC
+
+    def encode(self, msg: Msg) -> bytes:
+        """Encode message"""
+        return bson.dumps(msg.to_json())
+
+    def decode(self, payload: bytes, msg_class: type = RelaysStatus) -> Msg:
+        """Decode message"""
+        return msg_class.from_json(bson.loads(payload))
+
+    @staticmethod
+    def matches(payload: bytes) -> bool:
+        """A BSON document starts with its total length (int32 little endian)"""
+        return len(payload) >= 5 and int.from_bytes(payload[:4], "little") == len(payload)
+
+
+class CompactCodec(Codec):
+    """Compact fixed layout binary codec"""
+
+    name = COMPACT_CODEC
+    VERSION = 0xC1
+    """ Version byte, never the first byte of a BSON document as short as a compact message """
+    FLAG_COMMAND = 0x01
+    FLAG_CORRELATION_ID = 0x02
+    HEADER = struct.Struct("<BBQB")
+
+    def encode(self, msg: Msg) -> bytes:
+        """Encode message"""
+
+        status_mask = msg.status_mask
+        validity_mask = msg.validity_mask
+        masks_length = max(1, (validity_mask.bit_length() + 7) // 8)
+        flags = self.FLAG_COMMAND if msg.command else 0
+        correlation_id = b""
+        if msg.correlation_id is not None:
+            flags |= self.FLAG_CORRELATION_ID
+            encoded_correlation_id = msg.correlation_id.encode()[:255]
+            correlation_id = bytes([len(encoded_correlation_id)]) + encoded_correlation_id
+
+        return (
+            self.HEADER.pack(self.VERSION, flags, msg.timestamp_ms(), masks_length)
+            + status_mask.to_bytes(masks_length, "little")
+            + validity_mask.to_bytes(masks_length, "little")
+            + correlation_id
+        )
+
+    def decode(self, payload: bytes, msg_class: type = RelaysStatus) -> Msg:
+        """
+        Decode message, only relays status messages are supported. Raise ValueError if the
+        payload is truncated
+        """
+
+        if msg_class is not RelaysStatus:
+            raise ValueError(f"Compact codec does not support {msg_class.__name__} messages")
+        if len(payload) < self.HEADER.size:
+            raise ValueError(f"Truncated compact message: {len(payload)} bytes")
+        version, flags, timestamp_ms, masks_length = self.HEADER.unpack_from(payload)
+        if version != self.VERSION:
+            raise ValueError(f"Unsupported compact message version: {version}")
+        offset = self.HEADER.size
+        size = offset + 2 * masks_length + (1 if flags & self.FLAG_CORRELATION_ID else 0)
+        if len(payload) < size:
+            raise ValueError(f"Truncated compact message: {len(payload)} bytes, {size} expected")
+        status_mask = int.from_bytes(payload[offset : offset + masks_length], "little")
+        offset += masks_length
+        validity_mask = int.from_bytes(payload[offset : offset + masks_length], "little")
+        offset += masks_length
+        correlation_id = None
+        if flags & self.FLAG_CORRELATION_ID:
+            correlation_id_length = payload[offset]
+            offset += 1
+            if len(payload) < offset + correlation_id_length:
+                raise ValueError(
+                    f"Truncated compact message: {len(payload)} bytes, "
+                    f"{offset + correlation_id_length} expected"
+                )
+            correlation_id = payload[offset : offset + correlation_id_length].decode()
+
+        return RelaysStatus.from_mask(
+            status_mask=status_mask,
+            validity_mask=validity_mask,
+            command=bool(flags & self.FLAG_COMMAND),
+            timestamp=datetime.fromtimestamp(timestamp_ms / 1000),
+            correlation_id=correlation_id,
+        )
+
+
+CODECS: Dict[str, Codec] = {codec.name: codec for codec in (BsonCodec(), CompactCodec())}
+
+
+def get_codec(name: str) -> Codec:
+    """Get codec by name"""
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(f"Unknown MQTT codec: {name}") from None
+
+
+def detect_codec(payload: bytes) -> Codec:
+    """Detect the codec of a received payload"""
+    if payload[:1] == bytes([CompactCodec.VERSION]) and not BsonCodec.matches(payload):
+        return CODECS[COMPACT_CODEC]
+    return CODECS[BSON_CODEC]
+
+
+def serialize(msg: Msg, codec: str = DEFAULT_CODEC) -> bytes:
+    """serialize MQTT message"""
+    return get_codec(codec).encode(msg)
+
+
+def deserialize(payload: bytes, msg_class: type = RelaysStatus) -> Msg:
+    """deserialize MQTT message, whatever its codec"""
+    return detect_codec(payload).decode(payload, msg_class)
@@ -2,53 +2,198 @@
 MQTT messages model
 """
 
+import logging
+import time
 from datetime import datetime
-from typing import Iterable, TypeVar
+from typing import Dict, Iterable, List, Tuple, TypeVar
 from enum import Enum
-import bson
 import dateutil.parser
 
+logger = logging.getLogger(__name__)
+
 Msg = TypeVar("Msg")
 
+PREBUILT_RELAYS_NUMBER = 6
+# Relays numbers carried by the messages are below this limit (compact codec masks of 255 bytes)
+MAX_RELAYS_NUMBER = 255 * 8
 
-def serialize(msg: Msg) -> bytes:
-    """serialize MQTT message"""
-    return bson.dumps(msg.to_json())
 
+class SingleRelayStatus:
+    """
+    Immutable relay status, use SingleRelayStatus.of() to get the shared instance of a
+    (relay_number, status) value
+    """
 
-def deserialize(payload: bytes) -> Msg:
-    """deserialize MQTT message"""
-    return RelaysStatus.from_json(bson.loads(payload))
+    __slots__ = ("relay_number", "status")
 
+    _instances: Dict[Tuple[int, bool], "SingleRelayStatus"] = {}
 
-class SingleRelayStatus:
     def __init__(self, relay_number: int, status: bool):
-        self.relay_number = relay_number
-        self.status = status
+        object.__setattr__(self, "relay_number", relay_number)
+        object.__setattr__(self, "status", status)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __eq__(self, other):
+        if not isinstance(other, SingleRelayStatus):
+            return NotImplemented
+        return self.relay_number == other.relay_number and self.status == other.status
+
+    def __hash__(self):
+        return hash((self.relay_number, self.status))
 
     def __str__(self):
         """String representation of the SingleRelayStatus instance"""
         return "{}".format({"relay_number": self.relay_number, "status": self.status})
 
+    @classmethod
+    def of(cls, relay_number: int, status: bool) -> "SingleRelayStatus":
+        """Return the shared SingleRelayStatus instance"""
+        key = (relay_number, bool(status))
+        instance = cls._instances.get(key)
+        if instance is None:
+            instance = cls._instances.setdefault(key, cls(relay_number=key[0], status=key[1]))
+        return instance
+
     def to_json(self):
         """Return json dict that represents the SingleRelayStatus instance"""
         return {"relay_number": self.relay_number, "status": self.status}
 
+    @staticmethod
     def from_json(dictionary: dict):
         """Return SingleRelayStatus instance from json dict"""
-        return SingleRelayStatus(
+        return SingleRelayStatus.of(
             relay_number=dictionary["relay_number"],
             status=dictionary["status"],
         )
 
 
+# Pre-build the shared instances of the relays of a board
+for _relay_number in range(PREBUILT_RELAYS_NUMBER):
+    SingleRelayStatus.of(_relay_number, False)
+    SingleRelayStatus.of(_relay_number, True)
+
+
 class RelaysStatus:
+    """
+    Relays status, backed either by a list of SingleRelayStatus or by a status mask and a
+    validity mask (bit n for relay n). The other representation is computed lazily, as the
+    timestamp datetime
+    """
+
+    __slots__ = (
+        "_relay_statuses",
+        "_status_mask",
+        "_validity_mask",
+        "command",
+        "_timestamp",
+        "_time",
+        "correlation_id",
+    )
+
     def __init__(
-        self, relay_statuses: Iterable[SingleRelayStatus], command: bool, timestamp: datetime = None
+        self,
+        relay_statuses: Iterable[SingleRelayStatus],
+        command: bool,
+        timestamp: datetime = None,
+        correlation_id: str = None,
     ):
-        self.relay_statuses = relay_statuses
+        if relay_statuses is not None and not isinstance(relay_statuses, (list, tuple)):
+            relay_statuses = list(relay_statuses)
+        self._relay_statuses = relay_statuses
+        self._status_mask = None
+        self._validity_mask = None
         self.command = command
-        self.timestamp = datetime.now() if timestamp is None else timestamp
+        self._timestamp = timestamp
+        self._time = time.time() if timestamp is None else None
+        # Correlation id of the command, echoed in the relays status published after it
+        self.correlation_id = correlation_id
+
+    @classmethod
+    def from_mask(
+        cls,
+        status_mask: int,
+        validity_mask: int,
+        command: bool,
+        timestamp: datetime = None,
+        correlation_id: str = None,
+    ) -> "RelaysStatus":
+        """Return RelaysStatus instance backed by masks"""
+        relays_status = cls(
+            relay_statuses=None,
+            command=command,
+            timestamp=timestamp,
+            correlation_id=correlation_id,
+        )
+        relays_status._status_mask = status_mask & validity_mask
+        relays_status._validity_mask = validity_mask
+        return relays_status
+
+    @property
+    def relay_statuses(self) -> List[SingleRelayStatus]:
+        """Relays statuses, materialized from masks on first access"""
+        if self._relay_statuses is None:
+            status_mask = self._status_mask
+            validity_mask = self._validity_mask
+            self._relay_statuses = [
+                SingleRelayStatus.of(relay_number, status_mask >> relay_number & 1)
+                for relay_number in range(validity_mask.bit_length())
+                if validity_mask >> relay_number & 1
+            ]
+        return self._relay_statuses
+
+    @relay_statuses.setter
+    def relay_statuses(self, relay_statuses: Iterable[SingleRelayStatus]):
+        self._relay_statuses = relay_statuses
+        self._status_mask = None
+        self._validity_mask = None
+
+    def _compute_masks(self):
+        """Compute masks from relays statuses, the last status of a relay wins"""
+        status_mask = 0
+        validity_mask = 0
+        for relay_status in self._relay_statuses:
+            relay_mask = 1 << relay_status.relay_number
+            validity_mask |= relay_mask
+            if relay_status.status:
+                status_mask |= relay_mask
+            else:
+                status_mask &= ~relay_mask
+        self._status_mask = status_mask
+        self._validity_mask = validity_mask
+
+    @property
+    def status_mask(self) -> int:
+        """Mask of the relays ON (bit n for relay n)"""
+        if self._status_mask is None:
+            self._compute_masks()
+        return self._status_mask
+
+    @property
+    def validity_mask(self) -> int:
+        """Mask of the relays whose status is given (bit n for relay n)"""
+        if self._validity_mask is None:
+            self._compute_masks()
+        return self._validity_mask
+
+    @property
+    def timestamp(self) -> datetime:
+        """Message timestamp, the datetime is built on first access"""
+        if self._timestamp is None:
+            self._timestamp = datetime.fromtimestamp(self._time)
+        return self._timestamp
+
+    @timestamp.setter
+    def timestamp(self, timestamp: datetime):
+        self._timestamp = timestamp
+        self._time = None
+
+    def timestamp_ms(self) -> int:
+        """Message timestamp in epoch milliseconds"""
+        if self._time is not None:
+            return int(self._time * 1000)
+        return int(self._timestamp.timestamp() * 1000)
 
     def __str__(self):
         """String representation of the RelaysStatus instance"""
@@ -57,24 +202,113 @@ class RelaysStatus:
                 "relay_statuses": [str(relay_status) for relay_status in self.relay_statuses],
                 "timestamp": self.timestamp.isoformat(),
                 "command": self.command,
+                "correlation_id": self.correlation_id,
             },
         )
 
     def to_json(self):
         """Return json dict that represents the RelaysStatus instance"""
-        return {
+        json_dict = {
             "relay_statuses": [relay_status.to_json() for relay_status in self.relay_statuses],
             "timestamp": self.timestamp.isoformat(),
             "command": self.command,
         }
+        if self.correlation_id is not None:
+            json_dict["correlation_id"] = self.correlation_id
+        return json_dict
 
+    @staticmethod
     def from_json(dictionary: dict):
-        """Return RelaysStatus instance from json dict"""
+        """
+        Return RelaysStatus instance from json dict, the relay statuses whose relay number is not
+        an integer in [0, MAX_RELAYS_NUMBER[ are dropped
+        """
+        relay_statuses = []
+        for single_relay_dict in dictionary["relay_statuses"]:
+            relay_number = single_relay_dict["relay_number"]
+            if (
+                not isinstance(relay_number, int)
+                or isinstance(relay_number, bool)
+                or not 0 <= relay_number < MAX_RELAYS_NUMBER
+            ):
+                logger.warning("Relay status dropped, invalid relay number: %r", relay_number)
+                continue
+            relay_statuses.append(SingleRelayStatus.from_json(single_relay_dict))
         return RelaysStatus(
+            relay_statuses=relay_statuses,
+            command=dictionary["command"],
+            timestamp=dateutil.parser.isoparse(dictionary["timestamp"]),
+            correlation_id=dictionary.get("correlation_id"),
+        )
+
+
+class RelaysScheduleCommand:
+    """
+    Relays schedule command: relay statuses applied at start (or after delay_in_secs), reverted
+    after duration_in_secs if given and repeated every period_in_secs if given
+    """
+
+    __slots__ = (
+        "relay_statuses",
+        "start",
+        "delay_in_secs",
+        "duration_in_secs",
+        "period_in_secs",
+        "timestamp",
+    )
+
+    def __init__(
+        self,
+        relay_statuses: Iterable[SingleRelayStatus],
+        start: datetime = None,
+        delay_in_secs: float = None,
+        duration_in_secs: float = None,
+        period_in_secs: float = None,
+        timestamp: datetime = None,
+    ):
+        self.relay_statuses = list(relay_statuses)
+        self.start = start
+        self.delay_in_secs = delay_in_secs
+        self.duration_in_secs = duration_in_secs
+        self.period_in_secs = period_in_secs
+        self.timestamp = datetime.now() if timestamp is None else timestamp
+
+    def __str__(self):
+        """String representation of the RelaysScheduleCommand instance"""
+        return "{}".format(
+            {
+                "relay_statuses": [str(relay_status) for relay_status in self.relay_statuses],
+                "start": None if self.start is None else self.start.isoformat(),
+                "delay_in_secs": self.delay_in_secs,
+                "duration_in_secs": self.duration_in_secs,
+                "period_in_secs": self.period_in_secs,
+                "timestamp": self.timestamp.isoformat(),
+            },
+        )
+
+    def to_json(self):
+        """Return json dict that represents the RelaysScheduleCommand instance"""
+        return {
+            "relay_statuses": [relay_status.to_json() for relay_status in self.relay_statuses],
+            "start": None if self.start is None else self.start.isoformat(),
+            "delay_in_secs": self.delay_in_secs,
+            "duration_in_secs": self.duration_in_secs,
+            "period_in_secs": self.period_in_secs,
+            "timestamp": self.timestamp.isoformat(),
+        }
+
+    @staticmethod
+    def from_json(dictionary: dict):
+        """Return RelaysScheduleCommand instance from json dict"""
+        start = dictionary.get("start")
+        return RelaysScheduleCommand(
             relay_statuses=[
                 SingleRelayStatus.from_json(single_relay_dict)
                 for single_relay_dict in dictionary["relay_statuses"]
             ],
-            command=dictionary["command"],
+            start=None if start is None else dateutil.parser.isoparse(start),
+            delay_in_secs=dictionary.get("delay_in_secs"),
+            duration_in_secs=dictionary.get("duration_in_secs"),
+            period_in_secs=dictionary.get("period_in_secs"),
             timestamp=dateutil.parser.isoparse(dictionary["timestamp"]),
         )
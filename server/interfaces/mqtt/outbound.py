@@ -0,0 +1,88 @@
+"""
+MQTT outbound messages queue
+
+Messages are buffered until the background sender publishes them. The buffer is bounded (the
+oldest message is dropped when full) and a message published with replace=True supersedes the
+pending message of the same topic
+"""
+
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import List, Optional
+
+
+class MQTTPublishError(Exception):
+    """Error raised to the callers waiting for a message that could not be published"""
+
+
+class OutboundMessage:
+    """Message waiting to be published"""
+
+    __slots__ = ("topic", "payload", "qos", "retain", "replace", "futures", "queued_at")
+
+    def __init__(self, topic: str, payload: bytes, qos: int, retain: bool, replace: bool):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+        self.replace = replace
+        self.futures: List[Future] = [Future()]
+        # Monotonic time the message was queued
+        self.queued_at = time.monotonic()
+
+    def set_result(self, result):
+        """Resolve the futures of the message"""
+        for future in self.futures:
+            if not future.done():
+                future.set_result(result)
+
+    def set_exception(self, exception: Exception):
+        """Fail the futures of the message"""
+        for future in self.futures:
+            if not future.done():
+                future.set_exception(exception)
+
+
+class OutboundQueue:
+    """Bounded queue of outbound messages, not thread safe (protected by the client condition)"""
+
+    max_size: int
+    dropped_messages: int
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.dropped_messages = 0
+        self._messages = deque()
+
+    def __len__(self):
+        return len(self._messages)
+
+    def put(self, message: OutboundMessage) -> Optional[OutboundMessage]:
+        """
+        Put a message in the queue, return the dropped message if any.
+        If message replaces a pending one, the futures are merged and the payload updated in place
+        """
+        if message.replace:
+            for pending_message in self._messages:
+                if pending_message.replace and pending_message.topic == message.topic:
+                    pending_message.payload = message.payload
+                    pending_message.qos = message.qos
+                    pending_message.retain = message.retain
+                    pending_message.futures.extend(message.futures)
+                    return None
+
+        dropped = None
+        if len(self._messages) >= self.max_size:
+            dropped = self._messages.popleft()
+            self.dropped_messages += 1
+        self._messages.append(message)
+        return dropped
+
+    def put_front(self, message: OutboundMessage):
+        """Put back a message that could not be sent"""
+        self._messages.appendleft(message)
+
+    def get(self) -> OutboundMessage:
+        """Get the next message to publish"""
+        return self._messages.popleft()
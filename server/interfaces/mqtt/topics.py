@@ -0,0 +1,154 @@
+"""
+MQTT topics matching
+
+The subscriptions topic filters are stored in a trie of topic levels, a topic is matched against
+the filters with the + (single level) and # (remaining levels) wildcards. The matches of the
+topics received are cached, the cache is reset when a subscription changes
+"""
+
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+SINGLE_LEVEL_WILDCARD = "+"
+MULTI_LEVEL_WILDCARD = "#"
+TOPIC_LEVEL_SEPARATOR = "/"
+
+
+def validate_topic_filter(topic_filter: str):
+    """Raise ValueError if the topic filter is not valid"""
+
+    if not topic_filter:
+        raise ValueError("Empty topic filter")
+    levels = topic_filter.split(TOPIC_LEVEL_SEPARATOR)
+    for index, level in enumerate(levels):
+        if MULTI_LEVEL_WILDCARD in level and (
+            level != MULTI_LEVEL_WILDCARD or index != len(levels) - 1
+        ):
+            raise ValueError(f"Invalid topic filter {topic_filter}: # must be the last level")
+        if SINGLE_LEVEL_WILDCARD in level and level != SINGLE_LEVEL_WILDCARD:
+            raise ValueError(f"Invalid topic filter {topic_filter}: + must be a whole level")
+
+
+class _TopicNode:
+    """Trie node, a topic level"""
+
+    __slots__ = ("children", "topic_filter", "value")
+
+    def __init__(self):
+        self.children: Dict[str, "_TopicNode"] = {}
+        self.topic_filter: Optional[str] = None
+        """ Topic filter ending at this node, None if no filter ends here """
+        self.value: Any = None
+
+
+class TopicTrie:
+    """Topic filters trie, a value is stored for each topic filter"""
+
+    cache_size: int
+
+    def __init__(self, cache_size: int = 1024):
+        self.cache_size = cache_size
+        self._root = _TopicNode()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._cache: Dict[str, Tuple[Tuple[str, Any], ...]] = {}
+
+    def __len__(self):
+        return self._size
+
+    def insert(self, topic_filter: str, value: Any):
+        """Set the value of a topic filter, raise ValueError if the filter is not valid"""
+
+        validate_topic_filter(topic_filter)
+        with self._lock:
+            node = self._root
+            for level in topic_filter.split(TOPIC_LEVEL_SEPARATOR):
+                node = node.children.setdefault(level, _TopicNode())
+            if node.topic_filter is None:
+                self._size += 1
+            node.topic_filter = topic_filter
+            node.value = value
+            self._cache = {}
+
+    def remove(self, topic_filter: str) -> bool:
+        """Remove a topic filter, return False if it was not stored"""
+
+        with self._lock:
+            path = [self._root]
+            levels = topic_filter.split(TOPIC_LEVEL_SEPARATOR)
+            for level in levels:
+                node = path[-1].children.get(level)
+                if node is None:
+                    return False
+                path.append(node)
+            node = path[-1]
+            if node.topic_filter is None:
+                return False
+            node.topic_filter = None
+            node.value = None
+            self._size -= 1
+            # Prune the nodes left without filter nor children
+            for level, parent in zip(reversed(levels), reversed(path[:-1])):
+                child = parent.children[level]
+                if child.topic_filter is not None or child.children:
+                    break
+                del parent.children[level]
+            self._cache = {}
+            return True
+
+    def get(self, topic_filter: str) -> Any:
+        """Get the value of a topic filter (no wildcard matching), None if not stored"""
+
+        node = self._root
+        for level in topic_filter.split(TOPIC_LEVEL_SEPARATOR):
+            node = node.children.get(level)
+            if node is None:
+                return None
+        return node.value
+
+    def match(self, topic: str) -> Tuple[Tuple[str, Any], ...]:
+        """
+        Return the (topic filter, value) of the filters matching the topic, the filters without
+        wildcard at a level come first
+        """
+
+        matches = self._cache.get(topic)
+        if matches is not None:
+            return matches
+        with self._lock:
+            matches = self._match(topic)
+            if len(self._cache) >= self.cache_size:
+                self._cache = {}
+            self._cache[topic] = matches
+        return matches
+
+    def _match(self, topic: str) -> Tuple[Tuple[str, Any], ...]:
+        """Walk the trie along the topic levels"""
+
+        levels = topic.split(TOPIC_LEVEL_SEPARATOR)
+        # Topics starting with $ (broker topics) are not matched by a leading wildcard
+        wildcards_allowed = not topic.startswith("$")
+        matches: List[Tuple[str, Any]] = []
+        stack = [(self._root, 0)]
+        while stack:
+            node, depth = stack.pop()
+            if depth == len(levels):
+                if node.topic_filter is not None:
+                    matches.append((node.topic_filter, node.value))
+                # "a/#" matches "a"
+                child = node.children.get(MULTI_LEVEL_WILDCARD)
+                if child is not None and child.topic_filter is not None:
+                    matches.append((child.topic_filter, child.value))
+                continue
+            if wildcards_allowed or depth > 0:
+                child = node.children.get(MULTI_LEVEL_WILDCARD)
+                if child is not None and child.topic_filter is not None:
+                    matches.append((child.topic_filter, child.value))
+                # Pushed before the exact level, which is walked first
+                child = node.children.get(SINGLE_LEVEL_WILDCARD)
+                if child is not None:
+                    stack.append((child, depth + 1))
+            child = node.children.get(levels[depth])
+            if child is not None:
+                stack.append((child, depth + 1))
+        return tuple(sorted(matches, key=lambda match: MULTI_LEVEL_WILDCARD in match[0]))
@@ -0,0 +1,137 @@
+"""
+Relays bitmask engine
+
+Logical masks use bit n for relay n, hardware bytes use the bit positions given in configuration
+(hardware bytes are handled already inverted, a bit set to 1 means relay ON)
+"""
+
+from typing import Dict, Iterable, List, Tuple
+from server.interfaces.mqtt import SingleRelayStatus
+
+HARDWARE_BYTE_SIZE = 8
+
+
+def bits_in_mask(mask: int) -> List[int]:
+    """Get the bits set in mask, lowest first"""
+    return [bit for bit in range(mask.bit_length()) if mask >> bit & 1]
+
+
+class RelaysBitmask:
+    """Integer bitmask engine used to compute relays commands on logical masks"""
+
+    relays_number: int
+    relays_mask: int
+
+    def __init__(self, relays_number: int):
+        self.relays_number = relays_number
+        self.relays_mask = (1 << self.relays_number) - 1
+
+    def is_valid_relay(self, relay_number: int) -> bool:
+        """Check if the relay number is handled by the engine"""
+        return 0 <= relay_number < self.relays_number
+
+    @staticmethod
+    def is_relay_on(mask: int, relay_number: int) -> bool:
+        """Check if the relay is ON in mask"""
+        return bool(mask >> relay_number & 1)
+
+    def compile(self, relay_statuses: Iterable[SingleRelayStatus]) -> Tuple[int, int]:
+        """
+        Compile relay statuses into (set_mask, clear_mask), the last status of a relay wins and
+        relays not handled by the engine are ignored
+        """
+        set_mask = 0
+        clear_mask = 0
+        for relay_status in relay_statuses:
+            if not self.is_valid_relay(relay_status.relay_number):
+                continue
+            relay_mask = 1 << relay_status.relay_number
+            if relay_status.status:
+                set_mask |= relay_mask
+                clear_mask &= ~relay_mask
+            else:
+                clear_mask |= relay_mask
+                set_mask &= ~relay_mask
+        return set_mask, clear_mask
+
+    def compile_masks(self, status_mask: int, validity_mask: int) -> Tuple[int, int]:
+        """
+        Compile the status and validity masks of a RelaysStatus into (set_mask, clear_mask),
+        relays not handled by the engine are ignored
+        """
+        validity_mask &= self.relays_mask
+        return status_mask & validity_mask, ~status_mask & validity_mask
+
+    @staticmethod
+    def apply(mask: int, set_mask: int, clear_mask: int) -> int:
+        """Apply set and clear masks to mask"""
+        return (mask & ~clear_mask) | set_mask
+
+    def toggle(self, mask: int, toggle_mask: int) -> int:
+        """Toggle the relays of toggle_mask"""
+        return (mask ^ toggle_mask) & self.relays_mask
+
+    def diff(self, mask: int, other_mask: int) -> int:
+        """Get the mask of relays whose status differs"""
+        return (mask ^ other_mask) & self.relays_mask
+
+    def relays_in_mask(self, mask: int) -> List[int]:
+        """Get the relay numbers set in mask"""
+        return [
+            relay_number for relay_number in range(self.relays_number) if mask >> relay_number & 1
+        ]
+
+    def to_dict(self, mask: int) -> Dict[int, bool]:
+        """Get {relay_number: status} dict from mask"""
+        return {
+            relay_number: bool(mask >> relay_number & 1)
+            for relay_number in range(self.relays_number)
+        }
+
+
+class HardwareBitmask(RelaysBitmask):
+    """Bitmask engine of a relays board, maps logical masks to the expander byte"""
+
+    relays_bits: Tuple[int]
+    hardware_relays_mask: int
+
+    def __init__(self, relays_bits: Iterable[int]):
+        self.relays_bits = tuple(relays_bits)
+        if len(set(self.relays_bits)) != len(self.relays_bits) or any(
+            bit not in range(0, HARDWARE_BYTE_SIZE) for bit in self.relays_bits
+        ):
+            raise ValueError(f"Invalid relays bits mapping: {self.relays_bits}")
+        super().__init__(relays_number=len(self.relays_bits))
+
+        self.hardware_relays_mask = 0
+        for bit in self.relays_bits:
+            self.hardware_relays_mask |= 1 << bit
+
+        # Lookup tables, built once: hardware byte -> logical mask, logical mask -> hardware bits
+        self._from_hardware_table = tuple(
+            self._map_bits(raw, self.relays_bits, range(self.relays_number))
+            for raw in range(1 << HARDWARE_BYTE_SIZE)
+        )
+        self._to_hardware_table = tuple(
+            self._map_bits(mask, range(self.relays_number), self.relays_bits)
+            for mask in range(1 << self.relays_number)
+        )
+
+    @staticmethod
+    def _map_bits(value: int, source_bits: Iterable[int], target_bits: Iterable[int]) -> int:
+        """Move each source bit of value to the target bit at the same position"""
+        mapped = 0
+        for source_bit, target_bit in zip(source_bits, target_bits):
+            if value >> source_bit & 1:
+                mapped |= 1 << target_bit
+        return mapped
+
+    def from_hardware(self, raw: int) -> int:
+        """Get logical mask from hardware byte"""
+        return self._from_hardware_table[raw & 0xFF]
+
+    def to_hardware(self, mask: int, raw: int = 0) -> int:
+        """Get hardware byte from logical mask, bits not mapped to relays are kept from raw"""
+        return (raw & ~self.hardware_relays_mask & 0xFF) | self._to_hardware_table[
+            mask & self.relays_mask
+        ]
@@ -0,0 +1,141 @@
+"""
+Relays boards
+
+A board is a PCF8574 style expander driving relays (active low) on an I2C bus. Relays are
+numbered globally in the boards order: the relays of a board are the bits
+[first_relay, first_relay + relays_number) of the global masks
+"""
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, TypeVar
+from server.common.metrics import metrics_registry
+from server.interfaces.i2c import I2CBusBackend
+from .bitmask import HardwareBitmask
+
+logger = logging.getLogger(__name__)
+
+I2C_TRANSACTION_DURATION = metrics_registry.histogram(
+    "relays_i2c_transaction_duration_seconds",
+    "Relays boards I2C transactions duration",
+    ("operation", "board"),
+)
+I2C_ERRORS = metrics_registry.counter(
+    "relays_i2c_errors_total", "Relays boards I2C transactions errors", ("operation", "board")
+)
+
+T = TypeVar("T")
+
+
+class RelaysBoard:
+    """Relays board"""
+
+    name: str
+    bus_number: int
+    address: int
+    first_relay: int
+    bitmask: HardwareBitmask
+    global_relays_mask: int
+
+    def __init__(
+        self,
+        name: str,
+        bus_number: int,
+        address: int,
+        relays_bits: Iterable[int],
+        first_relay: int,
+        bus: I2CBusBackend,
+    ):
+        self.name = name
+        self.bus_number = bus_number
+        self.address = address
+        self.first_relay = first_relay
+        self.bitmask = HardwareBitmask(relays_bits=relays_bits)
+        self.global_relays_mask = self.bitmask.relays_mask << first_relay
+        self.bus = bus
+
+    def __repr__(self):
+        return f"RelaysBoard({self.name}, bus: {self.bus_number}, address: {hex(self.address)})"
+
+    @property
+    def relays_number(self) -> int:
+        """Number of relays of the board"""
+        return self.bitmask.relays_number
+
+    def read_status_raw(self) -> int:
+        """Read relays raw status (bit set to 1 if the relay is ON) from the bus"""
+
+        start = time.perf_counter()
+        try:
+            status_raw = ~self.bus.read_byte(self.address) & 0xFF
+        except OSError:
+            I2C_ERRORS.labels("read", self.name).inc()
+            raise
+        finally:
+            I2C_TRANSACTION_DURATION.labels("read", self.name).observe(time.perf_counter() - start)
+        logger.debug("%s status read from bus: %#x", self, status_raw)
+        return status_raw
+
+    def write_status_raw(self, status_raw: int):
+        """Write relays raw status (bit set to 1 if the relay is ON)"""
+
+        raw_command = ~status_raw & 0xFF
+        logger.debug("%s raw command: %s", self, raw_command)
+        start = time.perf_counter()
+        try:
+            self.bus.write_byte(self.address, raw_command)
+        except OSError:
+            I2C_ERRORS.labels("write", self.name).inc()
+            raise
+        finally:
+            I2C_TRANSACTION_DURATION.labels("write", self.name).observe(time.perf_counter() - start)
+
+    def to_global_mask(self, status_raw: int) -> int:
+        """Get the global mask of the board relays from its raw status"""
+        return self.bitmask.from_hardware(status_raw) << self.first_relay
+
+    def to_status_raw(self, global_mask: int, status_raw: int) -> int:
+        """Get the raw status of the board from the global mask"""
+        return self.bitmask.to_hardware(global_mask >> self.first_relay, status_raw)
+
+
+class RelaysBoardsExecutor:
+    """Runs the operations of the boards of different buses in parallel"""
+
+    def __init__(self, boards: Iterable[RelaysBoard]):
+        bus_numbers = {board.bus_number for board in boards}
+        self._executor = (
+            ThreadPoolExecutor(max_workers=len(bus_numbers), thread_name_prefix="relays-bus")
+            if len(bus_numbers) > 1
+            else None
+        )
+
+    def run(
+        self, boards: Iterable[RelaysBoard], operation: Callable[[RelaysBoard], T]
+    ) -> Dict[RelaysBoard, T]:
+        """
+        Run operation on each board, sequentially for the boards of the same bus and in
+        parallel for the different buses. The first error raised is propagated
+        """
+        boards_by_bus: Dict[int, List[RelaysBoard]] = {}
+        for board in boards:
+            boards_by_bus.setdefault(board.bus_number, []).append(board)
+
+        def run_bus(bus_boards: List[RelaysBoard]):
+            return [(board, operation(board)) for board in bus_boards]
+
+        if self._executor is None or len(boards_by_bus) <= 1:
+            return {
+                board: result
+                for bus_boards in boards_by_bus.values()
+                for board, result in run_bus(bus_boards)
+            }
+
+        futures = [
+            self._executor.submit(run_bus, bus_boards) for bus_boards in boards_by_bus.values()
+        ]
+        results = {}
+        for future in futures:
+            results.update(future.result())
+        return results
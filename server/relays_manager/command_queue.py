@@ -0,0 +1,321 @@
+"""
+Inbound relays commands queue
+
+Commands are applied by a dedicated worker, a command received alone is applied at once. When
+several commands are pending (burst), the commands received within the coalescing window are
+merged (latest status wins for each relay) and applied at once. When the queue is
+full, a command received is merged into the newest pending command (no relay change is lost).
+The commands redelivered (QoS 1 duplicates) are dropped on reception, and the relays of a command
+older than the last command applied to them (delivered late) are discarded. Both checks rely on
+the sender timestamp, the commands timestamped on reception (panel clock) are not checked
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, Hashable, Iterable, List, Optional, Tuple
+from server.common.metrics import metrics_registry
+from server.common.tracing import tracer
+from server.interfaces.mqtt import RelaysStatus
+
+logger = logging.getLogger(__name__)
+
+COMMANDS_QUEUE_DEPTH = metrics_registry.gauge(
+    "relays_commands_queue_depth", "Relays commands received waiting to be applied"
+)
+COMMANDS_DROPPED = metrics_registry.counter(
+    "relays_commands_dropped_total", "Relays commands dropped, commands queue stopping"
+)
+COMMANDS_COALESCED = metrics_registry.counter(
+    "relays_commands_coalesced_total", "Relays commands merged with a later command"
+)
+COMMAND_PROCESSING_DURATION = metrics_registry.histogram(
+    "relays_command_processing_seconds", "Relays command processing duration"
+)
+COMMANDS_DUPLICATED = metrics_registry.counter(
+    "relays_commands_duplicated_total", "Relays commands dropped, already received"
+)
+COMMANDS_STALE = metrics_registry.counter(
+    "relays_commands_stale_total",
+    "Relays commands (partially) discarded, older than the last command applied to the relays",
+)
+COMMAND_LATENCY = metrics_registry.histogram(
+    "relays_command_latency_seconds",
+    "Relays commands latency from reception to actuation (oldest command of a merged batch)",
+)
+
+
+def merge_relays_commands(commands: Iterable[RelaysStatus]) -> RelaysStatus:
+    """
+    Merge relays commands in a single one, the latest status of each relay wins. The merged
+    command has the correlation id of the latest command
+    """
+
+    status_mask = 0
+    validity_mask = 0
+    timestamp = None
+    correlation_id = None
+    for command in commands:
+        command_validity_mask = command.validity_mask
+        status_mask = (status_mask & ~command_validity_mask) | command.status_mask
+        validity_mask |= command_validity_mask
+        timestamp = command.timestamp
+        correlation_id = command.correlation_id or correlation_id
+
+    return RelaysStatus.from_mask(
+        status_mask=status_mask,
+        validity_mask=validity_mask,
+        command=True,
+        timestamp=timestamp,
+        correlation_id=correlation_id,
+    )
+
+
+def command_key(command: RelaysStatus) -> Tuple[int, int, int]:
+    """
+    Key identifying a command: its sender timestamp and masks, a redelivered message has the
+    same key (the correlation id is generated on reception when the sender gave none)
+    """
+    return command.timestamp_ms(), command.validity_mask, command.status_mask
+
+
+class RecentCommands:
+    """Bounded LRU of the keys of the commands (or messages) received"""
+
+    max_size: int
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._keys: "OrderedDict[Hashable, None]" = OrderedDict()
+
+    def add(self, key: Hashable) -> bool:
+        """Add a key, return False if it was already known"""
+
+        with self._lock:
+            if key in self._keys:
+                self._keys.move_to_end(key)
+                return False
+            self._keys[key] = None
+            if len(self._keys) > self.max_size:
+                self._keys.popitem(last=False)
+            return True
+
+
+def discard_stale_relays(
+    commands: Iterable[RelaysStatus], relays_timestamps: Dict[int, int]
+) -> List[RelaysStatus]:
+    """
+    Remove from the commands (in reception order) the relays already set by a more recent command,
+    relays_timestamps (relay number: timestamp in ms of the last command applied) is updated.
+    The commands without relay left are removed
+    """
+
+    fresh_commands = []
+    for command in commands:
+        timestamp_ms = command.timestamp_ms()
+        validity_mask = command.validity_mask
+        fresh_validity_mask = validity_mask
+        relay_number = 0
+        mask = validity_mask
+        while mask:
+            if mask & 1:
+                if timestamp_ms < relays_timestamps.get(relay_number, timestamp_ms):
+                    fresh_validity_mask &= ~(1 << relay_number)
+                else:
+                    relays_timestamps[relay_number] = timestamp_ms
+            mask >>= 1
+            relay_number += 1
+
+        if fresh_validity_mask != validity_mask:
+            COMMANDS_STALE.inc()
+            logger.warning(
+                "Stale relays command, relays %#x discarded: %s",
+                validity_mask & ~fresh_validity_mask,
+                command,
+            )
+            if not fresh_validity_mask:
+                continue
+            command = RelaysStatus.from_mask(
+                status_mask=command.status_mask,
+                validity_mask=fresh_validity_mask,
+                command=True,
+                timestamp=command.timestamp,
+                correlation_id=command.correlation_id,
+            )
+        fresh_commands.append(command)
+    return fresh_commands
+
+
+class RelaysCommandQueue:
+    """Bounded queue of relays commands, drained by a dedicated worker thread"""
+
+    max_size: int
+    coalescing_window_in_secs: float
+
+    def __init__(
+        self,
+        apply_command: Callable[[RelaysStatus], None],
+        max_size: int = 64,
+        coalescing_window_in_secs: float = 0.05,
+        deduplication_size: int = 256,
+        discard_stale: bool = True,
+    ):
+        """
+        The last deduplication_size commands received are remembered to drop the duplicates (0
+        disables the deduplication)
+        """
+        self.max_size = max_size
+        self.coalescing_window_in_secs = coalescing_window_in_secs
+        self.discard_stale = discard_stale
+        self._apply_command = apply_command
+        self._recent_commands = RecentCommands(deduplication_size) if deduplication_size else None
+        # Relay number: sender timestamp (ms) of the last command applied
+        self._relays_timestamps: Dict[int, int] = {}
+        self._condition = threading.Condition()
+        # Items: (monotonic reception time, command, timestamped by its sender)
+        self._pending: Deque[Tuple[float, RelaysStatus, bool]] = deque()
+        self._stopping = False
+        self._worker = None
+        COMMANDS_QUEUE_DEPTH.set_function(self.qsize)
+
+    def start(self):
+        """Start the worker thread"""
+
+        if self._worker is not None and self._worker.is_alive():
+            return
+        self._worker = threading.Thread(target=self._run, name="relays-commands", daemon=True)
+        self._worker.start()
+        logger.info("Relays commands worker started")
+
+    def stop(self):
+        """Stop the worker thread once the pending commands are applied"""
+
+        if self._worker is None:
+            return
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        self._worker.join()
+        self._worker = None
+        with self._condition:
+            self._stopping = False
+
+    def put(self, command: RelaysStatus, sender_clock: bool = True):
+        """
+        Enqueue a command, merged into the newest pending command if the queue is full (the
+        changes of every relay are kept). A command already received is dropped. sender_clock is
+        False for the commands timestamped on reception, not deduplicated nor checked as stale
+        (their timestamp is not comparable with the senders timestamps)
+        """
+
+        if (
+            sender_clock
+            and self._recent_commands is not None
+            and not self._recent_commands.add(command_key(command))
+        ):
+            COMMANDS_DUPLICATED.inc()
+            logger.info("Duplicated relays command dropped: %s", command)
+            return
+
+        received_at = time.monotonic()
+        with self._condition:
+            if self._stopping:
+                COMMANDS_DROPPED.inc()
+                logger.warning("Relays commands queue stopping, command dropped: %s", command)
+                return
+            if len(self._pending) < self.max_size:
+                self._pending.append((received_at, command, sender_clock))
+                self._condition.notify_all()
+                return
+            newest_received_at, newest, newest_sender_clock = self._pending[-1]
+            merged_command = merge_relays_commands((newest, command))
+            # Not checked as stale if a command is timestamped on reception
+            self._pending[-1] = (
+                newest_received_at,
+                merged_command,
+                newest_sender_clock and sender_clock,
+            )
+        COMMANDS_COALESCED.inc()
+        logger.warning("Relays commands queue full, command merged: %s", command)
+        if newest.correlation_id != merged_command.correlation_id:
+            tracer.record_monotonic(
+                newest.correlation_id,
+                "command.queue",
+                newest_received_at,
+                received_at,
+                merged_into=merged_command.correlation_id,
+                coalesced=2,
+            )
+
+    def qsize(self) -> int:
+        """Number of pending commands"""
+        return len(self._pending)
+
+    def _next_items(self) -> List[Tuple[float, RelaysStatus, bool]]:
+        """
+        Wait for pending items, return them (empty once stopping and drained). A command pending
+        alone is returned at once, during a burst the items received within the coalescing window
+        are collected (at most max_size)
+        """
+
+        with self._condition:
+            while not self._pending and not self._stopping:
+                self._condition.wait()
+            if len(self._pending) > 1:
+                deadline = time.monotonic() + self.coalescing_window_in_secs
+                while len(self._pending) < self.max_size and not self._stopping:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(timeout=remaining)
+            items = list(self._pending)
+            self._pending.clear()
+            return items
+
+    def _run(self):
+        """Worker loop"""
+
+        while True:
+            items = self._next_items()
+            if not items:
+                break
+            if len(items) > 1:
+                COMMANDS_COALESCED.inc(len(items) - 1)
+                logger.info("%d relays commands coalesced", len(items))
+            start = time.monotonic()
+            commands = [command for _, command, _ in items]
+            relays_timestamps: Optional[Dict[int, int]] = None
+            if self.discard_stale:
+                # Committed once the command is applied
+                relays_timestamps = dict(self._relays_timestamps)
+                commands = []
+                for _, command, sender_clock in items:
+                    if sender_clock:
+                        commands.extend(discard_stale_relays((command,), relays_timestamps))
+                    else:
+                        commands.append(command)
+            merged_command = merge_relays_commands(commands) if commands else None
+            for received_at, command, _ in items:
+                tracer.record_monotonic(
+                    command.correlation_id,
+                    "command.queue",
+                    received_at,
+                    start,
+                    merged_into=merged_command.correlation_id if merged_command else None,
+                    coalesced=len(items),
+                )
+            if merged_command is None:
+                continue
+            try:
+                self._apply_command(merged_command)
+            except Exception:
+                logger.exception("Relays command processing failed")
+                continue
+            finally:
+                end = time.monotonic()
+                COMMAND_PROCESSING_DURATION.observe(end - start)
+            if relays_timestamps is not None:
+                self._relays_timestamps = relays_timestamps
+            COMMAND_LATENCY.observe(end - items[0][0])
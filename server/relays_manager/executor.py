@@ -0,0 +1,262 @@
+"""
+Single writer relays I2C executor
+
+All the bus transactions are made by one owner thread, which applies the commands in order
+(no lost update between concurrent commands) and publishes the relays state as an immutable,
+versioned snapshot. Readers get the last snapshot without lock and without bus access
+"""
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, NamedTuple, Optional, Tuple
+from server.common.metrics import metrics_registry
+from server.common.tracing import tracer
+from .board import RelaysBoard, RelaysBoardsExecutor
+from .history import STATE_SOURCE_BUS, STATE_SOURCE_COMMAND
+
+logger = logging.getLogger(__name__)
+
+I2C_WRITES_SKIPPED = metrics_registry.counter(
+    "relays_i2c_writes_skipped_total", "Boards writes skipped, the board already had the status"
+)
+
+
+class RelaysState(NamedTuple):
+    """Immutable relays state snapshot"""
+
+    version: int
+    """ Incremented each time the relays status changes """
+    status_mask: int
+    """ Global mask of the relays ON (bit n for relay n) """
+    boards_status_raw: Tuple[int, ...]
+    """ Raw status of each board, in the boards order """
+    timestamp: float
+    """ Epoch time of the last status change """
+    verified_at: float
+    """ Monotonic time of the last bus access """
+
+    def to_json(self) -> dict:
+        """Return compact json dict that represents the RelaysState instance"""
+        return {
+            "version": self.version,
+            "status_mask": self.status_mask,
+            "timestamp_ms": int(self.timestamp * 1000),
+        }
+
+
+class RelaysI2CExecutor:
+    """Owner of the relays boards buses"""
+
+    def __init__(
+        self,
+        boards: List[RelaysBoard],
+        revalidation_period_in_secs: float = 0,
+        on_state_change: Optional[Callable[[RelaysState, str], None]] = None,
+    ):
+        """
+        The boards are read back from the bus when no command was applied during
+        revalidation_period_in_secs (disabled if 0). on_state_change(state, source) is called by
+        the owner thread on each status change, the source is STATE_SOURCE_COMMAND or
+        STATE_SOURCE_BUS
+        """
+        self.boards = boards
+        self.revalidation_period_in_secs = revalidation_period_in_secs
+        self._on_state_change = on_state_change
+        self._boards_executor = RelaysBoardsExecutor(boards)
+        self._operations = queue.SimpleQueue()
+        self._state: Optional[RelaysState] = None
+        self._state_changed = threading.Condition()
+        self._thread = None
+
+    @property
+    def state(self) -> RelaysState:
+        """Last relays state snapshot"""
+        return self._state
+
+    def wait_for_change(self, version: Optional[int], timeout: float) -> Optional[RelaysState]:
+        """
+        Wait until the state version differs from version (or timeout), return the last state
+        """
+        with self._state_changed:
+            self._state_changed.wait_for(
+                lambda: self._state is not None and self._state.version != version, timeout
+            )
+            return self._state
+
+    def start(self):
+        """Start the owner thread, the state is available once the boards were first read"""
+
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="relays-i2c", daemon=True)
+        self._thread.start()
+        logger.info("Relays I2C executor started")
+
+    def is_alive(self) -> bool:
+        """Check if the owner thread is running"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def stop(self):
+        """Stop the owner thread, once the submitted operations are done"""
+
+        if self._thread is not None:
+            self._operations.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def apply(self, set_mask: int, clear_mask: int, correlation_id: Optional[str] = None) -> Future:
+        """
+        Set the relays of set_mask ON and the relays of clear_mask OFF. The future result is the
+        (new state, mask of the relays that changed of status)
+        """
+
+        submitted_at = time.monotonic()
+
+        def operation():
+            tracer.record_monotonic(correlation_id, "i2c.queue", submitted_at, time.monotonic())
+            return self._apply(set_mask, clear_mask, correlation_id)
+
+        return self._submit(operation)
+
+    def refresh(self) -> Future:
+        """Read all boards from the bus, the future result is the new state"""
+        return self._submit(self._refresh)
+
+    def _submit(self, operation: Callable) -> Future:
+        """Submit an operation to the owner thread"""
+        future = Future()
+        self._operations.put((operation, future))
+        return future
+
+    def _publish(self, boards_status_raw: Tuple[int, ...], source: str) -> RelaysState:
+        """Publish the state snapshot of the boards raw status"""
+
+        now = time.monotonic()
+        current_state = self._state
+        if current_state is not None and current_state.boards_status_raw == boards_status_raw:
+            # Same status, the version is kept
+            state = current_state._replace(verified_at=now)
+            self._state = state
+            return state
+
+        status_mask = 0
+        for board, status_raw in zip(self.boards, boards_status_raw):
+            status_mask |= board.to_global_mask(status_raw)
+        state = RelaysState(
+            version=0 if current_state is None else current_state.version + 1,
+            status_mask=status_mask,
+            boards_status_raw=boards_status_raw,
+            timestamp=time.time(),
+            verified_at=now,
+        )
+        # Readers see either the previous or the new snapshot, the waiters are woken up
+        with self._state_changed:
+            self._state = state
+            self._state_changed.notify_all()
+        if self._on_state_change is not None:
+            try:
+                self._on_state_change(state, source)
+            except Exception:
+                logger.exception("Relays state change callback failed")
+        return state
+
+    def _refresh(self) -> RelaysState:
+        """Read all boards from the bus"""
+
+        boards_status_raw = self._boards_executor.run(
+            self.boards, lambda board: board.read_status_raw()
+        )
+        return self._publish(
+            tuple(boards_status_raw[board] for board in self.boards), STATE_SOURCE_BUS
+        )
+
+    def _apply(
+        self, set_mask: int, clear_mask: int, correlation_id: Optional[str] = None
+    ) -> Tuple[RelaysState, int]:
+        """Apply a command from the current state, only the targeted boards are written"""
+
+        state = self._state
+        if state is None:
+            raise RuntimeError("Relays boards not read yet")
+        targeted_mask = set_mask | clear_mask
+        boards_status_raw = list(state.boards_status_raw)
+        serial_commands = {}
+        for index, board in enumerate(self.boards):
+            board_relays_mask = board.global_relays_mask
+            if not board_relays_mask & targeted_mask:
+                continue
+            current_status_raw = boards_status_raw[index]
+            current_mask = board.to_global_mask(current_status_raw)
+            new_mask = board.bitmask.apply(
+                current_mask, set_mask & board_relays_mask, clear_mask & board_relays_mask
+            )
+            new_status_raw = board.to_status_raw(new_mask, current_status_raw)
+            if new_status_raw == current_status_raw:
+                # The board already has the target status
+                I2C_WRITES_SKIPPED.inc()
+                continue
+            boards_status_raw[index] = new_status_raw
+            serial_commands[board] = new_status_raw
+
+        if not serial_commands:
+            logger.info("Relays already in the target status, no serial command")
+            return state, 0
+
+        logger.info("Sending serial commands: %s", serial_commands)
+        # Write serial commands, the different buses in parallel
+        write_start = time.monotonic()
+        self._boards_executor.run(
+            serial_commands.keys(), lambda board: board.write_status_raw(serial_commands[board])
+        )
+        tracer.record_monotonic(
+            correlation_id,
+            "i2c.write",
+            write_start,
+            time.monotonic(),
+            boards=[board.name for board in serial_commands],
+        )
+
+        new_state = self._publish(tuple(boards_status_raw), STATE_SOURCE_COMMAND)
+        return new_state, state.status_mask ^ new_state.status_mask
+
+    def _revalidate(self) -> bool:
+        """Read back all boards, return False if the bus read failed"""
+
+        try:
+            self._refresh()
+            return True
+        except Exception:
+            logger.exception("Relays status revalidation failed")
+            return False
+
+    def _run(self):
+        """Owner thread loop"""
+
+        revalidate = False
+        while True:
+            if revalidate:
+                revalidate = not self._revalidate()
+            try:
+                item = self._operations.get(timeout=self.revalidation_period_in_secs or None)
+            except queue.Empty:
+                # Idle: check the expanders were not changed out of the executor
+                revalidate = True
+                continue
+
+            if item is None:
+                break
+            operation, future = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            if revalidate:
+                # The last read back failed, the operation must not start from a stale state
+                revalidate = not self._revalidate()
+            try:
+                future.set_result(operation())
+            except Exception as error:
+                # The boards state is unknown after a failed transaction
+                revalidate = True
+                future.set_exception(error)
@@ -0,0 +1,165 @@
+"""
+Relays state history
+
+The relays status transitions (timestamp, status mask, source) are kept in a fixed capacity ring
+buffer backed by arrays (about 10 bytes per transition), the oldest transitions are overwritten
+when it is full. The history is queried by time window, as transitions or as per relay duty
+cycles downsampled into buckets
+"""
+
+import threading
+from array import array
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+STATE_SOURCE_COMMAND = "command"
+""" Status set by a relays command """
+STATE_SOURCE_BUS = "bus"
+""" Status read from the bus (startup, revalidation, change made out of the service) """
+STATE_SOURCES = (STATE_SOURCE_COMMAND, STATE_SOURCE_BUS)
+
+
+class RelaysTransition(NamedTuple):
+    """Relays status transition"""
+
+    timestamp: float
+    """ Epoch time """
+    status_mask: int
+    source: str
+
+
+class RelaysHistory:
+    """Fixed capacity ring buffer of the relays status transitions"""
+
+    capacity: int
+
+    def __init__(self, capacity: int, relays_number: int):
+        self.capacity = capacity
+        # Smallest unsigned type holding the status mask
+        if relays_number <= 8:
+            mask_typecode = "B"
+        elif relays_number <= 16:
+            mask_typecode = "H"
+        elif relays_number <= 32:
+            mask_typecode = "L"
+        else:
+            mask_typecode = "Q"
+        self._timestamps = array("d", [0.0]) * capacity
+        self._masks = array(mask_typecode, [0]) * capacity
+        self._sources = array("B", [0]) * capacity
+        self._start = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def size_in_bytes(self) -> int:
+        """Memory used by the arrays"""
+        return sum(
+            len(values) * values.itemsize
+            for values in (self._timestamps, self._masks, self._sources)
+        )
+
+    def record(self, timestamp: float, status_mask: int, source: str):
+        """Record a transition, ignored if the status did not change"""
+
+        with self._lock:
+            if self._count and self._masks[self._index(self._count - 1)] == status_mask:
+                return
+            if self._count < self.capacity:
+                index = self._index(self._count)
+                self._count += 1
+            else:
+                # Overwrite the oldest transition
+                index = self._start
+                self._start = (self._start + 1) % self.capacity
+            self._timestamps[index] = timestamp
+            self._masks[index] = status_mask
+            self._sources[index] = STATE_SOURCES.index(source)
+
+    def _index(self, position: int) -> int:
+        """Array index of the transition at position (0 is the oldest)"""
+        return (self._start + position) % self.capacity
+
+    def _transition(self, position: int) -> RelaysTransition:
+        """Transition at position"""
+        index = self._index(position)
+        return RelaysTransition(
+            self._timestamps[index], self._masks[index], STATE_SOURCES[self._sources[index]]
+        )
+
+    def _first_position_after(self, timestamp: float) -> int:
+        """Position of the first transition after timestamp (binary search)"""
+
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._timestamps[self._index(middle)] <= timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def get_transitions(
+        self, start: float, end: float
+    ) -> Tuple[Optional[RelaysTransition], List[RelaysTransition]]:
+        """
+        Return the transition in effect at start (None if older than the history) and the
+        transitions of the window ]start, end]
+        """
+
+        with self._lock:
+            first = self._first_position_after(start)
+            last = self._first_position_after(end)
+            initial = self._transition(first - 1) if first > 0 else None
+            return initial, [self._transition(position) for position in range(first, last)]
+
+    def get_duty_cycles(
+        self, start: float, end: float, buckets_number: int, relay_numbers: List[int]
+    ) -> Dict[int, List[Optional[float]]]:
+        """
+        Downsample the window [start, end] into buckets_number buckets, return for each relay
+        the fraction of time it was ON in each bucket (None if the status is unknown during the
+        whole bucket, the time before the history is not accounted)
+        """
+
+        initial, transitions = self.get_transitions(start, end)
+        bucket_in_secs = (end - start) / buckets_number
+        on_secs = {relay_number: [0.0] * buckets_number for relay_number in relay_numbers}
+        known_secs = [0.0] * buckets_number
+
+        # Segments of constant status
+        segments = []
+        if initial is not None:
+            segments.append((start, initial.status_mask))
+        segments.extend(
+            (transition.timestamp, transition.status_mask) for transition in transitions
+        )
+        for segment_index, (segment_start, status_mask) in enumerate(segments):
+            segment_end = (
+                segments[segment_index + 1][0] if segment_index + 1 < len(segments) else end
+            )
+            relays_on = [
+                relay_number for relay_number in relay_numbers if status_mask >> relay_number & 1
+            ]
+            bucket = min(int((segment_start - start) / bucket_in_secs), buckets_number - 1)
+            while bucket < buckets_number:
+                bucket_start = start + bucket * bucket_in_secs
+                overlap = min(segment_end, bucket_start + bucket_in_secs) - max(
+                    segment_start, bucket_start
+                )
+                if overlap <= 0 and bucket_start >= segment_end:
+                    break
+                if overlap > 0:
+                    known_secs[bucket] += overlap
+                    for relay_number in relays_on:
+                        on_secs[relay_number][bucket] += overlap
+                bucket += 1
+
+        return {
+            relay_number: [
+                on / known if known > 0 else None for on, known in zip(relay_on_secs, known_secs)
+            ]
+            for relay_number, relay_on_secs in on_secs.items()
+        }
@@ -0,0 +1,283 @@
+"""
+Relays state journal
+
+Each relays state applied is appended to the journal as a fixed size record (sequence,
+timestamp, status mask, CRC32). Records are written and synced by a background thread, at most
+once per fsync period (the records of the period are written at once). When the journal is too
+long, it is compacted to its last record. On restart, the journal is read through a memory
+mapping and the last valid record gives the relays state to restore; a torn or corrupted tail is
+truncated
+"""
+
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Dict, List, NamedTuple, Optional
+from server.common.metrics import metrics_registry
+from .bitmask import RelaysBitmask
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_HEADER = b"RLYJRNL1"
+# Sequence, timestamp (epoch ms), status mask, CRC32 of the previous fields
+JOURNAL_RECORD = struct.Struct("<QQQI")
+JOURNAL_RECORD_DATA = struct.Struct("<QQQ")
+
+JOURNAL_SYNC_DURATION = metrics_registry.histogram(
+    "relays_journal_sync_seconds", "Relays state journal write and fsync duration"
+)
+JOURNAL_COMPACTIONS = metrics_registry.counter(
+    "relays_journal_compactions_total", "Relays state journal compactions"
+)
+
+
+class JournalRecord(NamedTuple):
+    """Relays state journal record"""
+
+    sequence: int
+    timestamp_ms: int
+    status_mask: int
+
+    def pack(self) -> bytes:
+        """Return the record bytes"""
+        data = JOURNAL_RECORD_DATA.pack(self.sequence, self.timestamp_ms, self.status_mask)
+        return data + struct.pack("<I", zlib.crc32(data))
+
+
+class RelaysStateJournal:
+    """Append only relays state journal, synced in batches by a writer thread"""
+
+    path: str
+    fsync_period_in_secs: float
+    max_records: int
+
+    def __init__(self, path: str, fsync_period_in_secs: float = 1.0, max_records: int = 4096):
+        self.path = path
+        self.fsync_period_in_secs = fsync_period_in_secs
+        self.max_records = max_records
+        self.last_record: Optional[JournalRecord] = None
+        self._records_number = 0
+        self._condition = threading.Condition()
+        self._pending: List[JournalRecord] = []
+        self._running = False
+        self._thread = None
+        self._fd = None
+
+    def recover(self) -> Optional[JournalRecord]:
+        """
+        Read the journal, return its last valid record (None if the journal is empty or missing)
+        and truncate the records after it
+        """
+
+        last_record = None
+        valid_size = len(JOURNAL_HEADER)
+        records_number = 0
+        try:
+            with open(self.path, "rb") as journal_file:
+                size = os.fstat(journal_file.fileno()).st_size
+                if size >= len(JOURNAL_HEADER):
+                    with mmap.mmap(journal_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                        if data[: len(JOURNAL_HEADER)] != JOURNAL_HEADER:
+                            logger.error("Invalid relays state journal header, journal reset")
+                            valid_size = 0
+                        else:
+                            offset = len(JOURNAL_HEADER)
+                            while offset + JOURNAL_RECORD.size <= size:
+                                (
+                                    sequence,
+                                    timestamp_ms,
+                                    status_mask,
+                                    crc,
+                                ) = JOURNAL_RECORD.unpack_from(data, offset)
+                                record_data = data[offset : offset + JOURNAL_RECORD_DATA.size]
+                                if zlib.crc32(record_data) != crc or (
+                                    last_record is not None and sequence <= last_record.sequence
+                                ):
+                                    break
+                                last_record = JournalRecord(sequence, timestamp_ms, status_mask)
+                                records_number += 1
+                                offset += JOURNAL_RECORD.size
+                            valid_size = offset
+                else:
+                    valid_size = 0
+                if valid_size != size:
+                    logger.warning(
+                        "Relays state journal truncated from %d to %d bytes", size, valid_size
+                    )
+        except FileNotFoundError:
+            valid_size = 0
+
+        self._open(valid_size)
+        self._records_number = records_number
+        self.last_record = last_record
+        logger.info("Relays state journal recovered, last record: %s", last_record)
+        return last_record
+
+    def _open(self, valid_size: int):
+        """Open the journal for appending, truncated to valid_size (created if empty)"""
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        os.ftruncate(self._fd, valid_size)
+        if valid_size == 0:
+            os.write(self._fd, JOURNAL_HEADER)
+        os.lseek(self._fd, 0, os.SEEK_END)
+        os.fsync(self._fd)
+
+    def start(self):
+        """Start the writer thread, the journal must be recovered first"""
+
+        if self._fd is None:
+            self.recover()
+        with self._condition:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="relays-journal", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the writer thread, the pending records are written"""
+
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def append(self, status_mask: int):
+        """Append a relays state, written by the writer thread within the fsync period"""
+
+        with self._condition:
+            last_record = self.last_record
+            if last_record is not None and last_record.status_mask == status_mask:
+                return
+            self.last_record = JournalRecord(
+                sequence=last_record.sequence + 1 if last_record is not None else 1,
+                timestamp_ms=int(time.time() * 1000),
+                status_mask=status_mask,
+            )
+            self._pending.append(self.last_record)
+            self._condition.notify_all()
+
+    def _run(self):
+        """Writer loop"""
+
+        last_sync = 0.0
+        while True:
+            with self._condition:
+                while self._running and not self._pending:
+                    self._condition.wait()
+                # Records appended until the end of the fsync period are synced together
+                while self._running:
+                    delay = last_sync + self.fsync_period_in_secs - time.monotonic()
+                    if delay <= 0:
+                        break
+                    self._condition.wait(timeout=delay)
+                records, self._pending = self._pending, []
+                running = self._running
+
+            if records:
+                try:
+                    self._write(records)
+                except OSError:
+                    logger.exception("Relays state journal write failed")
+                last_sync = time.monotonic()
+            if not running:
+                return
+
+    def _write(self, records: List[JournalRecord]):
+        """Write and sync the records, compact the journal if it is too long"""
+
+        start = time.perf_counter()
+        if self._records_number + len(records) > self.max_records:
+            self._compact(records[-1])
+        else:
+            os.write(self._fd, b"".join(record.pack() for record in records))
+            os.fsync(self._fd)
+            self._records_number += len(records)
+        JOURNAL_SYNC_DURATION.observe(time.perf_counter() - start)
+
+    def _compact(self, last_record: JournalRecord):
+        """Replace the journal by a journal of its last record"""
+
+        compacted_path = self.path + ".compact"
+        fd = os.open(compacted_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.write(fd, JOURNAL_HEADER + last_record.pack())
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(compacted_path, self.path)
+        os.close(self._fd)
+        self._fd = os.open(self.path, os.O_RDWR)
+        os.lseek(self._fd, 0, os.SEEK_END)
+        # Sync the directory entry of the new journal
+        directory_fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
+        self._records_number = 1
+        JOURNAL_COMPACTIONS.inc()
+        logger.info("Relays state journal compacted")
+
+
+RESTORE_POLICY_LAST = "last"
+RESTORE_POLICY_OFF = "force_off"
+RESTORE_POLICY_ON = "force_on"
+RESTORE_POLICIES = (RESTORE_POLICY_LAST, RESTORE_POLICY_OFF, RESTORE_POLICY_ON)
+
+
+class RelaysRestorePolicy:
+    """Relays status restored on startup, compiled into masks"""
+
+    __slots__ = ("restore_mask", "on_mask")
+
+    def __init__(self, restore_mask: int, on_mask: int):
+        self.restore_mask = restore_mask
+        """ Relays restored to their last status """
+        self.on_mask = on_mask
+        """ Relays set ON, the others are set OFF """
+
+    def initial_status_mask(self, last_status_mask: Optional[int]) -> int:
+        """Initial relays status mask, the relays restored are set OFF without last status"""
+        return ((last_status_mask or 0) & self.restore_mask) | self.on_mask
+
+
+def compile_relays_restore_policy(
+    default_policy: str, relays_policies: Dict[int, str], relays_bitmask: RelaysBitmask
+) -> RelaysRestorePolicy:
+    """
+    Compile the restore policy of the relays (last, force_off or force_on), relays_policies
+    overrides the default policy of some relays. Raise ValueError if a relay or a policy is not
+    valid
+    """
+
+    restore_mask = 0
+    on_mask = 0
+    policies = {
+        relay_number: default_policy for relay_number in range(relays_bitmask.relays_number)
+    }
+    for relay_number, policy in (relays_policies or {}).items():
+        if not relays_bitmask.is_valid_relay(relay_number):
+            raise ValueError(f"Relays restore policy: invalid relay number {relay_number}")
+        policies[relay_number] = policy
+    for relay_number, policy in policies.items():
+        if policy not in RESTORE_POLICIES:
+            raise ValueError(f"Relay {relay_number}: invalid restore policy {policy}")
+        if policy == RESTORE_POLICY_LAST:
+            restore_mask |= 1 << relay_number
+        elif policy == RESTORE_POLICY_ON:
+            on_mask |= 1 << relay_number
+    return RelaysRestorePolicy(restore_mask=restore_mask, on_mask=on_mask)
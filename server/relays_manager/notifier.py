@@ -0,0 +1,125 @@
+"""
+Change driven relays status notifier
+
+The relays status is published as soon as it changes (signaled by the commands or detected by
+the watcher reading the expander), otherwise a heartbeat is published. The heartbeat period is
+reset to its minimum on activity and doubled after each quiet heartbeat, up to its maximum
+"""
+
+import logging
+import threading
+import time
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+class RelaysStatusNotifier:
+    """Relays status notifier with adaptive heartbeat"""
+
+    heartbeat_min_period_in_secs: float
+    heartbeat_max_period_in_secs: float
+    watcher_period_in_secs: float
+
+    def __init__(
+        self,
+        publish_status: Callable[[], None],
+        read_status: Callable[[bool], int],
+        heartbeat_min_period_in_secs: float,
+        heartbeat_max_period_in_secs: float,
+        watcher_period_in_secs: float = 0,
+    ):
+        """
+        publish_status publishes the current relays status, read_status(refresh) returns the
+        current relays mask (reading the bus if refresh). The watcher is disabled if its period
+        is 0
+        """
+        self.heartbeat_min_period_in_secs = heartbeat_min_period_in_secs
+        self.heartbeat_max_period_in_secs = max(
+            heartbeat_min_period_in_secs, heartbeat_max_period_in_secs
+        )
+        self.watcher_period_in_secs = watcher_period_in_secs
+        self._publish_status = publish_status
+        self._read_status = read_status
+        self._status_changed = threading.Event()
+        self._running = False
+        self._thread = None
+        self._last_published_mask = None
+
+    def start(self):
+        """Start the notifier thread"""
+
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._running = True
+        # Initial status is published on start
+        self._status_changed.set()
+        self._thread = threading.Thread(target=self._run, name="relays-notifier", daemon=True)
+        self._thread.start()
+        logger.info("Relays status notifier started")
+
+    def stop(self):
+        """Stop the notifier thread"""
+
+        self._running = False
+        self._status_changed.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def status_changed(self):
+        """Signal a relays status change, the status is published immediately"""
+        self._status_changed.set()
+
+    def _publish(self):
+        """Publish relays status"""
+
+        try:
+            self._last_published_mask = self._read_status(False)
+            self._publish_status()
+        except Exception:
+            logger.exception("Relays status notification failed")
+
+    def _watch(self) -> bool:
+        """Read the expander, return True if the relays status changed since last publication"""
+
+        try:
+            return self._read_status(True) != self._last_published_mask
+        except Exception:
+            logger.exception("Relays status watcher read failed")
+            return False
+
+    def _run(self):
+        """Notifier loop"""
+
+        now = time.monotonic()
+        heartbeat_period = self.heartbeat_min_period_in_secs
+        next_heartbeat = now + heartbeat_period
+        next_watch = now + self.watcher_period_in_secs
+
+        while self._running:
+            deadline = next_heartbeat
+            if self.watcher_period_in_secs > 0:
+                deadline = min(deadline, next_watch)
+            changed = self._status_changed.wait(timeout=max(0, deadline - time.monotonic()))
+            if not self._running:
+                break
+            now = time.monotonic()
+
+            if not changed and self.watcher_period_in_secs > 0 and now >= next_watch:
+                next_watch = now + self.watcher_period_in_secs
+                changed = self._watch()
+                if changed:
+                    logger.info("Relays status change detected by watcher")
+
+            if changed:
+                self._status_changed.clear()
+                self._publish()
+                # Activity: back to the shortest heartbeat period
+                heartbeat_period = self.heartbeat_min_period_in_secs
+                next_heartbeat = now + heartbeat_period
+            elif now >= next_heartbeat:
+                self._publish()
+                # No activity: the next heartbeat comes later
+                heartbeat_period = min(heartbeat_period * 2, self.heartbeat_max_period_in_secs)
+                next_heartbeat = now + heartbeat_period
@@ -0,0 +1,68 @@
+"""
+Relays presets
+
+A preset (scene) sets a group of relays ON and another group OFF at once, it is compiled into
+set and clear masks at startup and applied with a single command
+"""
+
+from typing import Dict, Iterable, List
+from server.interfaces.mqtt import RelaysStatus
+from .bitmask import RelaysBitmask, bits_in_mask
+
+
+class RelaysPreset:
+    """Precompiled relays preset"""
+
+    __slots__ = ("name", "set_mask", "clear_mask")
+
+    def __init__(self, name: str, set_mask: int, clear_mask: int):
+        self.name = name
+        self.set_mask = set_mask
+        self.clear_mask = clear_mask
+
+    @property
+    def relays_on(self) -> List[int]:
+        """Relays set ON by the preset"""
+        return bits_in_mask(self.set_mask)
+
+    @property
+    def relays_off(self) -> List[int]:
+        """Relays set OFF by the preset"""
+        return bits_in_mask(self.clear_mask)
+
+    def to_relays_status(self) -> RelaysStatus:
+        """Return the RelaysStatus command of the preset"""
+        return RelaysStatus.from_mask(
+            status_mask=self.set_mask,
+            validity_mask=self.set_mask | self.clear_mask,
+            command=True,
+        )
+
+
+def compile_relays_presets(
+    presets_config: Dict[str, dict], relays_bitmask: RelaysBitmask
+) -> Dict[str, RelaysPreset]:
+    """
+    Compile the presets configuration {name: {"relays_on": [relays], "relays_off": [relays]}},
+    raise ValueError if a relay is not valid or both set ON and OFF by a preset
+    """
+
+    def relays_mask(name: str, relays: Iterable[int]) -> int:
+        mask = 0
+        for relay_number in relays:
+            if not relays_bitmask.is_valid_relay(relay_number):
+                raise ValueError(f"Relays preset {name}: invalid relay number {relay_number}")
+            mask |= 1 << relay_number
+        return mask
+
+    presets = {}
+    for name, preset_config in (presets_config or {}).items():
+        set_mask = relays_mask(name, preset_config.get("relays_on", []))
+        clear_mask = relays_mask(name, preset_config.get("relays_off", []))
+        if set_mask & clear_mask:
+            raise ValueError(
+                f"Relays preset {name}: relays "
+                f"{relays_bitmask.relays_in_mask(set_mask & clear_mask)} both ON and OFF"
+            )
+        presets[name] = RelaysPreset(name=name, set_mask=set_mask, clear_mask=clear_mask)
+    return presets
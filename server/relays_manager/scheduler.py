@@ -0,0 +1,272 @@
+"""
+Relays scheduler
+
+Timed relays commands and periodic jobs are driven by a single thread and a heap of timers on
+the monotonic clock (no thread per timer). A relays schedule applies its relays statuses at its
+start, reverts them after its duration (pulse, window) if any and repeats every period if any.
+The relays commands due within the merge window are merged (latest wins) and applied at once
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+from .bitmask import bits_in_mask
+
+logger = logging.getLogger(__name__)
+
+PHASE_START = 0
+PHASE_END = 1
+PHASE_JOB = 2
+
+
+class RelaysSchedule:
+    """Relays schedule"""
+
+    __slots__ = (
+        "schedule_id",
+        "set_mask",
+        "clear_mask",
+        "start",
+        "duration_in_secs",
+        "period_in_secs",
+        "next_start",
+    )
+
+    def __init__(
+        self,
+        schedule_id: int,
+        set_mask: int,
+        clear_mask: int,
+        start: float,
+        duration_in_secs: Optional[float] = None,
+        period_in_secs: Optional[float] = None,
+    ):
+        self.schedule_id = schedule_id
+        self.set_mask = set_mask
+        self.clear_mask = clear_mask
+        self.start = start
+        """ Monotonic time of the first start """
+        self.duration_in_secs = duration_in_secs
+        self.period_in_secs = period_in_secs
+        self.next_start = start
+        """ Monotonic time of the next start """
+
+    @property
+    def relays_on(self) -> List[int]:
+        """Relays set ON at start"""
+        return bits_in_mask(self.set_mask)
+
+    @property
+    def relays_off(self) -> List[int]:
+        """Relays set OFF at start"""
+        return bits_in_mask(self.clear_mask)
+
+    @property
+    def next_start_datetime(self) -> datetime:
+        """Datetime of the next start"""
+        return datetime.fromtimestamp(time.time() + self.next_start - time.monotonic())
+
+
+class SchedulerJob:
+    """Periodic job"""
+
+    __slots__ = ("name", "function", "period_in_secs")
+
+    def __init__(self, name: str, function: Callable[[], None], period_in_secs: float):
+        self.name = name
+        self.function = function
+        self.period_in_secs = period_in_secs
+
+
+class RelaysScheduler:
+    """Relays scheduler, a single thread runs the timers heap"""
+
+    max_schedules: int
+    merge_window_in_secs: float
+
+    def __init__(
+        self,
+        apply_command: Callable[[int, int], None],
+        max_schedules: int = 1000,
+        merge_window_in_secs: float = 0.01,
+    ):
+        """apply_command(set_mask, clear_mask) applies a relays command"""
+        self.max_schedules = max_schedules
+        self.merge_window_in_secs = merge_window_in_secs
+        self._apply_command = apply_command
+        self._condition = threading.Condition()
+        # Timers heap: (due monotonic time, sequence, phase, schedule id or job)
+        self._timers: List[Tuple[float, int, int, object]] = []
+        self._sequence = itertools.count()
+        self._schedule_ids = itertools.count(1)
+        self._schedules: Dict[int, RelaysSchedule] = {}
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        """Start the scheduler thread"""
+
+        with self._condition:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="relays-scheduler", daemon=True)
+            self._thread.start()
+        logger.info("Relays scheduler started")
+
+    def stop(self):
+        """Stop the scheduler thread"""
+
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _push(self, due: float, phase: int, target):
+        """Push a timer, called with the condition held"""
+
+        timer = (due, next(self._sequence), phase, target)
+        heapq.heappush(self._timers, timer)
+        if self._timers[0] is timer:
+            # New earliest timer
+            self._condition.notify_all()
+
+    def add_job(self, name: str, function: Callable[[], None], period_in_secs: float):
+        """Add a periodic job, first run after a period"""
+
+        job = SchedulerJob(name=name, function=function, period_in_secs=period_in_secs)
+        with self._condition:
+            self._push(time.monotonic() + period_in_secs, PHASE_JOB, job)
+        logger.info("Job %s scheduled every %s secs", name, period_in_secs)
+        return job
+
+    def add_schedule(
+        self,
+        set_mask: int,
+        clear_mask: int,
+        delay_in_secs: float = 0,
+        duration_in_secs: Optional[float] = None,
+        period_in_secs: Optional[float] = None,
+    ) -> RelaysSchedule:
+        """
+        Schedule a relays command in delay_in_secs, reverted after duration_in_secs if given and
+        repeated every period_in_secs if given. Raise ValueError if there are too many schedules
+        or if the period is shorter than the duration
+        """
+
+        if period_in_secs is not None and period_in_secs <= (duration_in_secs or 0):
+            raise ValueError("The schedule period must be longer than its duration")
+
+        with self._condition:
+            if len(self._schedules) >= self.max_schedules:
+                raise ValueError(f"Too many relays schedules (max {self.max_schedules})")
+            schedule = RelaysSchedule(
+                schedule_id=next(self._schedule_ids),
+                set_mask=set_mask,
+                clear_mask=clear_mask,
+                start=time.monotonic() + max(0, delay_in_secs),
+                duration_in_secs=duration_in_secs,
+                period_in_secs=period_in_secs,
+            )
+            self._schedules[schedule.schedule_id] = schedule
+            self._push(schedule.start, PHASE_START, schedule.schedule_id)
+        logger.info("Relays schedule %s added", schedule.schedule_id)
+        return schedule
+
+    def cancel_schedule(self, schedule_id: int) -> Optional[RelaysSchedule]:
+        """Cancel a schedule (relays statuses are not reverted), its timers are dropped when due"""
+
+        with self._condition:
+            return self._schedules.pop(schedule_id, None)
+
+    def get_schedule(self, schedule_id: int) -> Optional[RelaysSchedule]:
+        """Get schedule by id"""
+        return self._schedules.get(schedule_id)
+
+    def get_schedules(self) -> List[RelaysSchedule]:
+        """Get pending schedules, ordered by id"""
+        with self._condition:
+            return list(self._schedules.values())
+
+    def _pop_due_timers(self, now: float) -> List[Tuple[float, int, int, object]]:
+        """Pop the timers due (within the merge window), called with the condition held"""
+
+        due_timers = []
+        limit = now + self.merge_window_in_secs
+        while self._timers and self._timers[0][0] <= limit:
+            due_timers.append(heapq.heappop(self._timers))
+        return due_timers
+
+    def _fire(self, due_timers) -> Tuple[int, int, List[SchedulerJob]]:
+        """
+        Process due timers, called with the condition held. Return the merged relays command and
+        the jobs to run
+        """
+
+        now = time.monotonic()
+        set_mask = 0
+        clear_mask = 0
+        jobs = []
+        for due, _, phase, target in due_timers:
+            if phase == PHASE_JOB:
+                jobs.append(target)
+                # Periods missed (e.g. system suspended) are skipped
+                self._push(max(due + target.period_in_secs, now), PHASE_JOB, target)
+                continue
+
+            schedule = self._schedules.get(target)
+            if schedule is None:
+                # Cancelled
+                continue
+
+            if phase == PHASE_START:
+                command_set_mask, command_clear_mask = schedule.set_mask, schedule.clear_mask
+                if schedule.duration_in_secs is not None:
+                    self._push(due + schedule.duration_in_secs, PHASE_END, target)
+                if schedule.period_in_secs is not None:
+                    schedule.next_start = max(due + schedule.period_in_secs, now)
+                    self._push(schedule.next_start, PHASE_START, target)
+                elif schedule.duration_in_secs is None:
+                    del self._schedules[target]
+            else:
+                # Revert the statuses set at start
+                command_set_mask, command_clear_mask = schedule.clear_mask, schedule.set_mask
+                if schedule.period_in_secs is None:
+                    del self._schedules[target]
+
+            set_mask = (set_mask & ~command_clear_mask) | command_set_mask
+            clear_mask = (clear_mask & ~command_set_mask) | command_clear_mask
+        return set_mask, clear_mask, jobs
+
+    def _run(self):
+        """Scheduler loop"""
+
+        while True:
+            with self._condition:
+                while self._running:
+                    now = time.monotonic()
+                    due_timers = self._pop_due_timers(now)
+                    if due_timers:
+                        break
+                    timeout = self._timers[0][0] - now if self._timers else None
+                    self._condition.wait(timeout=timeout)
+                if not self._running:
+                    return
+                set_mask, clear_mask, jobs = self._fire(due_timers)
+
+            if set_mask or clear_mask:
+                try:
+                    self._apply_command(set_mask, clear_mask)
+                except Exception:
+                    logger.exception("Scheduled relays command failed")
+            for job in jobs:
+                try:
+                    job.function()
+                except Exception:
+                    logger.exception("Job %s failed", job.name)
@@ -1,36 +1,53 @@
-import smbus2
+import atexit
 import logging
+import threading
 import time
-from typing import Iterable
+import uuid
+from typing import Callable, Dict, List, Optional
 from flask import Flask
+from paho.mqtt.client import MQTTMessage
 from server.interfaces.mqtt import mqtt_client_interface
+from server.interfaces.i2c import I2CBusBackend, create_bus_backend
 from datetime import datetime
-from timeloop import Timeloop
-from server.interfaces.mqtt import SingleRelayStatus, RelaysStatus
-from datetime import timedelta
+from server.interfaces.mqtt import SingleRelayStatus, RelaysStatus, RelaysScheduleCommand
 from server.common import RpiElectricalPanelException, ErrorCode
-
-
-relays_status_timeloop = Timeloop()
+from server.common.metrics import metrics_registry
+from server.common.tracing import tracer, new_correlation_id
+from .bitmask import RelaysBitmask, bits_in_mask
+from .board import RelaysBoard
+from .command_queue import COMMANDS_DUPLICATED, RecentCommands, RelaysCommandQueue
+from .executor import RelaysI2CExecutor, RelaysState
+from .history import RelaysHistory
+from .journal import RelaysStateJournal, compile_relays_restore_policy
+from .notifier import RelaysStatusNotifier
+from .preset import RelaysPreset, compile_relays_presets
+from .scheduler import RelaysSchedule, RelaysScheduler
+from .startup import StartupStages
 
 logger = logging.getLogger(__name__)
 
-bus = smbus2.SMBus(1)
+NOTIFICATION_MODE_PERIODIC = "periodic"
+NOTIFICATION_MODE_ON_CHANGE = "on_change"
+
+STAGE_RELAYS_BOARDS = "relays_boards"
+STAGE_MQTT = "mqtt"
+STAGE_SELF_TEST = "self_test"
+STAGE_RELAYS_STATUS = "relays_status"
+STARTUP_STAGES = (STAGE_RELAYS_BOARDS, STAGE_MQTT, STAGE_SELF_TEST, STAGE_RELAYS_STATUS)
+# A failed self test is reported but does not prevent the panel from being ready
+OPTIONAL_STARTUP_STAGES = (STAGE_SELF_TEST,)
 
-RELAYS_STATUSES_OFF = [
-    SingleRelayStatus(relay_number=0, status=False),
-    SingleRelayStatus(relay_number=1, status=False),
-    SingleRelayStatus(relay_number=2, status=False),
-    SingleRelayStatus(relay_number=3, status=False),
-    SingleRelayStatus(relay_number=4, status=False),
-    SingleRelayStatus(relay_number=5, status=False),
-]
+RELAY_ON_PAYLOAD = b"1"
+RELAY_OFF_PAYLOAD = b"0"
+# Payloads of the per relay command topics: ASCII or binary digit
+RELAY_COMMAND_PAYLOADS = {b"1": True, b"0": False, b"\x01": True, b"\x00": False}
 
 
 class RelaysManager:
     """Manager for relays control"""
 
     mqtt_broker_address: str
+    mqtt_broker_port: int
     mqtt_username: str
     mqtt_password: str
     mqtt_command_relays_topic: str
@@ -38,8 +55,17 @@ class RelaysManager:
     mqtt_qos: int
     mqtt_reconnection_timeout_in_secs: int
     mqtt_publish_timeout_in_secs: int
+    buses: Dict[int, I2CBusBackend]
+    relays_boards: List[RelaysBoard]
 
     def __init__(self, app: Flask = None) -> None:
+        # Only used in "on_change" notification mode
+        self.relays_status_notifier = None
+        # (correlation id, monotonic time) of the last command applied, echoed by the next status
+        self._pending_correlation = None
+        # Relays mask last published on the relay status topics, None to publish every relay
+        self._relay_topics_published_mask = None
+        self._relays_status_publication_lock = threading.Lock()
         if app is not None:
             self.init_app(app)
 
@@ -49,179 +75,745 @@ class RelaysManager:
             logger.debug("initializing the RelaysManager")
             # Initialize configuration
             self.mqtt_broker_address = app.config["MQTT_BROKER_ADDRESS"]
+            self.mqtt_broker_port = app.config["MQTT_BROKER_PORT"]
             self.mqtt_username = app.config["MQTT_USERNAME"]
             self.mqtt_password = app.config["MQTT_PASSWORD"]
             self.mqtt_command_relays_topic = app.config["MQTT_COMMAND_RELAYS_TOPIC"]
             self.mqtt_relays_status_topic = app.config["MQTT_RELAYS_STATUS_TOPIC"]
+            self.mqtt_relays_status_retain = app.config["MQTT_RELAYS_STATUS_RETAIN"]
+            self.mqtt_relay_status_topics_enabled = app.config["MQTT_RELAY_STATUS_TOPICS_ENABLED"]
+            self.mqtt_relay_command_topics_enabled = app.config["MQTT_RELAY_COMMAND_TOPICS_ENABLED"]
+            self.mqtt_relay_command_topic = app.config["MQTT_RELAY_COMMAND_TOPIC"]
+            self.mqtt_schedule_relays_topic = app.config["MQTT_SCHEDULE_RELAYS_TOPIC"]
             self.mqtt_qos = app.config["MQTT_QOS"]
             self.mqtt_reconnection_timeout_in_secs = app.config["MQTT_RECONNECTION_TIMEOUT_IN_SEG"]
             self.mqtt_publish_timeout_in_secs = app.config["MQTT_MSG_PUBLISH_TIMEOUT_IN_SECS"]
-            self.serial_address = app.config["RELAYS_SERIAL_ADDRESS"]
+            self.mqtt_max_pending_messages = app.config["MQTT_MAX_PENDING_MESSAGES"]
+            self.mqtt_topics_codecs = app.config["MQTT_TOPICS_CODECS"]
+            self.mqtt_command_queue_max_size = app.config["MQTT_COMMAND_QUEUE_MAX_SIZE"]
+            self.mqtt_command_deduplication_size = app.config["MQTT_COMMAND_DEDUPLICATION_SIZE"]
+            self.mqtt_command_discard_stale = app.config["MQTT_COMMAND_DISCARD_STALE"]
+            self.mqtt_command_coalescing_window_in_secs = app.config[
+                "MQTT_COMMAND_COALESCING_WINDOW_IN_SECS"
+            ]
             self.relays_status_notification_period_in_secs = app.config[
                 "RELAYS_STATUS_NOTIFICATION_PERIOD_IN_SECS"
             ]
+            self.relays_status_notification_mode = app.config["RELAYS_STATUS_NOTIFICATION_MODE"]
+            self.relays_status_heartbeat_min_period_in_secs = app.config[
+                "RELAYS_STATUS_HEARTBEAT_MIN_PERIOD_IN_SECS"
+            ]
+            self.relays_status_heartbeat_max_period_in_secs = app.config[
+                "RELAYS_STATUS_HEARTBEAT_MAX_PERIOD_IN_SECS"
+            ]
+            self.relays_status_watcher_period_in_secs = app.config[
+                "RELAYS_STATUS_WATCHER_PERIOD_IN_SECS"
+            ]
+            self.relays_status_revalidation_period_in_secs = app.config[
+                "RELAYS_STATUS_REVALIDATION_PERIOD_IN_SECS"
+            ]
 
-            # Connect to MQTT broker
+            self.relays_self_test_enabled = app.config["RELAYS_SELF_TEST_ENABLED"]
+            self.relays_self_test_step_in_secs = app.config["RELAYS_SELF_TEST_STEP_IN_SECS"]
+            self.relays_warmup_retry_delay_in_secs = app.config["RELAYS_WARMUP_RETRY_DELAY_IN_SECS"]
+            self.relays_stream_keepalive_period_in_secs = app.config[
+                "RELAYS_STREAM_KEEPALIVE_PERIOD_IN_SECS"
+            ]
+            self.relays_long_poll_max_timeout_in_secs = app.config[
+                "RELAYS_LONG_POLL_MAX_TIMEOUT_IN_SECS"
+            ]
+            self.startup_stages = StartupStages(STARTUP_STAGES, OPTIONAL_STARTUP_STAGES)
+            # The relays state versions restart at each startup
+            self.relays_state_instance_id = uuid.uuid4().hex
+
+            # Relays scheduler, also runs the periodic jobs (started once the relays are ready)
+            self.relays_scheduler = RelaysScheduler(
+                apply_command=self.apply_scheduled_relays_command,
+                max_schedules=app.config["RELAYS_SCHEDULER_MAX_SCHEDULES"],
+                merge_window_in_secs=app.config["RELAYS_SCHEDULER_MERGE_WINDOW_IN_SECS"],
+            )
+
+            # Relays boards, relays are numbered globally in the boards order
+            self.init_relays_boards(app.config)
+            self.relays_bitmask = RelaysBitmask(
+                relays_number=sum(board.relays_number for board in self.relays_boards)
+            )
+            # Relays presets, compiled into masks
+            self.relays_presets = compile_relays_presets(
+                app.config.get("RELAYS_PRESETS"), self.relays_bitmask
+            )
+
+            # Relays status restored on startup from the relays state journal
+            self.relays_restore_policy = compile_relays_restore_policy(
+                app.config["RELAYS_RESTORE_DEFAULT_POLICY"],
+                app.config["RELAYS_RESTORE_POLICIES"],
+                self.relays_bitmask,
+            )
+            self.relays_journal_file = app.config["RELAYS_JOURNAL_FILE"]
+            self.relays_journal_fsync_period_in_secs = app.config[
+                "RELAYS_JOURNAL_FSYNC_PERIOD_IN_SECS"
+            ]
+            self.relays_journal_max_records = app.config["RELAYS_JOURNAL_MAX_RECORDS"]
+            # Set once the journal is recovered, the self test statuses are not journaled
+            self.relays_state_journal = None
+
+            # Connect to MQTT broker, in background
             self.init_mqtt_service()
 
-            # Test relays
-            self.test_relays_status()
+            # Metrics of the relays state
+            metrics_registry.gauge(
+                "relays_state_version", "Relays state version (incremented on each change)"
+            ).set_function(lambda: self.get_relays_state().version)
+            metrics_registry.gauge(
+                "relays_status_mask", "Relays status mask (bit n set if relay n is ON)"
+            ).set_function(lambda: self.get_relays_state().status_mask)
+            metrics_registry.gauge(
+                "relays_schedules_pending", "Relays schedules pending"
+            ).set_function(lambda: len(self.relays_scheduler.get_schedules()))
+
+            # Warm up the relays in background, the HTTP server is served meanwhile
+            self.warmup_thread = threading.Thread(
+                target=self.warm_up, name="relays-warmup", daemon=True
+            )
+            self.warmup_thread.start()
+
+    def run_startup_stage(self, stage: str, operation: Callable[[], None]):
+        """Run a startup stage, retried until it succeeds"""
+
+        while True:
+            try:
+                with self.startup_stages.run(stage):
+                    operation()
+                return
+            except Exception:
+                logger.exception(
+                    "Startup stage %s failed, retry in %s secs",
+                    stage,
+                    self.relays_warmup_retry_delay_in_secs,
+                )
+                time.sleep(self.relays_warmup_retry_delay_in_secs)
 
-            # Init relays status
-            self.init_relays_status()
+    def warm_up(self):
+        """
+        Warm up the relays: read the boards, run the self test (if enabled) and set the initial
+        relays status, then start the relays commands and status notification services
+        """
 
-    def generate_serial_command(self, new_relay_statuses: Iterable[SingleRelayStatus]):
-        """Generate serial command to send to control the relays"""
+        self.run_startup_stage(
+            STAGE_RELAYS_BOARDS, lambda: self.relays_i2c_executor.refresh().result()
+        )
 
-        relays_current_status_raw, relays_current_status = self.get_relays_current_status()
-        relays_with_new_status = []
+        if self.relays_self_test_enabled:
+            try:
+                with self.startup_stages.run(STAGE_SELF_TEST):
+                    self.test_relays_status()
+            except Exception:
+                logger.exception("Relays self test failed")
+        else:
+            self.startup_stages.skip(STAGE_SELF_TEST)
+
+        # Recovered once, the relays status stage is retried with the same journal
+        last_status_mask = self.recover_relays_state()
+        self.run_startup_stage(
+            STAGE_RELAYS_STATUS, lambda: self.init_relays_status(last_status_mask)
+        )
 
-        # Retreive the relays that change of status
-        for new_relay_status in new_relay_statuses:
-            if new_relay_status.relay_number in relays_current_status:
-                if new_relay_status.status != relays_current_status[new_relay_status.relay_number]:
-                    relays_with_new_status.append(new_relay_status.relay_number)
-        logger.debug(f"relays_with_new_status: {relays_with_new_status}")
+        # Commands received during the warm up were queued
+        self.relays_command_queue.start()
+        self.relays_scheduler.start()
+        self.start_relays_status_notification()
+        logger.info("Relays manager ready")
+
+    def on_mqtt_connection(self, connected: bool):
+        """Track the MQTT connection startup stage"""
+
+        if connected:
+            self.startup_stages.done(STAGE_MQTT)
+            # The broker may have lost the retained relay statuses, all are published again
+            self._relay_topics_published_mask = None
+            if self.relays_status_notifier is not None:
+                self.relays_status_notifier.status_changed()
+        else:
+            self.startup_stages.fail(STAGE_MQTT, "Not connected to broker")
+
+    def init_relays_boards(self, config: dict):
+        """Create the relays boards and their buses backends"""
+
+        boards_config = config.get("RELAYS_BOARDS")
+        if not boards_config:
+            # Single board configuration
+            boards_config = [
+                {
+                    "name": "board_0",
+                    "bus": config["RELAYS_BUS_NUMBER"],
+                    "address": config["RELAYS_SERIAL_ADDRESS"],
+                    "relays_bits": config["RELAYS_BITS"],
+                }
+            ]
 
-        # generate command
-        new_status_raw_command = bin(relays_current_status_raw)[2:]
-        for i in relays_with_new_status:
-            new_status = "0" if relays_current_status[i] else "1"
-            new_status_raw_command = (
-                new_status_raw_command[: i + 2] + new_status + new_status_raw_command[i + 3 :]
+        self.buses = {}
+        self.relays_boards = []
+        first_relay = 0
+        for board_config in boards_config:
+            bus_number = board_config["bus"]
+            if bus_number not in self.buses:
+                self.buses[bus_number] = create_bus_backend(
+                    backend=config["RELAYS_BUS_BACKEND"],
+                    bus_number=bus_number,
+                    simulated_latency_in_secs=config["RELAYS_SIMULATED_BUS_LATENCY_IN_SECS"],
+                    simulated_jitter_in_secs=config["RELAYS_SIMULATED_BUS_JITTER_IN_SECS"],
+                    simulated_error_rate=config["RELAYS_SIMULATED_BUS_ERROR_RATE"],
+                    recorded_backend=config["RELAYS_RECORDING_BUS_BACKEND"],
+                    max_recorded_transactions=config["RELAYS_RECORDING_BUS_MAX_TRANSACTIONS"],
+                )
+            board = RelaysBoard(
+                name=board_config["name"],
+                bus_number=bus_number,
+                address=board_config["address"],
+                relays_bits=board_config["relays_bits"],
+                first_relay=first_relay,
+                bus=self.buses[bus_number],
             )
-        relays_new_status_command = int(new_status_raw_command, 2)
+            logger.info("%s relays: %s", board, board.relays_number)
+            self.relays_boards.append(board)
+            first_relay += board.relays_number
 
-        logger.info(f"Generated command: {relays_new_status_command}")
-        return relays_new_status_command
+        # Relays status transitions, recorded by the relays I2C executor
+        self.relays_history = RelaysHistory(
+            capacity=config["RELAYS_HISTORY_CAPACITY"], relays_number=first_relay
+        )
+        # Single owner of the buses, the initial state is read from the boards
+        self.relays_i2c_executor = RelaysI2CExecutor(
+            boards=self.relays_boards,
+            revalidation_period_in_secs=self.relays_status_revalidation_period_in_secs,
+            on_state_change=lambda state, source: self.relays_history.record(
+                state.timestamp, state.status_mask, source
+            ),
+        )
+        self.relays_i2c_executor.start()
 
-    def get_relays_current_status(self):
-        """retrieve relays current status and format"""
-        relays_status = {}
+    def get_relays_board(self, board_name: str) -> RelaysBoard:
+        """Get relays board by name"""
+
+        for board in self.relays_boards:
+            if board.name == board_name:
+                return board
+        raise RpiElectricalPanelException(ErrorCode.INVALID_RELAYS_BOARD, board_name)
 
-        # ONLY FOR LOCAL TEST
-        # current_status_raw = 0xCC  # 0b11001100
-        # current_status_raw = 0xCC  # 0b00000000
+    def get_board_relay_number(self, board_name: str, board_relay_number: int) -> int:
+        """Get the global relay number of a board relay"""
 
-        current_status_raw = ~bus.read_byte(self.serial_address) & 0xFF
-        current_status = "{0:08b}".format(current_status_raw)[2:]
+        board = self.get_relays_board(board_name)
+        if not board.bitmask.is_valid_relay(board_relay_number):
+            raise RpiElectricalPanelException(ErrorCode.INVALID_RELAY_NUMBER)
+        return board.first_relay + board_relay_number
+
+    def get_relays_preset(self, preset_name: str) -> RelaysPreset:
+        """Get relays preset by name"""
+
+        preset = self.relays_presets.get(preset_name)
+        if preset is None:
+            raise RpiElectricalPanelException(ErrorCode.INVALID_RELAYS_PRESET, preset_name)
+        return preset
+
+    def apply_relays_preset(
+        self, preset_name: str, correlation_id: Optional[str] = None
+    ) -> RelaysStatus:
+        """Apply relays preset with a single command, return the command applied"""
+
+        relays_status = self.get_relays_preset(preset_name).to_relays_status()
+        relays_status.correlation_id = correlation_id
+        logger.info("Apply relays preset %s", preset_name)
+        self.set_relays_statuses(relays_status=relays_status, notify=True)
+        return relays_status
+
+    def schedule_relays(self, schedule_command: RelaysScheduleCommand) -> RelaysSchedule:
+        """
+        Schedule a relays command, the start datetime is used if given, otherwise the delay
+        """
+        logger.info("Relays schedule command received : %s", schedule_command)
+
+        for relay_status in schedule_command.relay_statuses:
+            if not self.relays_bitmask.is_valid_relay(relay_status.relay_number):
+                raise RpiElectricalPanelException(
+                    ErrorCode.INVALID_RELAY_NUMBER, str(relay_status.relay_number)
+                )
+        set_mask, clear_mask = self.relays_bitmask.compile(schedule_command.relay_statuses)
+
+        if schedule_command.start is not None:
+            delay_in_secs = schedule_command.start.timestamp() - time.time()
+        else:
+            delay_in_secs = schedule_command.delay_in_secs or 0
+
+        try:
+            return self.relays_scheduler.add_schedule(
+                set_mask=set_mask,
+                clear_mask=clear_mask,
+                delay_in_secs=delay_in_secs,
+                duration_in_secs=schedule_command.duration_in_secs,
+                period_in_secs=schedule_command.period_in_secs,
+            )
+        except ValueError as error:
+            raise RpiElectricalPanelException(ErrorCode.INVALID_RELAYS_SCHEDULE, str(error))
+
+    def on_relay_command(self, message: MQTTMessage):
+        """
+        Callback for messages received in the relay command topics (command/relays/relay/<relay
+        number>), the one byte payload is queued as a relays command without decoding. Without
+        sender timestamp, the QoS 1 redeliveries are recognized by their message id
+        """
+
+        topic, payload = message.topic, bytes(message.payload)
+        relay_level = topic.rpartition("/")[2]
+        status = RELAY_COMMAND_PAYLOADS.get(payload)
+        if (
+            status is None
+            or not relay_level.isdigit()
+            or not self.relays_bitmask.is_valid_relay(int(relay_level))
+        ):
+            logger.error("Relay command rejected, topic %s payload %r", topic, payload)
+            return
+        if (
+            message.qos
+            and self._relay_command_mids is not None
+            and not self._relay_command_mids.add(message.mid)
+            and message.dup
+        ):
+            COMMANDS_DUPLICATED.inc()
+            logger.info("Duplicated relay command dropped, topic %s mid %d", topic, message.mid)
+            return
+        relay_mask = 1 << int(relay_level)
+        self.relays_command_queue.put(
+            RelaysStatus.from_mask(
+                status_mask=relay_mask if status else 0,
+                validity_mask=relay_mask,
+                command=True,
+                correlation_id=new_correlation_id(),
+            ),
+            sender_clock=False,
+        )
+
+    def on_relays_command(self, command: RelaysStatus):
+        """Callback for messages received in command relays topic, unknown relays are dropped"""
+
+        relays_mask = self.relays_bitmask.relays_mask
+        unknown_relays_mask = command.validity_mask & ~relays_mask
+        if unknown_relays_mask:
+            logger.warning(
+                "Relays command, unknown relays %s dropped", bits_in_mask(unknown_relays_mask)
+            )
+            if not command.validity_mask & relays_mask:
+                return
+            command = RelaysStatus.from_mask(
+                status_mask=command.status_mask,
+                validity_mask=command.validity_mask & relays_mask,
+                command=True,
+                timestamp=command.timestamp,
+                correlation_id=command.correlation_id,
+            )
+        self.relays_command_queue.put(command)
 
-        for i, status in enumerate(current_status):
-            relay_status = True if status == "1" else False
-            relays_status[i] = relay_status
+    def on_relays_schedule_command(self, schedule_command: RelaysScheduleCommand):
+        """Callback for messages received in schedule relays topic"""
 
-        logger.info(f"Relays current status: {relays_status}")
-        return current_status_raw, relays_status
+        try:
+            self.schedule_relays(schedule_command)
+        except RpiElectricalPanelException as error:
+            logger.error("Relays schedule command rejected: %s", error.message)
 
-    def get_relays_current_status_instance(self):
+    def get_relays_schedule(self, schedule_id: int) -> RelaysSchedule:
+        """Get relays schedule by id"""
+
+        schedule = self.relays_scheduler.get_schedule(schedule_id)
+        if schedule is None:
+            raise RpiElectricalPanelException(ErrorCode.INVALID_RELAYS_SCHEDULE, str(schedule_id))
+        return schedule
+
+    def cancel_relays_schedule(self, schedule_id: int) -> RelaysSchedule:
+        """Cancel relays schedule"""
+
+        schedule = self.relays_scheduler.cancel_schedule(schedule_id)
+        if schedule is None:
+            raise RpiElectricalPanelException(ErrorCode.INVALID_RELAYS_SCHEDULE, str(schedule_id))
+        logger.info("Relays schedule %s cancelled", schedule_id)
+        return schedule
+
+    def apply_scheduled_relays_command(self, set_mask: int, clear_mask: int):
+        """Apply the relays command of the schedules due at the same time"""
+
+        self.set_relays_statuses(
+            relays_status=RelaysStatus.from_mask(
+                status_mask=set_mask, validity_mask=set_mask | clear_mask, command=True
+            ),
+            notify=True,
+        )
+
+    def get_relays_state(self, refresh: bool = False) -> RelaysState:
+        """
+        Retrieve the relays state snapshot, without bus access unless refresh is requested (the
+        boards are then read by the relays I2C executor)
+        """
+        if refresh:
+            return self.relays_i2c_executor.refresh().result()
+        state = self.relays_i2c_executor.state
+        if state is None:
+            raise RpiElectricalPanelException(ErrorCode.RELAYS_MANAGER_NOT_READY)
+        return state
+
+    def wait_for_relays_state_change(self, version: Optional[int], timeout: float) -> RelaysState:
+        """
+        Wait until the relays state version differs from version, return the last relays state
+        snapshot (unchanged if timeout elapsed)
+        """
+        state = self.relays_i2c_executor.wait_for_change(version, timeout)
+        if state is None:
+            raise RpiElectricalPanelException(ErrorCode.RELAYS_MANAGER_NOT_READY)
+        return state
+
+    def get_relays_history(
+        self, window_in_secs: float, relay_number: Optional[int] = None, limit: int = 1000
+    ) -> dict:
+        """
+        Get the relays status transitions of the window ending now (only the transitions of the
+        relay if given), the most recent ones if there are more than limit
+        """
+
+        relays_mask = self.relays_bitmask.relays_mask
+        if relay_number is not None:
+            self.check_relay_number(relay_number)
+            relays_mask = 1 << relay_number
+        end = time.time()
+        start = end - window_in_secs
+        initial, transitions = self.relays_history.get_transitions(start, end)
+
+        previous_mask = initial.status_mask if initial is not None else None
+        relays_transitions = []
+        for transition in transitions:
+            if previous_mask is None or (transition.status_mask ^ previous_mask) & relays_mask:
+                relays_transitions.append(
+                    {
+                        "timestamp_ms": int(transition.timestamp * 1000),
+                        "status_mask": transition.status_mask,
+                        "relays_on": bits_in_mask(transition.status_mask),
+                        "source": transition.source,
+                    }
+                )
+            previous_mask = transition.status_mask
+        return {
+            "start_ms": int(start * 1000),
+            "end_ms": int(end * 1000),
+            "initial_status_mask": initial.status_mask if initial is not None else None,
+            "transitions": relays_transitions[-limit:],
+            "truncated": len(relays_transitions) > limit,
+        }
+
+    def get_relays_duty_cycles(
+        self, window_in_secs: float, buckets_number: int, relay_number: Optional[int] = None
+    ) -> dict:
+        """
+        Get the fraction of time each relay (or the relay if given) was ON, in each bucket of the
+        window ending now
+        """
+
+        if relay_number is not None:
+            self.check_relay_number(relay_number)
+            relay_numbers = [relay_number]
+        else:
+            relay_numbers = list(range(self.relays_bitmask.relays_number))
+        end = time.time()
+        start = end - window_in_secs
+        duty_cycles = self.relays_history.get_duty_cycles(start, end, buckets_number, relay_numbers)
+        return {
+            "start_ms": int(start * 1000),
+            "end_ms": int(end * 1000),
+            "bucket_in_secs": window_in_secs / buckets_number,
+            "relays": [
+                {"relay_number": relay_number, "duty_cycles": relay_duty_cycles}
+                for relay_number, relay_duty_cycles in duty_cycles.items()
+            ],
+        }
+
+    def get_relays_current_mask(self, refresh: bool = False) -> int:
+        """retrieve relays current status as global mask (bit n set if relay n is ON)"""
+        return self.get_relays_state(refresh=refresh).status_mask
+
+    def get_relays_current_status(self, refresh: bool = False) -> Dict[int, bool]:
+        """retrieve relays current status and format"""
+
+        relays_status = self.relays_bitmask.to_dict(self.get_relays_current_mask(refresh=refresh))
+
+        logger.debug("Relays current status: %s", relays_status)
+        return relays_status
+
+    def get_relays_current_status_instance(self, refresh: bool = False) -> RelaysStatus:
         """retrieve relays current status as a RelaysStatus instance"""
 
-        current_status_raw, relays_current_status = self.get_relays_current_status()
-        relay_statuses = []
-        for relay_number, relay_status in relays_current_status.items():
-            relay_statuses.append(SingleRelayStatus(relay_number=relay_number, status=relay_status))
-        relays_current_status = RelaysStatus(relay_statuses=relay_statuses, command=False)
+        return RelaysStatus.from_mask(
+            status_mask=self.get_relays_current_mask(refresh=refresh),
+            validity_mask=self.relays_bitmask.relays_mask,
+            command=False,
+        )
 
-        return current_status_raw, relays_current_status
+    def get_relays_state_status_instance(self, state: RelaysState) -> RelaysStatus:
+        """Relays status of a state snapshot, timestamped with the last status change"""
 
-    def get_single_relay_status_instance(self, relay_number: int):
-        """get single relay status as a SingleRelayStatus instance"""
+        return RelaysStatus.from_mask(
+            status_mask=state.status_mask,
+            validity_mask=self.relays_bitmask.relays_mask,
+            command=False,
+            timestamp=datetime.fromtimestamp(state.timestamp),
+        )
 
-        if relay_number not in range(0, 6):
-            raise RpiElectricalPanelException(ErrorCode.INVALID_RELAY_NUMBER)
+    def check_relay_number(self, relay_number: int):
+        """Raise INVALID_RELAY_NUMBER if the relay does not exist"""
 
-        _, relays_statuses = self.get_relays_current_status_instance()
+        if not self.relays_bitmask.is_valid_relay(relay_number):
+            raise RpiElectricalPanelException(ErrorCode.INVALID_RELAY_NUMBER)
 
-        for relay_status in relays_statuses.relay_statuses:
-            if relay_status.relay_number == relay_number:
-                return relay_status
-        return None
+    def get_single_relay_status_instance(self, relay_number: int, refresh: bool = False):
+        """get single relay status as a SingleRelayStatus instance"""
 
-    def send_relays_command(self, serial_command: str):
-        """send relays control serial command"""
-        logger.info(f"Sending serial command: {serial_command}")
+        self.check_relay_number(relay_number)
+        return self.get_single_relay_state_status_instance(
+            relay_number, self.get_relays_state(refresh=refresh)
+        )
 
-        raw_command = ~serial_command & 0xFF
-        logger.debug(f"Raw command: {raw_command}")
+    def get_single_relay_state_status_instance(
+        self, relay_number: int, state: RelaysState
+    ) -> SingleRelayStatus:
+        """Single relay status of a state snapshot"""
 
-        # Writte serial command
-        bus.write_byte(self.serial_address, raw_command)
+        return SingleRelayStatus.of(
+            relay_number=relay_number,
+            status=self.relays_bitmask.is_relay_on(state.status_mask, relay_number),
+        )
 
     def set_relays_statuses(self, relays_status: RelaysStatus, notify: bool = False):
         """Set relays statuses, used as callback for messages received in command relays topic"""
-        logger.info(f"Relays command received : {relays_status}")
 
-        relays_new_status_serial_command = self.generate_serial_command(
-            relays_status.relay_statuses
+        if not self.startup_stages.is_done(STAGE_RELAYS_STATUS):
+            raise RpiElectricalPanelException(ErrorCode.RELAYS_MANAGER_NOT_READY)
+        self.apply_relays_statuses(relays_status, notify=notify)
+
+    def apply_relays_statuses(self, relays_status: RelaysStatus, notify: bool = False):
+        """Apply relays statuses, also used during the warm up"""
+        logger.info("Relays command received : %s", relays_status)
+
+        start = time.monotonic()
+        if relays_status.correlation_id is None:
+            relays_status.correlation_id = new_correlation_id()
+        correlation_id = relays_status.correlation_id
+        set_mask, clear_mask = self.relays_bitmask.compile_masks(
+            relays_status.status_mask, relays_status.validity_mask
         )
-        # Send relays serial command
-        self.send_relays_command(relays_new_status_serial_command)
+        # Commands are applied in order by the relays I2C executor
+        state, changed_relays_mask = self.relays_i2c_executor.apply(
+            set_mask, clear_mask, correlation_id
+        ).result()
+        if self.relays_state_journal is not None:
+            self.relays_state_journal.append(state.status_mask)
+        applied_at = time.monotonic()
+        logger.info("Changed relays mask: %#x", changed_relays_mask)
+        tracer.record_monotonic(
+            correlation_id, "relays.apply", start, applied_at, changed_mask=changed_relays_mask
+        )
+        if changed_relays_mask or notify:
+            self._pending_correlation = (correlation_id, applied_at)
 
         # notify new relays status
-        if notify:
+        if self.relays_status_notifier is not None:
+            if changed_relays_mask:
+                self.relays_status_notifier.status_changed()
+        elif notify:
             self.notify_relays_status()
 
     def notify_relays_status(self):
         """Pubish MQTT message to notify relays status"""
         # retrieve relays status
-        if self.mqtt_client.connected:
-            current_status_raw, relays_current_status = self.get_relays_current_status_instance()
-            logger.info(f"Publish current relays status: {bin(current_status_raw)}")
-            self.mqtt_client.publish(
-                topic=self.mqtt_relays_status_topic, message=relays_current_status
+        relays_current_status = self.get_relays_current_status_instance()
+        # The status echoes the correlation id of the last command applied
+        pending_correlation, self._pending_correlation = self._pending_correlation, None
+        if pending_correlation is not None:
+            correlation_id, applied_at = pending_correlation
+            relays_current_status.correlation_id = correlation_id
+            tracer.record_monotonic(correlation_id, "status.notify", applied_at, time.monotonic())
+        if not self.mqtt_client.connected:
+            logger.info("MQTT Client disconnected, relays status buffered until reconnection")
+        logger.info("Publish current relays status: %#x", relays_current_status.status_mask)
+        # Not blocking, a pending status message is superseded by the new one
+        published_at = time.monotonic()
+        with self._relays_status_publication_lock:
+            future = self.mqtt_client.publish(
+                topic=self.mqtt_relays_status_topic,
+                message=relays_current_status,
+                retain=self.mqtt_relays_status_retain,
+                replace=True,
+            )
+            if self.mqtt_relay_status_topics_enabled:
+                self.publish_relay_statuses(relays_current_status.status_mask)
+        if pending_correlation is not None:
+            future.add_done_callback(
+                lambda done: tracer.record_monotonic(
+                    relays_current_status.correlation_id,
+                    "status.publish",
+                    published_at,
+                    time.monotonic(),
+                    result="error" if done.exception() else "puback",
+                )
             )
-        else:
-            logger.info(f"MQTT Client disconnected, relays status not sent")
 
-    def init_relays_status(self):
-        """Set relays status to OFF"""
+    def publish_relay_statuses(self, status_mask: int):
+        """
+        Publish the status of the relays changed since the last publication on their own topic
+        (relays status topic/<relay number>), the payload is 1 if the relay is ON, 0 otherwise
+        """
+
+        last_mask = self._relay_topics_published_mask
+        changed_mask = self.relays_bitmask.relays_mask
+        if last_mask is not None:
+            changed_mask &= status_mask ^ last_mask
+        for relay_number in bits_in_mask(changed_mask):
+            self.mqtt_client.publish_payload(
+                topic=f"{self.mqtt_relays_status_topic}/{relay_number}",
+                payload=RELAY_ON_PAYLOAD if status_mask >> relay_number & 1 else RELAY_OFF_PAYLOAD,
+                retain=self.mqtt_relays_status_retain,
+                replace=True,
+            )
+        self._relay_topics_published_mask = status_mask
+
+    def recover_relays_state(self) -> Optional[int]:
+        """
+        Open the relays state journal, return the last relays status mask journaled (None if
+        none or if the journal is disabled or failed)
+        """
+
+        if not self.relays_journal_file:
+            return None
+        journal = RelaysStateJournal(
+            path=self.relays_journal_file,
+            fsync_period_in_secs=self.relays_journal_fsync_period_in_secs,
+            max_records=self.relays_journal_max_records,
+        )
+        try:
+            last_record = journal.recover()
+            journal.start()
+        except Exception:
+            # The relays are still usable, without journal
+            logger.exception("Relays state journal failed, relays status not journaled")
+            return None
+        # The records waiting for the periodic fsync are written when the service exits
+        atexit.register(journal.stop)
+        self.relays_state_journal = journal
+        if last_record is None:
+            return None
+        return last_record.status_mask & self.relays_bitmask.relays_mask
+
+    def init_relays_status(self, last_status_mask: Optional[int]):
+        """
+        Set the initial relays status, the last status journaled is restored according to the
+        restore policy of each relay (OFF if none)
+        """
+
+        initial_status_mask = self.relays_restore_policy.initial_status_mask(last_status_mask)
+        logger.info(
+            "Initial relays status: %#x (last status journaled: %s)",
+            initial_status_mask,
+            last_status_mask,
+        )
 
-        # Initial relays status
-        initial_relays_status = RelaysStatus(relay_statuses=RELAYS_STATUSES_OFF, command=True)
+        # Initial relays status, a single write per board
+        initial_relays_status = RelaysStatus.from_mask(
+            status_mask=initial_status_mask,
+            validity_mask=self.relays_bitmask.relays_mask,
+            command=True,
+        )
 
         # Set initial status
-        self.set_relays_statuses(relays_status=initial_relays_status, notify=True)
+        self.apply_relays_statuses(relays_status=initial_relays_status, notify=True)
 
     def test_relays_status(self):
         """Used to test the relays in app init"""
 
-        relays_status_off = RelaysStatus(relay_statuses=RELAYS_STATUSES_OFF, command=True)
-        self.set_relays_statuses(relays_status=relays_status_off)
-        time.sleep(0.1)
+        relays_status_off = RelaysStatus.from_mask(
+            status_mask=0, validity_mask=self.relays_bitmask.relays_mask, command=True
+        )
+        self.apply_relays_statuses(relays_status=relays_status_off)
+        time.sleep(self.relays_self_test_step_in_secs)
 
-        for i in range(6):
-            self.set_relays_statuses(
+        for i in range(self.relays_bitmask.relays_number):
+            self.apply_relays_statuses(
                 relays_status=RelaysStatus(
                     relay_statuses=[
-                        SingleRelayStatus(relay_number=i, status=True),
+                        SingleRelayStatus.of(relay_number=i, status=True),
                     ],
                     command=True,
                 )
             )
-            time.sleep(0.1)
+            time.sleep(self.relays_self_test_step_in_secs)
 
     def init_mqtt_service(self):
         """Connect to MQTT broker"""
 
+        # Message ids of the relay commands received, to drop the QoS 1 redeliveries
+        self._relay_command_mids = (
+            RecentCommands(self.mqtt_command_deduplication_size)
+            if self.mqtt_command_deduplication_size
+            else None
+        )
+        # Commands received are applied by a dedicated worker, out of the MQTT network thread
+        # (started once the relays are initialized)
+        self.relays_command_queue = RelaysCommandQueue(
+            apply_command=self.set_relays_statuses,
+            max_size=self.mqtt_command_queue_max_size,
+            coalescing_window_in_secs=self.mqtt_command_coalescing_window_in_secs,
+            deduplication_size=self.mqtt_command_deduplication_size,
+            discard_stale=self.mqtt_command_discard_stale,
+        )
+
         self.mqtt_client = mqtt_client_interface(
             broker_address=self.mqtt_broker_address,
+            broker_port=self.mqtt_broker_port,
             username=self.mqtt_username,
             password=self.mqtt_password,
-            subscriptions={self.mqtt_command_relays_topic: self.set_relays_statuses},
+            subscriptions={
+                self.mqtt_command_relays_topic: self.on_relays_command,
+                self.mqtt_schedule_relays_topic: self.on_relays_schedule_command,
+            },
             reconnection_timeout_in_secs=self.mqtt_reconnection_timeout_in_secs,
             publish_timeout_in_secs=self.mqtt_publish_timeout_in_secs,
+            max_pending_messages=self.mqtt_max_pending_messages,
+            codecs=self.mqtt_topics_codecs,
+            connection_callback=self.on_mqtt_connection,
+            message_classes={self.mqtt_schedule_relays_topic: RelaysScheduleCommand},
+            raw_subscriptions=(
+                {f"{self.mqtt_relay_command_topic}/+": self.on_relay_command}
+                if self.mqtt_relay_command_topics_enabled
+                else None
+            ),
         )
+        self.startup_stages.start(STAGE_MQTT)
         self.mqtt_client.connect()
         self.mqtt_client.loop_start()
 
-        # Start relays status notification service
-        @relays_status_timeloop.job(
-            interval=timedelta(seconds=self.relays_status_notification_period_in_secs)
-        )
-        def send_relays_status():
-            self.notify_relays_status()
+    def start_relays_status_notification(self):
+        """Start relays status notification service"""
 
-        relays_status_timeloop.start(block=False)
+        if self.relays_status_notification_mode == NOTIFICATION_MODE_ON_CHANGE:
+            self.relays_status_notifier = RelaysStatusNotifier(
+                publish_status=self.notify_relays_status,
+                read_status=lambda refresh: self.get_relays_current_mask(refresh=refresh),
+                heartbeat_min_period_in_secs=self.relays_status_heartbeat_min_period_in_secs,
+                heartbeat_max_period_in_secs=self.relays_status_heartbeat_max_period_in_secs,
+                watcher_period_in_secs=self.relays_status_watcher_period_in_secs,
+            )
+            self.relays_status_notifier.start()
+            return
+
+        self.relays_scheduler.add_job(
+            name="relays-status-notification",
+            function=self.notify_relays_status,
+            period_in_secs=self.relays_status_notification_period_in_secs,
+        )
 
 
 relays_manager_service: RelaysManager = RelaysManager()
@@ -0,0 +1,133 @@
+"""
+Relays manager startup stages
+
+The HTTP server is served while the relays manager warms up in background, each stage state is
+reported by the health API
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+STAGE_PENDING = "pending"
+STAGE_RUNNING = "running"
+STAGE_DONE = "done"
+STAGE_FAILED = "failed"
+STAGE_SKIPPED = "skipped"
+
+
+class StartupStage:
+    """Startup stage state"""
+
+    __slots__ = ("name", "state", "started_at", "finished_at", "error")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = STAGE_PENDING
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def to_json(self) -> dict:
+        """Return json dict that represents the StartupStage instance"""
+
+        duration_in_secs = None
+        if self.started_at is not None:
+            end = self.finished_at if self.finished_at is not None else time.monotonic()
+            duration_in_secs = end - self.started_at
+        return {
+            "name": self.name,
+            "state": self.state,
+            "duration_in_secs": duration_in_secs,
+            "error": self.error,
+        }
+
+
+class StartupStages:
+    """
+    Ordered startup stages, ready when every stage is done or skipped (an optional stage may
+    also have failed)
+    """
+
+    def __init__(self, names: Iterable[str], optional_names: Iterable[str] = ()):
+        self._lock = threading.Lock()
+        self._stages: Dict[str, StartupStage] = {name: StartupStage(name) for name in names}
+        self.optional_names = frozenset(optional_names)
+        self.started_at = time.monotonic()
+
+    def _set_state(self, name: str, state: str, error: str = None):
+        """Set stage state"""
+
+        with self._lock:
+            stage = self._stages[name]
+            now = time.monotonic()
+            if state == STAGE_RUNNING:
+                stage.started_at = now
+                stage.finished_at = None
+            elif stage.started_at is None:
+                stage.started_at = now
+            if state != STAGE_RUNNING:
+                stage.finished_at = now
+            stage.state = state
+            stage.error = error
+
+        if state == STAGE_FAILED:
+            logger.error("Startup stage %s failed: %s", name, error)
+        else:
+            logger.info("Startup stage %s %s", name, state)
+
+    def start(self, name: str):
+        """Mark the stage as running"""
+        self._set_state(name, STAGE_RUNNING)
+
+    def done(self, name: str):
+        """Mark the stage as done"""
+        self._set_state(name, STAGE_DONE)
+
+    def fail(self, name: str, error: str):
+        """Mark the stage as failed"""
+        self._set_state(name, STAGE_FAILED, error)
+
+    def skip(self, name: str):
+        """Mark the stage as skipped"""
+        self._set_state(name, STAGE_SKIPPED)
+
+    @contextmanager
+    def run(self, name: str):
+        """Run a stage, marked as failed if an exception is raised (the exception is propagated)"""
+
+        self.start(name)
+        try:
+            yield
+        except Exception as error:
+            self.fail(name, str(error) or type(error).__name__)
+            raise
+        self.done(name)
+
+    def is_done(self, name: str) -> bool:
+        """Check if the stage is done"""
+        return self._stages[name].state == STAGE_DONE
+
+    def _is_finished(self, stage: StartupStage) -> bool:
+        """Check if the stage does not block the readiness"""
+        if stage.state in (STAGE_DONE, STAGE_SKIPPED):
+            return True
+        return stage.state == STAGE_FAILED and stage.name in self.optional_names
+
+    @property
+    def ready(self) -> bool:
+        """Every stage is done or skipped, or failed if optional"""
+        return all(self._is_finished(stage) for stage in self._stages.values())
+
+    def uptime_in_secs(self) -> float:
+        """Time elapsed since the startup"""
+        return time.monotonic() - self.started_at
+
+    def to_json(self) -> List[dict]:
+        """Return json list of the stages, in order"""
+        with self._lock:
+            return [stage.to_json() for stage in self._stages.values()]
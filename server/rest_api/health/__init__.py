@@ -0,0 +1,2 @@
+"""REST API Health package"""
+from .rest_controler import bp
@@ -0,0 +1,48 @@
+""" REST controller for health ressource """
+import logging
+from flask.views import MethodView
+from flask_smorest import Blueprint
+
+from server.relays_manager import relays_manager_service
+from .rest_model import LivenessSchema, ReadinessSchema
+
+logger = logging.getLogger(__name__)
+
+bp = Blueprint("health", __name__, url_prefix="/health")
+""" The api blueprint. Should be registered in app main api object """
+
+
+@bp.route("/live")
+class LivenessApi(MethodView):
+    """API to check the service is alive"""
+
+    @bp.response(status_code=200, schema=LivenessSchema)
+    @bp.alt_response(503, LivenessSchema)
+    def get(self):
+        """Get liveness, the relays I2C executor must be running"""
+
+        alive = relays_manager_service.relays_i2c_executor.is_alive()
+        response = {
+            "alive": alive,
+            "uptime_in_secs": relays_manager_service.startup_stages.uptime_in_secs(),
+        }
+        return response, 200 if alive else 503
+
+
+@bp.route("/ready")
+class ReadinessApi(MethodView):
+    """API to check the service is ready, with the state of each startup stage"""
+
+    @bp.response(status_code=200, schema=ReadinessSchema)
+    @bp.alt_response(503, ReadinessSchema)
+    def get(self):
+        """Get readiness, ready when every required startup stage is done or skipped"""
+
+        startup_stages = relays_manager_service.startup_stages
+        ready = startup_stages.ready
+        response = {
+            "ready": ready,
+            "uptime_in_secs": startup_stages.uptime_in_secs(),
+            "stages": startup_stages.to_json(),
+        }
+        return response, 200 if ready else 503
@@ -0,0 +1,28 @@
+"""REST API models for health package"""
+
+from marshmallow import Schema
+from marshmallow.fields import Boolean, List, Nested, String, Float
+
+
+class StartupStageSchema(Schema):
+    """REST ressource for startup stage"""
+
+    name = String(required=True, allow_none=False)
+    state = String(required=True, allow_none=False)
+    duration_in_secs = Float(required=False, allow_none=True)
+    error = String(required=False, allow_none=True)
+
+
+class LivenessSchema(Schema):
+    """REST ressource for liveness"""
+
+    alive = Boolean(required=True, allow_none=False)
+    uptime_in_secs = Float(required=True, allow_none=False)
+
+
+class ReadinessSchema(Schema):
+    """REST ressource for readiness"""
+
+    ready = Boolean(required=True, allow_none=False)
+    uptime_in_secs = Float(required=True, allow_none=False)
+    stages = List(Nested(StartupStageSchema), required=True)
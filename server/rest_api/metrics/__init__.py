@@ -0,0 +1,2 @@
+"""REST API Metrics package"""
+from .rest_controler import bp
@@ -0,0 +1,32 @@
+""" REST controller for metrics ressource """
+import logging
+from flask import Response
+from flask.views import MethodView
+from flask_smorest import Blueprint
+
+from server.common.metrics import metrics_registry
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+bp = Blueprint("metrics", __name__)
+""" The api blueprint. Should be registered in app main api object """
+
+
+@bp.route("/metrics")
+class MetricsApi(MethodView):
+    """API to scrape the metrics"""
+
+    @bp.doc(
+        responses={
+            200: {
+                "description": "Metrics in the Prometheus text exposition format",
+                "content": {"text/plain": {}},
+            }
+        }
+    )
+    def get(self):
+        """Get metrics"""
+
+        return Response(metrics_registry.render(), content_type=PROMETHEUS_CONTENT_TYPE)
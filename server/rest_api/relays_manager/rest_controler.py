@@ -1,23 +1,55 @@
 """ REST controller for relays management ressource """
+import json
 import logging
 from datetime import datetime
+from flask import Response, g, request, stream_with_context
 from flask.views import MethodView
+from werkzeug.http import http_date
+from marshmallow import INCLUDE
 from flask_smorest import Blueprint
 
 from server.relays_manager import relays_manager_service
-from .rest_model import SingleRelayStatusSchema, RelaysStatusResponseSchema, RelaysStatusQuerySchema
-from server.interfaces.mqtt.model import SingleRelayStatus, RelaysStatus
+from server.relays_manager.executor import RelaysState
+from .rest_model import (
+    SingleRelayStatusSchema,
+    RelaysStatusResponseSchema,
+    RelaysStatusQuerySchema,
+    RelaysStatusRefreshQuerySchema,
+    RelaysBoardSchema,
+    BoardRelayStatusQuerySchema,
+    RelaysStateSchema,
+    RelaysStatePollQuerySchema,
+    RelaysHistoryQuerySchema,
+    RelaysHistorySchema,
+    RelaysDutyCycleQuerySchema,
+    RelaysDutyCycleSchema,
+    RelaysBatchSchema,
+    RelaysPresetSchema,
+    RelaysScheduleQuerySchema,
+    RelaysScheduleSchema,
+    RELAY_QUERY_PREFIX,
+)
+from server.interfaces.mqtt.model import SingleRelayStatus, RelaysStatus, RelaysScheduleCommand
 from server.common import RpiElectricalPanelException, ErrorCode
 
-
-RELAYS = ["relay_0", "relay_1", "relay_2", "relay_3", "relay_4", "relay_5"]
-
 logger = logging.getLogger(__name__)
 
 bp = Blueprint("relays", __name__, url_prefix="/relays")
 """ The api blueprint. Should be registered in app main api object """
 
 
+def set_relays_state_etag(state: RelaysState) -> dict:
+    """
+    Set the ETag of the relays state version, abort with 304 (before serialization) if it
+    matches If-None-Match. Return the Last-Modified headers
+    """
+
+    bp.set_etag(
+        {"instance_id": relays_manager_service.relays_state_instance_id, "version": state.version}
+    )
+    return {"Last-Modified": http_date(state.timestamp), "Cache-Control": "no-cache"}
+
+
 @bp.route("/")
 class RelaysStatusApi(MethodView):
     """API to retrieve or set wifi general status"""
@@ -25,35 +57,41 @@ class RelaysStatusApi(MethodView):
     @bp.doc(
         responses={400: "BAD_REQUEST", 404: "NOT_FOUND"},
     )
+    @bp.etag
+    @bp.arguments(RelaysStatusRefreshQuerySchema, location="query")
     @bp.response(status_code=200, schema=RelaysStatusResponseSchema)
-    def get(self):
-        """Get relays status"""
+    def get(self, args: RelaysStatusRefreshQuerySchema):
+        """Get relays status, 304 if If-None-Match matches the relays state ETag"""
 
-        logger.info(f"GET relays/")
+        logger.info("GET relays/ %s", args)
 
         # Call relays manager services to get relays status
-        _, relays_status = relays_manager_service.get_relays_current_status_instance()
+        state = relays_manager_service.get_relays_state(refresh=args["refresh"])
+        headers = set_relays_state_etag(state)
+        relays_status = relays_manager_service.get_relays_state_status_instance(state)
 
-        return relays_status
+        return relays_status, headers
 
     @bp.doc(responses={400: "BAD_REQUEST"})
-    @bp.arguments(RelaysStatusQuerySchema, location="query")
+    @bp.arguments(RelaysStatusQuerySchema, location="query", unknown=INCLUDE)
     @bp.response(status_code=200, schema=RelaysStatusResponseSchema)
     def post(self, args: RelaysStatusQuerySchema):
         """Set relays status"""
 
-        logger.info(f"POST relays/ {args}")
+        logger.info("POST relays/ %s", args)
 
         # Build RelayStatus instance
-        statuses_from_query = []
-        for relay in RELAYS:
-            if relay in args:
-                statuses_from_query.append(
-                    SingleRelayStatus(relay_number=int(relay.split("_")[1]), status=args[relay]),
-                )
+        statuses_from_query = [
+            SingleRelayStatus.of(relay_number=int(relay[len(RELAY_QUERY_PREFIX) :]), status=status)
+            for relay, status in args.items()
+            if status is not None
+        ]
 
         relays_statuses = RelaysStatus(
-            relay_statuses=statuses_from_query, command=True, timestamp=datetime.now()
+            relay_statuses=statuses_from_query,
+            command=True,
+            timestamp=datetime.now(),
+            correlation_id=g.correlation_id,
         )
 
         # Call relays_manager_service to set relays statuses
@@ -61,6 +99,263 @@ class RelaysStatusApi(MethodView):
         return relays_statuses
 
 
+@bp.route("/batch")
+class RelaysBatchApi(MethodView):
+    """API to set many relays statuses at once"""
+
+    @bp.doc(responses={400: "BAD_REQUEST"})
+    @bp.arguments(RelaysBatchSchema)
+    @bp.response(status_code=200, schema=RelaysStatusResponseSchema)
+    def post(self, args: RelaysBatchSchema):
+        """
+        Set relays statuses in a single command (one write per relays board, one status
+        notification), the last status given for a relay wins
+        """
+
+        logger.info("POST relays/batch %s", args)
+
+        relays_bitmask = relays_manager_service.relays_bitmask
+        relay_statuses = [
+            SingleRelayStatus.of(
+                relay_number=relay_status["relay_number"], status=relay_status["status"]
+            )
+            for relay_status in args["relay_statuses"]
+        ]
+        # Sanity check
+        for relay_status in relay_statuses:
+            if not relays_bitmask.is_valid_relay(relay_status.relay_number):
+                raise RpiElectricalPanelException(
+                    ErrorCode.INVALID_RELAY_NUMBER, str(relay_status.relay_number)
+                )
+
+        set_mask, clear_mask = relays_bitmask.compile(relay_statuses)
+        relays_status = RelaysStatus.from_mask(
+            status_mask=set_mask,
+            validity_mask=set_mask | clear_mask,
+            command=True,
+            timestamp=datetime.now(),
+            correlation_id=g.correlation_id,
+        )
+
+        # Call relays_manager_service to set relays statuses
+        relays_manager_service.set_relays_statuses(relays_status=relays_status, notify=True)
+        return relays_status
+
+
+@bp.route("/presets/")
+class RelaysPresetsApi(MethodView):
+    """API to retrieve the relays presets"""
+
+    @bp.doc(responses={400: "BAD_REQUEST"})
+    @bp.response(status_code=200, schema=RelaysPresetSchema(many=True))
+    def get(self):
+        """Get relays presets"""
+
+        logger.info("GET relays/presets/")
+
+        return list(relays_manager_service.relays_presets.values())
+
+
+@bp.route("/presets/<preset>")
+class RelaysPresetApi(MethodView):
+    """API to retrieve or apply a relays preset"""
+
+    @bp.doc(responses={400: "BAD_REQUEST"})
+    @bp.response(status_code=200, schema=RelaysPresetSchema)
+    def get(self, preset: str):
+        """Get relays preset"""
+
+        logger.info("GET relays/presets/%s", preset)
+
+        return relays_manager_service.get_relays_preset(preset)
+
+    @bp.doc(responses={400: "BAD_REQUEST"})
+    @bp.response(status_code=200, schema=RelaysStatusResponseSchema)
+    def post(self, preset: str):
+        """Apply relays preset in a single command"""
+
+        logger.info("POST relays/presets/%s", preset)
+
+        return relays_manager_service.apply_relays_preset(preset, correlation_id=g.correlation_id)
+
+
+@bp.route("/schedules/")
+class RelaysSchedulesApi(MethodView):
+    """API to retrieve or add relays schedules"""
+
+    @bp.doc(responses={400: "BAD_REQUEST"})
+    @bp.response(status_code=200, schema=RelaysScheduleSchema(many=True))
+    def get(self):
+        """Get pending relays schedules"""
+
+        logger.info("GET relays/schedules/")
+
+        return relays_manager_service.relays_scheduler.get_schedules()
+
+    @bp.doc(responses={400: "BAD_REQUEST"})
+    @bp.arguments(RelaysScheduleQuerySchema)
+    @bp.response(status_code=201, schema=RelaysScheduleSchema)
+    def post(self, args: RelaysScheduleQuerySchema):
+        """
+        Add relays schedule: on at a datetime (start), off after a delay (delay_in_secs),
+        pulse (duration_in_secs), recurring window (period_in_secs and duration_in_secs)
+        """
+
+        logger.info("POST relays/schedules/ %s", args)
+
+        schedule_command = RelaysScheduleCommand(
+            relay_statuses=[
+                SingleRelayStatus.of(
+                    relay_number=relay_status["relay_number"], status=relay_status["status"]
+                )
+                for relay_status in args["relay_statuses"]
+            ],
+            start=args.get("start"),
+            delay_in_secs=args.get("delay_in_secs"),
+            duration_in_secs=args.get("duration_in_secs"),
+            period_in_secs=args.get("period_in_secs"),
+        )
+        return relays_manager_service.schedule_relays(schedule_command)
+
+
+@bp.route("/schedules/<int:schedule_id>")
+class RelaysScheduleApi(MethodView):
+    """API to retrieve or cancel a relays schedule"""
+
+    @bp.doc(responses={400: "BAD_REQUEST"})
+    @bp.response(status_code=200, schema=RelaysScheduleSchema)
+    def get(self, schedule_id: int):
+        """Get relays schedule"""
+
+        logger.info("GET relays/schedules/%s", schedule_id)
+
+        return relays_manager_service.get_relays_schedule(schedule_id)
+
+    @bp.doc(responses={400: "BAD_REQUEST"})
+    @bp.response(status_code=200, schema=RelaysScheduleSchema)
+    def delete(self, schedule_id: int):
+        """Cancel relays schedule, the relays statuses are not reverted"""
+
+        logger.info("DELETE relays/schedules/%s", schedule_id)
+
+        return relays_manager_service.cancel_relays_schedule(schedule_id)
+
+
+def relays_state_event(state) -> str:
+    """Format the relays state as a server-sent event, the event id is the state version"""
+    data = json.dumps(state.to_json(), separators=(",", ":"))
+    return f"id: {state.version}\nevent: relays\ndata: {data}\n\n"
+
+
+@bp.route("/stream")
+class RelaysStateStreamApi(MethodView):
+    """API to stream the relays state changes"""
+
+    @bp.doc(
+        responses={
+            200: {
+                "description": "Server-sent events stream, a relays event is sent on each relays "
+                "state change (data: version, status_mask, timestamp_ms)",
+                "content": {"text/event-stream": {}},
+            },
+            503: "SERVICE_UNAVAILABLE",
+        }
+    )
+    def get(self):
+        """
+        Stream the relays state changes (server-sent events). The current state is sent first,
+        unless the Last-Event-ID header matches its version
+        """
+
+        logger.info("GET relays/stream")
+
+        last_event_id = request.headers.get("Last-Event-ID")
+        version = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+        # Fail before streaming if the relays are not ready
+        relays_manager_service.get_relays_state()
+        keepalive_period_in_secs = relays_manager_service.relays_stream_keepalive_period_in_secs
+
+        def stream():
+            last_version = version
+            while True:
+                state = relays_manager_service.wait_for_relays_state_change(
+                    last_version, keepalive_period_in_secs
+                )
+                if state.version == last_version:
+                    yield ": keepalive\n\n"
+                    continue
+                last_version = state.version
+                yield relays_state_event(state)
+
+        return Response(
+            stream_with_context(stream()),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+
+@bp.route("/poll")
+class RelaysStatePollApi(MethodView):
+    """API to wait for a relays state change (long polling)"""
+
+    @bp.doc(responses={503: "SERVICE_UNAVAILABLE"})
+    @bp.arguments(RelaysStatePollQuerySchema, location="query")
+    @bp.response(status_code=200, schema=RelaysStateSchema)
+    def get(self, args: RelaysStatePollQuerySchema):
+        """
+        Get relays state once its version differs from the version given, the current state is
+        returned if the timeout elapsed (capped by the server) or if no version is given
+        """
+
+        logger.info("GET relays/poll %s", args)
+
+        timeout = min(args["timeout"], relays_manager_service.relays_long_poll_max_timeout_in_secs)
+        state = relays_manager_service.wait_for_relays_state_change(args["version"], timeout)
+        return state.to_json()
+
+
+@bp.route("/history")
+class RelaysHistoryApi(MethodView):
+    """API to retrieve the relays status transitions"""
+
+    @bp.doc(responses={400: "BAD_REQUEST"})
+    @bp.arguments(RelaysHistoryQuerySchema, location="query")
+    @bp.response(status_code=200, schema=RelaysHistorySchema)
+    def get(self, args: RelaysHistoryQuerySchema):
+        """
+        Get the relays status transitions of the last window_in_secs (only the transitions of
+        the relay if given), the most recent ones if there are more than limit
+        """
+
+        logger.info("GET relays/history %s", args)
+
+        return relays_manager_service.get_relays_history(
+            window_in_secs=args["window_in_secs"], relay_number=args["relay"], limit=args["limit"]
+        )
+
+
+@bp.route("/history/duty_cycle")
+class RelaysDutyCycleApi(MethodView):
+    """API to retrieve the relays duty cycles"""
+
+    @bp.doc(responses={400: "BAD_REQUEST"})
+    @bp.arguments(RelaysDutyCycleQuerySchema, location="query")
+    @bp.response(status_code=200, schema=RelaysDutyCycleSchema)
+    def get(self, args: RelaysDutyCycleQuerySchema):
+        """
+        Get the fraction of time each relay (or the relay if given) was ON during the last
+        window_in_secs, downsampled into buckets (null if the status is unknown)
+        """
+
+        logger.info("GET relays/history/duty_cycle %s", args)
+
+        return relays_manager_service.get_relays_duty_cycles(
+            window_in_secs=args["window_in_secs"],
+            buckets_number=args["buckets"],
+            relay_number=args["relay"],
+        )
+
+
 @bp.route("/single/<relay>")
 class WifiBandsStatusApi(MethodView):
     """API to retrieve single relay status"""
@@ -68,14 +363,23 @@ class WifiBandsStatusApi(MethodView):
     @bp.doc(
         responses={400: "BAD_REQUEST", 404: "NOT_FOUND"},
     )
+    @bp.etag
+    @bp.arguments(RelaysStatusRefreshQuerySchema, location="query")
     @bp.response(status_code=200, schema=SingleRelayStatusSchema)
-    def get(self, relay: str):
-        """Get single relay status"""
+    def get(self, args: RelaysStatusRefreshQuerySchema, relay: str):
+        """Get single relay status, 304 if If-None-Match matches the relays state ETag"""
 
-        logger.info(f"GET relays/single/{relay}")
+        logger.info("GET relays/single/%s %s", relay, args)
 
+        relay_number = int(relay)
+        relays_manager_service.check_relay_number(relay_number)
         # Call relays_manager_service to get relay status
-        return relays_manager_service.get_single_relay_status_instance(int(relay))
+        state = relays_manager_service.get_relays_state(refresh=args["refresh"])
+        headers = set_relays_state_etag(state)
+        return (
+            relays_manager_service.get_single_relay_state_status_instance(relay_number, state),
+            headers,
+        )
 
     @bp.doc(responses={400: "BAD_REQUEST"})
     @bp.arguments(SingleRelayStatusSchema, location="query")
@@ -83,7 +387,7 @@ class WifiBandsStatusApi(MethodView):
     def post(self, args: SingleRelayStatusSchema, relay: str):
         """Set single relays status"""
 
-        logger.info(f"POST relays/sinle/{relay} {args}")
+        logger.info("POST relays/sinle/%s %s", relay, args)
 
         relay_number = int(relay)
         # Sanity check
@@ -91,16 +395,75 @@ class WifiBandsStatusApi(MethodView):
             raise RpiElectricalPanelException(ErrorCode.RELAYS_NUMBER_DONT_MATCH)
 
         # Sanity check
-        if relay_number not in range(0, 6):
+        if not relays_manager_service.relays_bitmask.is_valid_relay(relay_number):
             raise RpiElectricalPanelException(ErrorCode.INVALID_RELAY_NUMBER)
 
-        single_relay_status = SingleRelayStatus(relay_number=relay_number, status=args["status"])
+        single_relay_status = SingleRelayStatus.of(relay_number=relay_number, status=args["status"])
+
+        # Call relays_manager_service to set relays statuses
+        relays_status = RelaysStatus(
+            relay_statuses=[single_relay_status],
+            command=True,
+            timestamp=datetime.now(),
+            correlation_id=g.correlation_id,
+        )
+        relays_manager_service.set_relays_statuses(relays_status=relays_status, notify=True)
+
+        return single_relay_status
+
+
+@bp.route("/boards/")
+class RelaysBoardsApi(MethodView):
+    """API to retrieve the relays boards"""
+
+    @bp.doc(responses={400: "BAD_REQUEST"})
+    @bp.response(status_code=200, schema=RelaysBoardSchema(many=True))
+    def get(self):
+        """Get relays boards, with the global number of their first relay"""
+
+        logger.info("GET relays/boards/")
+
+        return relays_manager_service.relays_boards
+
+
+@bp.route("/boards/<board>/<relay>")
+class BoardRelayStatusApi(MethodView):
+    """API to retrieve or set a relay addressed by board and relay number in the board"""
+
+    @bp.doc(responses={400: "BAD_REQUEST"})
+    @bp.etag
+    @bp.arguments(RelaysStatusRefreshQuerySchema, location="query")
+    @bp.response(status_code=200, schema=SingleRelayStatusSchema)
+    def get(self, args: RelaysStatusRefreshQuerySchema, board: str, relay: str):
+        """Get board relay status, the relay number returned is the global one"""
+
+        logger.info("GET relays/boards/%s/%s %s", board, relay, args)
+
+        relay_number = relays_manager_service.get_board_relay_number(board, int(relay))
+        state = relays_manager_service.get_relays_state(refresh=args["refresh"])
+        headers = set_relays_state_etag(state)
+        return (
+            relays_manager_service.get_single_relay_state_status_instance(relay_number, state),
+            headers,
+        )
+
+    @bp.doc(responses={400: "BAD_REQUEST"})
+    @bp.arguments(BoardRelayStatusQuerySchema, location="query")
+    @bp.response(status_code=200, schema=SingleRelayStatusSchema)
+    def post(self, args: BoardRelayStatusQuerySchema, board: str, relay: str):
+        """Set board relay status, the relay number returned is the global one"""
+
+        logger.info("POST relays/boards/%s/%s %s", board, relay, args)
+
+        relay_number = relays_manager_service.get_board_relay_number(board, int(relay))
+        single_relay_status = SingleRelayStatus.of(relay_number=relay_number, status=args["status"])
 
         # Call relays_manager_service to set relays statuses
         relays_status = RelaysStatus(
             relay_statuses=[single_relay_status],
             command=True,
             timestamp=datetime.now(),
+            correlation_id=g.correlation_id,
         )
         relays_manager_service.set_relays_statuses(relays_status=relays_status, notify=True)
 
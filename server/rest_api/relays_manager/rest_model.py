@@ -1,11 +1,20 @@
 """REST API models for relays manager package"""
 
-from marshmallow import Schema
-from marshmallow.fields import Boolean, List, Integer, Nested, DateTime
+import re
+from marshmallow import Schema, INCLUDE, ValidationError, post_load
+from marshmallow.fields import Boolean, List, Integer, Nested, DateTime, String, Float
+from marshmallow.validate import Length, Range
+
+from server.common import RpiElectricalPanelException, ErrorCode
+from server.relays_manager import relays_manager_service
 
 # Datetime naive format to use for serialization
 API_NAIVE_DATETIME_FORMAT: str = "%Y-%m-%dT%H:%M:%S"
 
+# Relays status query parameters are relay_<global relay number>
+RELAY_QUERY_PREFIX: str = "relay_"
+RELAY_QUERY_PATTERN = re.compile(rf"^{RELAY_QUERY_PREFIX}\d+$")
+
 
 class SingleRelayStatusSchema(Schema):
     """REST ressource for single relay status"""
@@ -22,8 +31,34 @@ class RelaysStatusResponseSchema(Schema):
     timestamp = DateTime(required=True, format=API_NAIVE_DATETIME_FORMAT)
 
 
+class RelaysBatchSchema(Schema):
+    """REST ressource for relays batch command, the last status given for a relay wins"""
+
+    relay_statuses = List(Nested(SingleRelayStatusSchema), required=True, validate=Length(min=1))
+
+
+class RelaysPresetSchema(Schema):
+    """REST ressource for relays preset"""
+
+    name = String(required=True)
+    relays_on = List(Integer(), required=True)
+    relays_off = List(Integer(), required=True)
+
+
+class RelaysStatusRefreshQuerySchema(Schema):
+    """REST ressource for relays status read query"""
+
+    refresh = Boolean(required=False, allow_none=False, load_default=False)
+
+
 class RelaysStatusQuerySchema(Schema):
-    """REST ressource for relays status query"""
+    """
+    REST ressource for relays status query, the relays of the first board are documented,
+    relay_<n> is accepted for any relay
+    """
+
+    class Meta:
+        unknown = INCLUDE
 
     relay_0 = Boolean(required=False, allow_none=True, default=None)
     relay_1 = Boolean(required=False, allow_none=True, default=None)
@@ -31,3 +66,143 @@ class RelaysStatusQuerySchema(Schema):
     relay_3 = Boolean(required=False, allow_none=True, default=None)
     relay_4 = Boolean(required=False, allow_none=True, default=None)
     relay_5 = Boolean(required=False, allow_none=True, default=None)
+
+    @post_load
+    def load_relays(self, data: dict, **kwargs):
+        """Validate the relay_<n> parameters not declared and the relays numbers"""
+        for name, value in data.items():
+            if not RELAY_QUERY_PATTERN.match(name):
+                raise ValidationError("Unknown field.", field_name=name)
+            relay_number = int(name[len(RELAY_QUERY_PREFIX) :])
+            if not relays_manager_service.relays_bitmask.is_valid_relay(relay_number):
+                raise RpiElectricalPanelException(ErrorCode.INVALID_RELAY_NUMBER, str(relay_number))
+            if name not in self.fields:
+                data[name] = Boolean(allow_none=True).deserialize(value, name, data)
+        return data
+
+
+class BoardRelayStatusQuerySchema(Schema):
+    """REST ressource for board relay status query"""
+
+    status = Boolean(required=True, allow_none=False)
+
+
+class RelaysBoardSchema(Schema):
+    """REST ressource for relays board"""
+
+    name = String(required=True)
+    bus_number = Integer(required=True)
+    address = Integer(required=True)
+    first_relay = Integer(required=True)
+    relays_number = Integer(required=True)
+
+
+class RelaysStateSchema(Schema):
+    """REST ressource for relays state (compact event of the relays state changes)"""
+
+    version = Integer(required=True)
+    status_mask = Integer(required=True)
+    timestamp_ms = Integer(required=True)
+
+
+class RelaysStatePollQuerySchema(Schema):
+    """REST ressource for relays state long polling query"""
+
+    version = Integer(required=False, allow_none=True, load_default=None)
+    timeout = Float(required=False, allow_none=False, load_default=30, validate=Range(min=0))
+
+
+class RelaysHistoryQuerySchema(Schema):
+    """REST ressource for relays history query, the window ends now"""
+
+    window_in_secs = Float(
+        required=False,
+        allow_none=False,
+        load_default=86400,
+        validate=Range(min=0, min_inclusive=False),
+    )
+    relay = Integer(required=False, allow_none=True, load_default=None)
+    limit = Integer(
+        required=False, allow_none=False, load_default=1000, validate=Range(min=1, max=10000)
+    )
+
+
+class RelaysTransitionSchema(Schema):
+    """REST ressource for relays status transition"""
+
+    timestamp_ms = Integer(required=True)
+    status_mask = Integer(required=True)
+    relays_on = List(Integer(), required=True)
+    source = String(required=True)
+
+
+class RelaysHistorySchema(Schema):
+    """REST ressource for relays history, the most recent transitions of the window"""
+
+    start_ms = Integer(required=True)
+    end_ms = Integer(required=True)
+    initial_status_mask = Integer(required=True, allow_none=True)
+    transitions = List(Nested(RelaysTransitionSchema), required=True)
+    truncated = Boolean(required=True)
+
+
+class RelaysDutyCycleQuerySchema(Schema):
+    """REST ressource for relays duty cycle query, the window ends now"""
+
+    window_in_secs = Float(
+        required=False,
+        allow_none=False,
+        load_default=86400,
+        validate=Range(min=0, min_inclusive=False),
+    )
+    buckets = Integer(
+        required=False, allow_none=False, load_default=24, validate=Range(min=1, max=1440)
+    )
+    relay = Integer(required=False, allow_none=True, load_default=None)
+
+
+class RelayDutyCycleSchema(Schema):
+    """REST ressource for the duty cycle of a relay, fraction of time ON in each bucket"""
+
+    relay_number = Integer(required=True)
+    duty_cycles = List(Float(allow_none=True), required=True)
+
+
+class RelaysDutyCycleSchema(Schema):
+    """REST ressource for relays duty cycles, the window is downsampled into buckets"""
+
+    start_ms = Integer(required=True)
+    end_ms = Integer(required=True)
+    bucket_in_secs = Float(required=True)
+    relays = List(Nested(RelayDutyCycleSchema), required=True)
+
+
+class RelaysScheduleQuerySchema(Schema):
+    """
+    REST ressource for relays schedule creation: relays statuses applied at start (or after
+    delay_in_secs), reverted after duration_in_secs if given and repeated every period_in_secs
+    if given
+    """
+
+    relay_statuses = List(Nested(SingleRelayStatusSchema), required=True, validate=Length(min=1))
+    start = DateTime(required=False, allow_none=True, format=API_NAIVE_DATETIME_FORMAT)
+    delay_in_secs = Float(required=False, allow_none=True, validate=Range(min=0))
+    duration_in_secs = Float(
+        required=False, allow_none=True, validate=Range(min=0, min_inclusive=False)
+    )
+    period_in_secs = Float(
+        required=False, allow_none=True, validate=Range(min=0, min_inclusive=False)
+    )
+
+
+class RelaysScheduleSchema(Schema):
+    """REST ressource for relays schedule"""
+
+    schedule_id = Integer(required=True)
+    relays_on = List(Integer(), required=True)
+    relays_off = List(Integer(), required=True)
+    next_start = DateTime(
+        required=True, format=API_NAIVE_DATETIME_FORMAT, attribute="next_start_datetime"
+    )
+    duration_in_secs = Float(required=False, allow_none=True)
+    period_in_secs = Float(required=False, allow_none=True)
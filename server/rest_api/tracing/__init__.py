@@ -0,0 +1,2 @@
+"""REST API Tracing package"""
+from .rest_controler import bp
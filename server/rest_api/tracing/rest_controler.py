@@ -0,0 +1,53 @@
+""" REST controller for tracing ressource """
+import logging
+from typing import List
+from flask.views import MethodView
+from flask_smorest import Blueprint
+
+from server.common import RpiElectricalPanelException, ErrorCode
+from server.common.tracing import Span, tracer
+from .rest_model import TraceSchema, TracesQuerySchema
+
+logger = logging.getLogger(__name__)
+
+bp = Blueprint("tracing", __name__, url_prefix="/traces")
+""" The api blueprint. Should be registered in app main api object """
+
+
+def to_trace(correlation_id: str, spans: List[Span]) -> dict:
+    """Return json dict of the trace, its duration is from the first span start to the last end"""
+
+    end = max(span.start + span.duration_in_secs for span in spans)
+    return {
+        "correlation_id": correlation_id,
+        "duration_in_secs": end - spans[0].start,
+        "spans": spans,
+    }
+
+
+@bp.route("/")
+class TracesApi(MethodView):
+    """API to retrieve the last traces"""
+
+    @bp.arguments(TracesQuerySchema, location="query")
+    @bp.response(status_code=200, schema=TraceSchema(many=True))
+    def get(self, args: TracesQuerySchema):
+        """Get the last traces, most recent first"""
+
+        traces = tracer.get_traces(limit=args["limit"])
+        return [to_trace(correlation_id, spans) for correlation_id, spans in traces.items()]
+
+
+@bp.route("/<correlation_id>")
+class TraceApi(MethodView):
+    """API to retrieve the trace of a correlation id"""
+
+    @bp.doc(responses={404: "NOT_FOUND"})
+    @bp.response(status_code=200, schema=TraceSchema)
+    def get(self, correlation_id: str):
+        """Get the trace of a correlation id (X-Correlation-ID of REST requests)"""
+
+        spans = tracer.get_trace(correlation_id)
+        if not spans:
+            raise RpiElectricalPanelException(ErrorCode.UNKNOWN_TRACE, correlation_id)
+        return to_trace(correlation_id, spans)
@@ -0,0 +1,28 @@
+"""REST API models for tracing package"""
+
+from marshmallow import Schema
+from marshmallow.fields import Dict, Float, Integer, List, Nested, String
+from marshmallow.validate import Range
+
+
+class SpanSchema(Schema):
+    """REST ressource for trace span"""
+
+    name = String(required=True, allow_none=False)
+    start = Float(required=True, allow_none=False)
+    duration_in_secs = Float(required=True, allow_none=False)
+    attributes = Dict(required=True)
+
+
+class TraceSchema(Schema):
+    """REST ressource for trace, the spans of a correlation id"""
+
+    correlation_id = String(required=True, allow_none=False)
+    duration_in_secs = Float(required=True, allow_none=False)
+    spans = List(Nested(SpanSchema), required=True)
+
+
+class TracesQuerySchema(Schema):
+    """REST query parameters for traces"""
+
+    limit = Integer(required=False, load_default=20, validate=Range(min=1, max=1000))
@@ -0,0 +1,48 @@
+import os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from server.interfaces.mqtt.model import SingleRelayStatus, RelaysStatus
+from server.interfaces.mqtt.codec import CODECS, deserialize
+import timeit
+
+ITERATIONS = 20000
+
+MESSAGES = {
+    "status (6 relays)": RelaysStatus(
+        relay_statuses=[SingleRelayStatus(relay_number=i, status=bool(i % 2)) for i in range(6)],
+        command=False,
+    ),
+    "command (1 relay)": RelaysStatus(
+        relay_statuses=[SingleRelayStatus(relay_number=3, status=True)], command=True
+    ),
+}
+
+
+def benchmark(codec, message):
+    """Return (payload size, encodes per sec, decodes per sec, autodetected decodes per sec)"""
+
+    payload = codec.encode(message)
+    encode_time = timeit.timeit(lambda: codec.encode(message), number=ITERATIONS)
+    decode_time = timeit.timeit(lambda: codec.decode(payload), number=ITERATIONS)
+    detect_time = timeit.timeit(lambda: deserialize(payload), number=ITERATIONS)
+    return (
+        len(payload),
+        ITERATIONS / encode_time,
+        ITERATIONS / decode_time,
+        ITERATIONS / detect_time,
+    )
+
+
+if __name__ == "__main__":
+    print(f"{ITERATIONS} iterations per measure\n")
+    print(
+        f"{'message':<20}{'codec':<10}{'bytes':>8}{'encode/s':>12}{'decode/s':>12}{'detect+decode/s':>17}"
+    )
+    for message_name, message in MESSAGES.items():
+        for codec_name, codec in CODECS.items():
+            size, encodes, decodes, detects = benchmark(codec, message)
+            print(
+                f"{message_name:<20}{codec_name:<10}{size:>8}{encodes:>12.0f}{decodes:>12.0f}"
+                f"{detects:>17.0f}"
+            )
@@ -0,0 +1,266 @@
+"""
+Local MQTT broker stand-in
+
+Minimal in-process MQTT 3.1.1 broker for the benchmarks: QoS 0 and 1 (PUBACK sent on receipt,
+deliveries not retried), retained messages, + and # wildcards, no authentication and no
+persistence. Each client connection is served by its own thread.
+"""
+
+import socket
+import struct
+import threading
+from typing import Dict, Tuple
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+
+def read_exact(sock: socket.socket, size: int) -> bytes:
+    """Read size bytes, raise ConnectionError if the connection is closed"""
+
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Connection closed")
+        data += chunk
+    return bytes(data)
+
+
+def read_packet(sock: socket.socket) -> Tuple[int, bytes]:
+    """Read a packet, return its fixed header byte and its body"""
+
+    header = read_exact(sock, 1)[0]
+    multiplier, length = 1, 0
+    while True:
+        byte = read_exact(sock, 1)[0]
+        length += (byte & 0x7F) * multiplier
+        multiplier *= 128
+        if not byte & 0x80:
+            break
+    return header, read_exact(sock, length) if length else b""
+
+
+def encode_remaining_length(length: int) -> bytes:
+    """Encode the remaining length of a packet (variable length integer)"""
+
+    encoded = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        if length:
+            byte |= 0x80
+        encoded.append(byte)
+        if not length:
+            return bytes(encoded)
+
+
+def packet(packet_type: int, flags: int = 0, body: bytes = b"") -> bytes:
+    """Build a packet"""
+    return bytes([packet_type << 4 | flags]) + encode_remaining_length(len(body)) + body
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    """Return True if the topic matches the filter (+ and # wildcards)"""
+
+    filter_levels, topic_levels = topic_filter.split("/"), topic.split("/")
+    for index, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if index >= len(topic_levels) or level not in ("+", topic_levels[index]):
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+class _Session:
+    """Client connection"""
+
+    __slots__ = ("sock", "subscriptions", "send_lock")
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.subscriptions: Dict[str, int] = {}
+        """ QoS of each topic filter """
+        self.send_lock = threading.Lock()
+
+    def send(self, data: bytes):
+        """Send data, ignored if the connection is lost"""
+
+        with self.send_lock:
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                pass
+
+
+class LocalBroker:
+    """In-process MQTT broker, port 0 binds a free port"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self._server = socket.socket()
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((host, port))
+        self._server.listen(16)
+        self.host = host
+        self.port = self._server.getsockname()[1]
+        self._lock = threading.Lock()
+        self._sessions: Dict[socket.socket, _Session] = {}
+        self._retained: Dict[str, Tuple[bytes, int]] = {}
+        self._message_id = 0
+        self.messages_received = 0
+        self.messages_delivered = 0
+
+    def start(self) -> "LocalBroker":
+        """Start accepting connections"""
+
+        threading.Thread(target=self._accept, name="local-broker", daemon=True).start()
+        return self
+
+    def stop(self):
+        """Stop accepting connections and close the client connections"""
+
+        self._server.close()
+        with self._lock:
+            sessions = list(self._sessions.values())
+        for session in sessions:
+            try:
+                session.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _accept(self):
+        """Accept loop"""
+
+        while True:
+            try:
+                sock, _ = self._server.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._serve, args=(sock,), daemon=True).start()
+
+    def _publish_packet(self, topic: str, payload: bytes, qos: int, retain: bool) -> bytes:
+        """Build a PUBLISH packet"""
+
+        encoded_topic = topic.encode()
+        body = struct.pack("!H", len(encoded_topic)) + encoded_topic
+        if qos:
+            with self._lock:
+                self._message_id = self._message_id % 65535 + 1
+                body += struct.pack("!H", self._message_id)
+        return packet(PUBLISH, qos << 1 | int(retain), body + payload)
+
+    def _deliver(self, topic: str, payload: bytes, qos: int):
+        """Deliver a message to the matching subscriptions"""
+
+        with self._lock:
+            targets = []
+            for session in self._sessions.values():
+                granted_qos = [
+                    subscription_qos
+                    for topic_filter, subscription_qos in session.subscriptions.items()
+                    if topic_matches(topic_filter, topic)
+                ]
+                if granted_qos:
+                    targets.append((session, min(qos, max(granted_qos))))
+            self.messages_delivered += len(targets)
+        for session, delivery_qos in targets:
+            session.send(self._publish_packet(topic, payload, delivery_qos, False))
+
+    def _on_publish(self, session: _Session, flags: int, body: bytes):
+        """Handle a PUBLISH packet"""
+
+        qos = flags >> 1 & 3
+        retain = flags & 1
+        topic_length = struct.unpack_from("!H", body)[0]
+        topic = body[2 : 2 + topic_length].decode()
+        offset = 2 + topic_length
+        if qos:
+            session.send(packet(PUBACK, body=body[offset : offset + 2]))
+            offset += 2
+        payload = body[offset:]
+        with self._lock:
+            self.messages_received += 1
+            if retain:
+                if payload:
+                    self._retained[topic] = (payload, qos)
+                else:
+                    self._retained.pop(topic, None)
+        self._deliver(topic, payload, qos)
+
+    def _on_subscribe(self, session: _Session, body: bytes):
+        """Handle a SUBSCRIBE packet, the matching retained messages are sent"""
+
+        offset, granted = 2, bytearray()
+        topic_filters = []
+        while offset < len(body):
+            length = struct.unpack_from("!H", body, offset)[0]
+            topic_filter = body[offset + 2 : offset + 2 + length].decode()
+            qos = min(body[offset + 2 + length], 1)
+            offset += 3 + length
+            with self._lock:
+                session.subscriptions[topic_filter] = qos
+            granted.append(qos)
+            topic_filters.append((topic_filter, qos))
+        session.send(packet(SUBACK, body=body[:2] + bytes(granted)))
+        with self._lock:
+            retained = list(self._retained.items())
+        for topic_filter, qos in topic_filters:
+            for topic, (payload, retained_qos) in retained:
+                if topic_matches(topic_filter, topic):
+                    session.send(self._publish_packet(topic, payload, min(qos, retained_qos), True))
+
+    def _on_unsubscribe(self, session: _Session, body: bytes):
+        """Handle an UNSUBSCRIBE packet"""
+
+        offset = 2
+        while offset < len(body):
+            length = struct.unpack_from("!H", body, offset)[0]
+            with self._lock:
+                session.subscriptions.pop(body[offset + 2 : offset + 2 + length].decode(), None)
+            offset += 2 + length
+        session.send(packet(UNSUBACK, body=body[:2]))
+
+    def _serve(self, sock: socket.socket):
+        """Client connection loop"""
+
+        session = _Session(sock)
+        with self._lock:
+            self._sessions[sock] = session
+        try:
+            while True:
+                header, body = read_packet(sock)
+                packet_type, flags = header >> 4, header & 0x0F
+                if packet_type == CONNECT:
+                    session.send(packet(CONNACK, body=b"\x00\x00"))
+                elif packet_type == PUBLISH:
+                    self._on_publish(session, flags, body)
+                elif packet_type == SUBSCRIBE:
+                    self._on_subscribe(session, body)
+                elif packet_type == UNSUBSCRIBE:
+                    self._on_unsubscribe(session, body)
+                elif packet_type == PINGREQ:
+                    session.send(packet(PINGRESP))
+                elif packet_type == DISCONNECT:
+                    break
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            with self._lock:
+                self._sessions.pop(sock, None)
+            sock.close()
+
+
+if __name__ == "__main__":
+    local_broker = LocalBroker(port=1883).start()
+    print(f"Local broker listening on {local_broker.host}:{local_broker.port}")
+    threading.Event().wait()
@@ -0,0 +1,418 @@
+"""
+MQTT relays commands benchmark
+
+A local broker stand-in is started, the app is created with create_app() on a simulated I2C bus
+and connected to it. Relays commands are published on MQTT_COMMAND_RELAYS_TOPIC at increasing
+rates, each command carrying its own correlation id. For each rate the commands are followed
+through the tracing spans and the relays status publications:
+
+    actuation latency: from the command publication to the end of the relays apply (the
+                       command applied alone or merged with the next commands)
+    status latency:    from the command publication to the reception of the first relays
+                       status published after its actuation
+    dropped:           commands never queued (lost, duplicated or received while stopping)
+    duplicated:        commands delivered more than once / status received more than once
+
+The saturation point is the first rate with dropped commands, an actuation p99 over the
+latency limit or an achieved rate under the target.
+
+    python test_scripts/mqtt_benchmark.py --rates 50,100,200,400,800,1600 --step-duration 5
+"""
+
+import argparse
+import bisect
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import paho.mqtt.client as mqtt
+
+from server.app import create_app
+from server.common.tracing import tracer
+from server.interfaces.mqtt.client import MESSAGES_RECEIVED
+from server.interfaces.mqtt.codec import CODECS, DEFAULT_CODEC, deserialize, serialize
+from server.interfaces.mqtt.model import RelaysStatus
+from server.relays_manager import relays_manager_service
+from server.relays_manager.command_queue import (
+    COMMANDS_COALESCED,
+    COMMANDS_DROPPED,
+    COMMANDS_DUPLICATED,
+    COMMANDS_STALE,
+)
+from server.relays_manager.service import STAGE_RELAYS_STATUS
+from test_scripts.local_broker import LocalBroker
+
+CONFIG_DIR = os.path.join(os.path.dirname(__file__), "..", "server", "config")
+RELAYS_NUMBER = 6
+ALL_RELAYS_MASK = (1 << RELAYS_NUMBER) - 1
+
+# App configuration overridden for the benchmark, MQTT_BROKER_PORT is the local broker port
+CONFIG_OVERRIDES = {
+    "MQTT_BROKER_ADDRESS": "127.0.0.1",
+    "RELAYS_BUS_BACKEND": "simulated",
+    "RELAYS_SELF_TEST_ENABLED": False,
+    "RELAYS_JOURNAL_FILE": None,
+    "RELAYS_STATUS_NOTIFICATION_MODE": "on_change",
+    "TRACING_ENABLED": True,
+    "TRACING_MAX_SPANS": 1000000,
+    "TRACING_EXPORT_FILE": None,
+}
+
+
+def percentile(sorted_values: List[float], percent: float) -> float:
+    """Percentile of sorted values (nearest rank)"""
+    if not sorted_values:
+        return float("nan")
+    rank = max(0, min(len(sorted_values) - 1, int(round(percent / 100 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+def counter_value(counter) -> float:
+    """Current value of a counter without labels"""
+    return counter.labels().value
+
+
+def create_benchmark_app(config_dir: str, broker_port: int):
+    """Create the app connected to the local broker, wait for its warm up"""
+
+    with open(os.path.join(CONFIG_DIR, "rpi-electrical-panel-config.yml")) as stream:
+        config = yaml.full_load(stream)
+    config.update(CONFIG_OVERRIDES, MQTT_BROKER_PORT=broker_port)
+    with open(os.path.join(config_dir, "rpi-electrical-panel-config.yml"), "w") as stream:
+        yaml.dump(config, stream)
+    shutil.copy(os.path.join(CONFIG_DIR, "logging-config.yml"), config_dir)
+    os.makedirs("logs", exist_ok=True)
+
+    app = create_app(config_dir=config_dir)
+    deadline = time.monotonic() + 30
+    while not (
+        relays_manager_service.startup_stages.is_done(STAGE_RELAYS_STATUS)
+        and relays_manager_service.mqtt_client.connected
+    ):
+        if time.monotonic() > deadline:
+            raise RuntimeError("Relays manager not ready")
+        time.sleep(0.05)
+    return app
+
+
+def connect_client(client_id: str, broker_port: int) -> mqtt.Client:
+    """Connect a paho client to the local broker and start its network loop"""
+
+    client = mqtt.Client(client_id=client_id)
+    connected = threading.Event()
+    client.on_connect = lambda *_: connected.set()
+    client.connect("127.0.0.1", broker_port)
+    client.loop_start()
+    if not connected.wait(10):
+        raise RuntimeError(f"{client_id} not connected")
+    return client
+
+
+class StatusSubscriber:
+    """Record the reception time of the relays status messages"""
+
+    def __init__(self, broker_port: int, topic: str):
+        self._lock = threading.Lock()
+        self.received_at: List[float] = []
+        self.correlation_ids: Dict[str, int] = defaultdict(int)
+        self._client = connect_client("benchmark_status_subscriber", broker_port)
+        self._client.on_message = self._on_message
+        self._client.subscribe(topic, qos=1)
+
+    def _on_message(self, client, userdata, message):
+        received_at = time.time()
+        # Retained status received on subscription
+        if message.retain:
+            return
+        status = deserialize(message.payload)
+        with self._lock:
+            self.received_at.append(received_at)
+            if status.correlation_id is not None:
+                self.correlation_ids[status.correlation_id] += 1
+
+    def stop(self):
+        self._client.loop_stop()
+        self._client.disconnect()
+
+
+def publish_commands(
+    client: mqtt.Client,
+    topic: str,
+    codec: str,
+    qos: int,
+    rate: float,
+    duration: float,
+    first_index: int,
+    prefix: str,
+) -> Dict[str, float]:
+    """
+    Publish rate commands per second for duration, each command sets all the relays and
+    changes one of them. Return the publication time of each correlation id
+    """
+
+    sent_at = {}
+    commands_number = int(rate * duration)
+    start = time.monotonic()
+    for index in range(first_index, first_index + commands_number):
+        scheduled_at = start + (index - first_index) / rate
+        delay = scheduled_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        # Cyclic Gray code: one relay changes per command, the same command comes back after
+        # 2**RELAYS_NUMBER commands (not within a millisecond, else dropped as duplicated)
+        gray_index = index % (1 << RELAYS_NUMBER)
+        correlation_id = f"{prefix}-{index}"
+        command = RelaysStatus.from_mask(
+            status_mask=gray_index ^ gray_index >> 1,
+            validity_mask=ALL_RELAYS_MASK,
+            command=True,
+            timestamp=datetime.now(),
+            correlation_id=correlation_id,
+        )
+        payload = serialize(command, codec)
+        sent_at[correlation_id] = time.time()
+        client.publish(topic, payload, qos=qos)
+    return sent_at
+
+
+def wait_commands_processed(topic: str, received_before: float, sent: int, timeout: float):
+    """
+    Wait for the commands sent to be received (or for the receptions to stop) and the commands
+    queue to be empty, then for the last relays status to be published
+    """
+
+    deadline = time.monotonic() + timeout
+    received = MESSAGES_RECEIVED.labels(topic).value - received_before
+    while time.monotonic() < deadline:
+        time.sleep(0.1)
+        previously_received = received
+        received = MESSAGES_RECEIVED.labels(topic).value - received_before
+        if (
+            received >= sent or received == previously_received
+        ) and relays_manager_service.relays_command_queue.qsize() == 0:
+            break
+    # Last commands applied, last status published
+    time.sleep(min(0.5, max(0.0, deadline - time.monotonic())))
+
+
+def analyze_step(
+    sent_at: Dict[str, float], subscriber: StatusSubscriber, elapsed: float, counters: dict
+) -> dict:
+    """Follow the step commands through the spans and the relays status received"""
+
+    traces = tracer.get_traces(limit=len(sent_at) * 2)
+    # End of the relays apply of each applied (merged) command
+    applied_at = {}
+    for correlation_id, spans in traces.items():
+        for span in spans:
+            if span.name == "relays.apply":
+                applied_at[correlation_id] = span.start + span.duration_in_secs
+
+    statuses_received_at = sorted(subscriber.received_at)
+    actuation_latencies = []
+    status_latencies = []
+    delivered = dropped = not_applied = duplicated_deliveries = 0
+    for correlation_id, published_at in sent_at.items():
+        spans = traces.get(correlation_id, [])
+        transits = sum(1 for span in spans if span.name == "mqtt.transit")
+        delivered += transits > 0
+        duplicated_deliveries += max(0, transits - 1)
+        queued = [span for span in spans if span.name == "command.queue"]
+        if not queued:
+            dropped += 1
+            continue
+        merged_into = queued[0].attributes.get("merged_into")
+        actuated_at = applied_at.get(merged_into)
+        if actuated_at is None:
+            # Discarded as stale or its merged command failed
+            not_applied += 1
+            continue
+        actuation_latencies.append(actuated_at - published_at)
+        status_index = bisect.bisect_left(statuses_received_at, actuated_at)
+        if status_index < len(statuses_received_at):
+            status_latencies.append(statuses_received_at[status_index] - published_at)
+
+    actuation_latencies.sort()
+    status_latencies.sort()
+    step_ids = set(applied_at) & set(sent_at)
+    return {
+        "sent": len(sent_at),
+        "sent_rate": len(sent_at) / elapsed if elapsed > 0 else 0.0,
+        "delivered": delivered,
+        "applies": len(step_ids),
+        "dropped": dropped,
+        "not_applied": not_applied,
+        "duplicated": duplicated_deliveries + counters["duplicated"],
+        "status_duplicated": sum(
+            count - 1
+            for correlation_id, count in subscriber.correlation_ids.items()
+            if correlation_id in sent_at and count > 1
+        ),
+        "coalesced": counters["coalesced"],
+        "stale": counters["stale"],
+        "queue_dropped": counters["dropped"],
+        "actuation_p50_ms": percentile(actuation_latencies, 50) * 1000,
+        "actuation_p99_ms": percentile(actuation_latencies, 99) * 1000,
+        "actuation_max_ms": percentile(actuation_latencies, 100) * 1000,
+        "status_p50_ms": percentile(status_latencies, 50) * 1000,
+        "status_p99_ms": percentile(status_latencies, 99) * 1000,
+    }
+
+
+def run_benchmark(
+    broker_port: int,
+    rates: List[float],
+    step_duration: float,
+    qos: int,
+    codec: str,
+    drain_timeout: float,
+) -> List[dict]:
+    """Run a step per rate, return the step results"""
+
+    command_topic = relays_manager_service.mqtt_command_relays_topic
+    subscriber = StatusSubscriber(broker_port, relays_manager_service.mqtt_relays_status_topic)
+    publisher = connect_client("benchmark_publisher", broker_port)
+
+    results = []
+    first_index = 0
+    try:
+        for step, rate in enumerate(rates):
+            received_before = MESSAGES_RECEIVED.labels(command_topic).value
+            counters_before = {
+                "coalesced": counter_value(COMMANDS_COALESCED),
+                "dropped": counter_value(COMMANDS_DROPPED),
+                "duplicated": counter_value(COMMANDS_DUPLICATED),
+                "stale": counter_value(COMMANDS_STALE),
+            }
+            start = time.monotonic()
+            sent_at = publish_commands(
+                publisher,
+                command_topic,
+                codec,
+                qos,
+                rate,
+                step_duration,
+                first_index,
+                f"bench{step}",
+            )
+            elapsed = time.monotonic() - start
+            first_index += len(sent_at)
+            wait_commands_processed(command_topic, received_before, len(sent_at), drain_timeout)
+            counters = {
+                name: counter_value(counter) - counters_before[name]
+                for name, counter in (
+                    ("coalesced", COMMANDS_COALESCED),
+                    ("dropped", COMMANDS_DROPPED),
+                    ("duplicated", COMMANDS_DUPLICATED),
+                    ("stale", COMMANDS_STALE),
+                )
+            }
+            result = analyze_step(sent_at, subscriber, elapsed, counters)
+            result["rate"] = rate
+            results.append(result)
+            print_step(result)
+    finally:
+        publisher.loop_stop()
+        publisher.disconnect()
+        subscriber.stop()
+    return results
+
+
+STEP_COLUMNS = (
+    ("rate", "rate", "{:>8.0f}"),
+    ("sent_rate", "sent/s", "{:>8.0f}"),
+    ("delivered", "deliv", "{:>7d}"),
+    ("applies", "applies", "{:>8d}"),
+    ("coalesced", "merged", "{:>7.0f}"),
+    ("dropped", "dropped", "{:>8d}"),
+    ("not_applied", "unappl", "{:>7d}"),
+    ("duplicated", "dup", "{:>5.0f}"),
+    ("status_duplicated", "st.dup", "{:>7d}"),
+    ("actuation_p50_ms", "act p50", "{:>9.2f}"),
+    ("actuation_p99_ms", "act p99", "{:>9.2f}"),
+    ("actuation_max_ms", "act max", "{:>9.2f}"),
+    ("status_p50_ms", "st p50", "{:>9.2f}"),
+    ("status_p99_ms", "st p99", "{:>9.2f}"),
+)
+
+
+def print_header():
+    """Print the steps table header"""
+    print(
+        "".join(
+            f"{title:>{len(column_format.format(0))}}" for _, title, column_format in STEP_COLUMNS
+        )
+    )
+
+
+def print_step(result: dict):
+    """Print a step row"""
+    print("".join(column_format.format(result[key]) for key, _, column_format in STEP_COLUMNS))
+
+
+def find_saturation(results: List[dict], latency_limit_in_ms: float) -> dict:
+    """First step with dropped commands, actuation p99 over the limit or rate not achieved"""
+
+    for result in results:
+        if (
+            result["dropped"]
+            or result["actuation_p99_ms"] > latency_limit_in_ms
+            or result["sent_rate"] < result["rate"] * 0.95
+        ):
+            return result
+    return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--rates", default="50,100,200,400,800,1600", help="commands per second of each step"
+    )
+    parser.add_argument("--step-duration", type=float, default=5, help="step duration in seconds")
+    parser.add_argument("--qos", type=int, choices=(0, 1), default=1, help="commands QoS")
+    parser.add_argument("--codec", choices=sorted(CODECS), default=DEFAULT_CODEC)
+    parser.add_argument(
+        "--drain-timeout", type=float, default=10, help="wait for the queued commands (seconds)"
+    )
+    parser.add_argument(
+        "--latency-limit-ms", type=float, default=250, help="actuation p99 saturation limit"
+    )
+    args = parser.parse_args()
+
+    benchmark_broker = LocalBroker().start()
+    work_dir = tempfile.mkdtemp(prefix="mqtt-benchmark-")
+    os.chdir(work_dir)
+    create_benchmark_app(work_dir, benchmark_broker.port)
+
+    step_rates = [float(rate) for rate in args.rates.split(",")]
+    print(
+        f"Steps of {args.step_duration:g} s at {args.rates} commands/s, QoS {args.qos}, "
+        f"{args.codec} codec, local broker port {benchmark_broker.port}\n"
+    )
+    print_header()
+    step_results = run_benchmark(
+        benchmark_broker.port,
+        step_rates,
+        args.step_duration,
+        args.qos,
+        args.codec,
+        args.drain_timeout,
+    )
+
+    saturation = find_saturation(step_results, args.latency_limit_ms)
+    if saturation is None:
+        print(f"\nSaturation not reached up to {step_rates[-1]:g} commands/s")
+    else:
+        print(f"\nSaturation point: {saturation['rate']:g} commands/s")
+    relays_manager_service.mqtt_client.loop_stop()
+    benchmark_broker.stop()
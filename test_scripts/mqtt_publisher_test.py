@@ -89,6 +89,7 @@ mqtt_client = mqtt_client_interface(
     broker_address=HOST, username=CLIENT_NAME, password=CLIENT_PASSWORD
 )
 mqtt_client.connect()
+mqtt_client.loop_start()
 
 try:
     while True:
@@ -0,0 +1,386 @@
+"""
+REST load test of the relays API
+
+The app is created with create_app() on a simulated I2C bus, the MQTT client is stubbed (no
+broker connection) and MQTT relays commands are injected at a given rate while the status
+notification runs. A mix of requests is sent at a target rate (open loop: the latency is
+measured from the time each request was scheduled) by a pool of workers, either through the
+Flask test client or through a local HTTP server. Throughput and latency percentiles are
+reported and compared with a baseline file.
+
+    python test_scripts/rest_load_test.py --rate 500 --duration 10 --mix read=70,single=20,bulk=10
+    python test_scripts/rest_load_test.py --save-baseline test_scripts/rest_load_baseline.json
+"""
+
+import argparse
+import http.client
+import itertools
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Tuple
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from paho.mqtt.client import MQTTMessage
+from werkzeug.serving import make_server
+
+from server.app import create_app
+from server.interfaces.mqtt.client import MQTTClient
+from server.interfaces.mqtt.codec import CODECS, BSON_CODEC
+from server.interfaces.mqtt.model import RelaysStatus
+from server.relays_manager import relays_manager_service
+from server.relays_manager.service import STAGE_RELAYS_STATUS
+
+CONFIG_DIR = os.path.join(os.path.dirname(__file__), "..", "server", "config")
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "rest_load_baseline.json")
+RELAYS_NUMBER = 6
+
+# App configuration overridden for the load test
+CONFIG_OVERRIDES = {
+    "RELAYS_BUS_BACKEND": "simulated",
+    "RELAYS_SELF_TEST_ENABLED": False,
+    "RELAYS_JOURNAL_FILE": None,
+    "MQTT_BROKER_ADDRESS": "127.0.0.1",
+}
+
+PERCENTILES = (50, 90, 99, 99.9)
+COMPARED_LATENCIES = ("p50_ms", "p90_ms", "p99_ms")
+LATENCY_SLACK_IN_MS = 5.0
+
+
+def request_read(rng: random.Random) -> Tuple[str, str, dict, bytes]:
+    """GET relays status"""
+    return "GET", "/relays/", {}, None
+
+
+def request_read_single(rng: random.Random) -> Tuple[str, str, dict, bytes]:
+    """GET single relay status"""
+    return "GET", f"/relays/single/{rng.randrange(RELAYS_NUMBER)}", {}, None
+
+
+def request_single(rng: random.Random) -> Tuple[str, str, dict, bytes]:
+    """POST single relay status"""
+    relay = rng.randrange(RELAYS_NUMBER)
+    status = "true" if rng.random() < 0.5 else "false"
+    return "POST", f"/relays/single/{relay}?relay_number={relay}&status={status}", {}, None
+
+
+def request_bulk(rng: random.Random) -> Tuple[str, str, dict, bytes]:
+    """POST every relay status in a batch"""
+    body = {
+        "relay_statuses": [
+            {"relay_number": relay, "status": rng.random() < 0.5} for relay in range(RELAYS_NUMBER)
+        ]
+    }
+    return "POST", "/relays/batch", {"Content-Type": "application/json"}, json.dumps(body).encode()
+
+
+OPERATIONS = {
+    "read": request_read,
+    "read_single": request_read_single,
+    "single": request_single,
+    "bulk": request_bulk,
+}
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """Parse the requests mix: operation=weight,..."""
+
+    weights = {}
+    for item in mix.split(","):
+        operation, _, weight = item.partition("=")
+        if operation not in OPERATIONS:
+            raise ValueError(f"Unknown operation {operation}, expected one of {list(OPERATIONS)}")
+        weights[operation] = float(weight or 1)
+    return weights
+
+
+def percentile(sorted_values: List[float], percent: float) -> float:
+    """Percentile of sorted values (nearest rank)"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(percent / 100 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+def create_load_test_app(config_dir: str):
+    """Create the app on a simulated bus with a stubbed MQTT client, wait for its warm up"""
+
+    # No broker: the client never connects, the status messages stay buffered
+    MQTTClient.connect = lambda self: None
+    MQTTClient.loop_start = lambda self: None
+
+    with open(os.path.join(CONFIG_DIR, "rpi-electrical-panel-config.yml")) as stream:
+        config = yaml.full_load(stream)
+    config.update(CONFIG_OVERRIDES)
+    with open(os.path.join(config_dir, "rpi-electrical-panel-config.yml"), "w") as stream:
+        yaml.dump(config, stream)
+    shutil.copy(os.path.join(CONFIG_DIR, "logging-config.yml"), config_dir)
+    os.makedirs("logs", exist_ok=True)
+
+    app = create_app(config_dir=config_dir)
+    while not relays_manager_service.startup_stages.is_done(STAGE_RELAYS_STATUS):
+        time.sleep(0.05)
+    # Subscriptions made on connection, registered here to deliver the injected commands (the
+    # broker subscription fails, not connected)
+    mqtt_client = relays_manager_service.mqtt_client
+    for topic, callback in mqtt_client.subscriptions.items():
+        mqtt_client.subscribe(topic, callback)
+    return app
+
+
+def inject_mqtt_commands(rate: float, stop: threading.Event):
+    """Deliver relays commands to the MQTT client callback at rate per second"""
+
+    mqtt_client = relays_manager_service.mqtt_client
+    topic = relays_manager_service.mqtt_command_relays_topic
+    codec = CODECS[BSON_CODEC]
+    rng = random.Random(1)
+    period = 1 / rate
+    next_time = time.monotonic()
+    while not stop.is_set():
+        relay = rng.randrange(RELAYS_NUMBER)
+        command = RelaysStatus.from_mask(
+            status_mask=(rng.random() < 0.5) << relay, validity_mask=1 << relay, command=True
+        )
+        message = MQTTMessage(topic=topic.encode())
+        message.payload = codec.encode(command)
+        mqtt_client._client.on_message(mqtt_client._client, None, message)
+        next_time += period
+        stop.wait(max(0.0, next_time - time.monotonic()))
+
+
+class TestClientSender:
+    """Send requests through the Flask test client (app cost only, no network)"""
+
+    def __init__(self, app):
+        self._client = app.test_client()
+
+    def send(self, method: str, path: str, headers: dict, body: bytes) -> int:
+        response = self._client.open(path, method=method, headers=headers, data=body)
+        response.get_data()
+        return response.status_code
+
+
+class HTTPSender:
+    """Send requests to the local HTTP server, one keep-alive connection per worker"""
+
+    def __init__(self, port: int):
+        self._connection = http.client.HTTPConnection("127.0.0.1", port)
+
+    def send(self, method: str, path: str, headers: dict, body: bytes) -> int:
+        self._connection.request(method, path, body=body, headers=headers)
+        response = self._connection.getresponse()
+        response.read()
+        return response.status
+
+
+def run_load(
+    create_sender, rate: float, duration: float, workers: int, mix: Dict[str, float], seed: int
+) -> dict:
+    """Send the requests mix at rate for duration, return the results per operation"""
+
+    operations = list(mix)
+    weights = [mix[operation] for operation in operations]
+    requests_number = int(rate * duration)
+    rng = random.Random(seed)
+    schedule = [rng.choices(operations, weights)[0] for _ in range(requests_number)]
+
+    counter = itertools.count()
+    latencies: Dict[str, List[float]] = {operation: [] for operation in operations}
+    errors: Dict[str, int] = {operation: 0 for operation in operations}
+    lock = threading.Lock()
+    start = time.monotonic() + 0.1
+
+    def worker(worker_index: int):
+        sender = create_sender()
+        worker_rng = random.Random(seed + worker_index)
+        while True:
+            index = next(counter)
+            if index >= requests_number:
+                return
+            operation = schedule[index]
+            scheduled_at = start + index / rate
+            delay = scheduled_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            method, path, headers, body = OPERATIONS[operation](worker_rng)
+            try:
+                status = sender.send(method, path, headers, body)
+            except Exception:
+                status = 0
+            # From the scheduled time: a late request counts the time it waited
+            latency = time.monotonic() - scheduled_at
+            with lock:
+                latencies[operation].append(latency)
+                if status >= 400 or status == 0:
+                    errors[operation] += 1
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    results = {"elapsed_in_secs": elapsed, "operations": {}}
+    all_latencies = []
+    for operation in operations:
+        values = sorted(latencies[operation])
+        all_latencies.extend(values)
+        results["operations"][operation] = summarize(values, errors[operation], elapsed)
+    results["total"] = summarize(sorted(all_latencies), sum(errors.values()), elapsed)
+    return results
+
+
+def summarize(sorted_latencies: List[float], errors: int, elapsed: float) -> dict:
+    """Throughput and latency percentiles (ms) of sorted latencies"""
+
+    summary = {
+        "requests": len(sorted_latencies),
+        "errors": errors,
+        "throughput": len(sorted_latencies) / elapsed if elapsed > 0 else 0.0,
+    }
+    for percent in PERCENTILES:
+        summary[f"p{percent:g}_ms"] = percentile(sorted_latencies, percent) * 1000
+    summary["max_ms"] = (sorted_latencies[-1] if sorted_latencies else 0.0) * 1000
+    return summary
+
+
+def print_results(results: dict):
+    """Print the results table"""
+
+    columns = (
+        ["requests", "errors", "throughput"] + [f"p{p:g}_ms" for p in PERCENTILES] + ["max_ms"]
+    )
+    print(f"{'operation':<14}" + "".join(f"{column:>12}" for column in columns))
+    rows = list(results["operations"].items()) + [("total", results["total"])]
+    for operation, summary in rows:
+        print(
+            f"{operation:<14}"
+            + "".join(
+                f"{summary[column]:>12.0f}"
+                if column in ("requests", "errors")
+                else f"{summary[column]:>12.2f}"
+                for column in columns
+            )
+        )
+
+
+def compare_with_baseline(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """
+    Return the regressions: p50, p90 or p99 higher or throughput lower than the baseline by
+    more than tolerance (latencies within LATENCY_SLACK_IN_MS are noise), more errors
+    """
+
+    regressions = []
+    for operation, summary in list(results["operations"].items()) + [("total", results["total"])]:
+        expected = (
+            baseline["total"] if operation == "total" else baseline["operations"].get(operation)
+        )
+        if expected is None:
+            continue
+        for column in COMPARED_LATENCIES:
+            limit = max(expected[column] * (1 + tolerance), expected[column] + LATENCY_SLACK_IN_MS)
+            if summary[column] > limit:
+                regressions.append(
+                    f"{operation}: {column} {summary[column]:.2f} > baseline {expected[column]:.2f}"
+                )
+        if summary["throughput"] < expected["throughput"] * (1 - tolerance):
+            regressions.append(
+                f"{operation}: throughput {summary['throughput']:.0f}/s < baseline "
+                f"{expected['throughput']:.0f}/s"
+            )
+        if summary["errors"] > expected["errors"]:
+            regressions.append(f"{operation}: {summary['errors']} errors")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rate", type=float, default=200, help="target requests per second")
+    parser.add_argument("--duration", type=float, default=10, help="test duration in seconds")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent workers")
+    parser.add_argument(
+        "--mix", default="read=70,read_single=10,single=15,bulk=5", help="operation=weight,..."
+    )
+    parser.add_argument(
+        "--mqtt-rate", type=float, default=20, help="MQTT commands per second (0: none)"
+    )
+    parser.add_argument("--http", action="store_true", help="through a local threaded HTTP server")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="baseline file to compare with")
+    parser.add_argument("--save-baseline", metavar="FILE", help="save the results as baseline")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.5, help="regression tolerance (0.5: 50%%)"
+    )
+    args = parser.parse_args()
+
+    # Paths given relative to the current directory, the test runs in a temporary directory
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+    save_baseline_path = os.path.abspath(args.save_baseline) if args.save_baseline else None
+    work_dir = tempfile.mkdtemp(prefix="rest-load-test-")
+    os.chdir(work_dir)
+    load_test_app = create_load_test_app(work_dir)
+
+    stop_injection = threading.Event()
+    if args.mqtt_rate > 0:
+        threading.Thread(
+            target=inject_mqtt_commands, args=(args.mqtt_rate, stop_injection), daemon=True
+        ).start()
+
+    server = None
+    if args.http:
+        server = make_server("127.0.0.1", 0, load_test_app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        sender_factory = lambda: HTTPSender(server.server_port)
+    else:
+        sender_factory = lambda: TestClientSender(load_test_app)
+
+    mode = "http" if args.http else "test client"
+    print(
+        f"{args.rate:g} req/s for {args.duration:g} s, {args.workers} workers, {mode}, "
+        f"mix {args.mix}, {args.mqtt_rate:g} MQTT commands/s\n"
+    )
+    load_results = run_load(
+        sender_factory, args.rate, args.duration, args.workers, parse_mix(args.mix), args.seed
+    )
+    stop_injection.set()
+    if server is not None:
+        server.shutdown()
+    print_results(load_results)
+
+    load_results["parameters"] = {
+        "rate": args.rate,
+        "duration": args.duration,
+        "workers": args.workers,
+        "mix": args.mix,
+        "mqtt_rate": args.mqtt_rate,
+        "http": args.http,
+    }
+    if save_baseline_path:
+        with open(save_baseline_path, "w") as baseline_file:
+            json.dump(load_results, baseline_file, indent=2, sort_keys=True)
+        print(f"\nBaseline saved to {save_baseline_path}")
+    elif baseline_path and os.path.exists(baseline_path):
+        with open(baseline_path) as baseline_file:
+            baseline_results = json.load(baseline_file)
+        if baseline_results.get("parameters") != load_results["parameters"]:
+            print("\nBaseline parameters differ, results not compared")
+        else:
+            found_regressions = compare_with_baseline(
+                load_results, baseline_results, args.tolerance
+            )
+            for regression in found_regressions:
+                print(f"REGRESSION {regression}")
+            if found_regressions:
+                sys.exit(1)
+            print("\nNo regression against the baseline")
@@ -0,0 +1,124 @@
+"""Non blocking logging tests"""
+
+import logging
+import sys
+import pytest
+from server.common import async_logging as async_logging_module
+from server.common.async_logging import (
+    LOG_RECORDS_DROPPED,
+    LOG_RECORDS_RATE_LIMITED,
+    AsyncLogging,
+    AsyncQueueHandler,
+    DropOldestQueue,
+)
+
+
+class RecordsHandler(logging.Handler):
+    """Records the formatted messages"""
+
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record: logging.LogRecord):
+        self.messages.append(self.format(record))
+
+
+def log_record(msg: str, *args, level: int = logging.INFO, name: str = "tests.async_logging"):
+    return logging.LogRecord(name, level, __file__, 1, msg, args, None)
+
+
+def test_drop_oldest_queue():
+    log_queue = DropOldestQueue(maxsize=2)
+    assert log_queue.put_nowait(1) is None
+    assert log_queue.put_nowait(2) is None
+    assert log_queue.put_nowait(3) == 1
+    assert [log_queue.get_nowait(), log_queue.get_nowait()] == [2, 3]
+
+
+def test_message_merged_when_queued():
+    log_queue = DropOldestQueue()
+    handler = AsyncQueueHandler(log_queue)
+    relay_numbers = [1, 2]
+    handler.emit(log_record("Relays %s switched ON", relay_numbers))
+    # Changed once logged, before the writer thread formats the record
+    relay_numbers.append(3)
+    record = log_queue.get_nowait()
+    assert record.msg == "Relays [1, 2] switched ON"
+    assert record.args is None
+    assert logging.Formatter("%(levelname)s %(message)s").format(record) == (
+        "INFO Relays [1, 2] switched ON"
+    )
+
+
+def test_exception_formatted_when_queued():
+    log_queue = DropOldestQueue()
+    handler = AsyncQueueHandler(log_queue)
+    try:
+        raise RuntimeError("I2C failure")
+    except RuntimeError:
+        record = logging.LogRecord(
+            "tests.async_logging", logging.ERROR, __file__, 1, "Failed", (), sys.exc_info()
+        )
+    handler.emit(record)
+    record = log_queue.get_nowait()
+    assert record.exc_info is None
+    assert "RuntimeError: I2C failure" in record.exc_text
+
+
+def test_oldest_record_dropped_and_counted():
+    log_queue = DropOldestQueue(maxsize=1)
+    handler = AsyncQueueHandler(log_queue)
+    dropped = LOG_RECORDS_DROPPED.labels("DEBUG").value
+    handler.emit(log_record("first", level=logging.DEBUG))
+    handler.emit(log_record("second"))
+    assert LOG_RECORDS_DROPPED.labels("DEBUG").value == dropped + 1
+    assert log_queue.get_nowait().msg == "second"
+
+
+def test_rate_limited_logger_and_children():
+    log_queue = DropOldestQueue()
+    handler = AsyncQueueHandler(log_queue, rate_limits={"tests.noisy": 0.001})
+    rate_limited = LOG_RECORDS_RATE_LIMITED.labels("tests.noisy.child").value
+    for _ in range(3):
+        handler.emit(log_record("Status published", name="tests.noisy.child"))
+    # Warnings are never rate limited, other loggers are not limited
+    handler.emit(log_record("Broker unreachable", level=logging.WARNING, name="tests.noisy"))
+    handler.emit(log_record("Command applied", name="tests.quiet"))
+    handler.emit(log_record("Command applied", name="tests.quiet"))
+    assert LOG_RECORDS_RATE_LIMITED.labels("tests.noisy.child").value == rate_limited + 2
+    assert log_queue.qsize() == 4
+
+
+@pytest.fixture
+def loggers_handlers():
+    """Restore the loggers handlers moved by the async logging"""
+
+    loggers = [logging.getLogger()] + [
+        logger
+        for logger in logging.Logger.manager.loggerDict.values()
+        if isinstance(logger, logging.Logger)
+    ]
+    handlers = {logger: list(logger.handlers) for logger in loggers}
+    yield
+    for logger, logger_handlers in handlers.items():
+        logger.handlers = logger_handlers
+
+
+def test_records_written_by_writer_thread(loggers_handlers, monkeypatch):
+    exit_callbacks = []
+    monkeypatch.setattr(async_logging_module.atexit, "register", exit_callbacks.append)
+    records_handler = RecordsHandler()
+    logger = logging.getLogger("tests.async_logging.writer")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    logger.addHandler(records_handler)
+    async_logging = AsyncLogging()
+    async_logging.start()
+    try:
+        logger.info("Relay %s switched ON", 2)
+    finally:
+        async_logging.stop()
+    assert records_handler.messages == ["Relay 2 switched ON"]
+    # Stopped at exit: the queued records are written
+    assert exit_callbacks == [async_logging.stop]
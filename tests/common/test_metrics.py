@@ -0,0 +1,73 @@
+"""Metrics registry tests"""
+
+import pytest
+from server.common.metrics import Counter, Gauge, Histogram, Metric, MetricsRegistry
+
+
+def test_metric_is_abstract():
+    with pytest.raises(TypeError):
+        Metric("metric", "Metric")
+
+
+def test_counter_render():
+    counter = Counter("commands_total", "Commands", ("source",))
+    counter.labels("mqtt").inc()
+    counter.labels("mqtt").inc(2)
+    counter.labels('rest "api"').inc()
+    assert counter.render() == (
+        "# HELP commands_total Commands\n"
+        "# TYPE commands_total counter\n"
+        'commands_total{source="mqtt"} 3\n'
+        'commands_total{source="rest \\"api\\""} 1\n'
+    )
+
+
+def test_labels_count_checked():
+    counter = Counter("commands_total", "Commands", ("source",))
+    with pytest.raises(ValueError):
+        counter.labels()
+    with pytest.raises(ValueError):
+        counter.labels("mqtt", "extra")
+
+
+def test_gauge_function():
+    gauge = Gauge("queue_size", "Queue size")
+    gauge.set(2)
+    assert gauge.render().endswith("queue_size 2\n")
+    gauge.set_function(lambda: 0.5)
+    assert gauge.render().endswith("queue_size 0.5\n")
+
+    # A failing function gives no sample
+    gauge.set_function(lambda: 1 / 0)
+    assert gauge.render() == "# HELP queue_size Queue size\n# TYPE queue_size gauge\n"
+
+
+def test_histogram_cumulative_buckets():
+    histogram = Histogram("latency_seconds", "Latency", buckets=(0.1, 0.01))
+    for value in (0.005, 0.01, 0.05, 2):
+        histogram.observe(value)
+    assert histogram.render().splitlines()[2:] == [
+        'latency_seconds_bucket{le="0.01"} 2',
+        'latency_seconds_bucket{le="0.1"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        "latency_seconds_sum 2.065",
+        "latency_seconds_count 4",
+    ]
+
+
+def test_registry_shares_metrics():
+    registry = MetricsRegistry()
+    counter = registry.counter("commands_total", "Commands")
+    assert registry.counter("commands_total", "Commands") is counter
+    with pytest.raises(ValueError):
+        registry.gauge("commands_total", "Commands")
+    counter.inc()
+    registry.gauge("queue_size", "Queue size").set(1)
+    assert registry.render() == (
+        "# HELP commands_total Commands\n"
+        "# TYPE commands_total counter\n"
+        "commands_total 1\n"
+        "# HELP queue_size Queue size\n"
+        "# TYPE queue_size gauge\n"
+        "queue_size 1\n"
+    )
@@ -0,0 +1,66 @@
+"""Commands tracing tests"""
+
+import json
+import time
+from flask import Flask
+import pytest
+from server.common.tracing import Tracer
+
+
+def tracer_app(**config) -> Flask:
+    app = Flask(__name__)
+    app.config.update(TRACING_ENABLED=True, TRACING_MAX_SPANS=3, TRACING_EXPORT_FILE=None)
+    app.config.update(config)
+    return app
+
+
+def test_spans_kept_in_ring_buffer():
+    tracer = Tracer(tracer_app())
+    for index in range(4):
+        tracer.record("9f1c2d", f"span_{index}", start=100.0 - index, duration_in_secs=0.1)
+    # Oldest span dropped, spans ordered by start
+    assert [span.name for span in tracer.get_trace("9f1c2d")] == ["span_3", "span_2", "span_1"]
+    assert tracer.get_trace("unknown") == []
+
+
+def test_spans_not_recorded_when_disabled_or_without_correlation_id():
+    tracer = Tracer(tracer_app())
+    tracer.record(None, "mqtt.receive", start=100.0, duration_in_secs=0)
+    tracer = Tracer(tracer_app(TRACING_ENABLED=False))
+    tracer.record("9f1c2d", "mqtt.receive", start=100.0, duration_in_secs=0)
+    assert tracer.get_traces() == {}
+
+
+def test_monotonic_span():
+    tracer = Tracer(tracer_app())
+    start = time.monotonic()
+    tracer.record_monotonic("9f1c2d", "relays.apply", start, start + 0.25, changed_mask=1)
+    span = tracer.get_trace("9f1c2d")[0]
+    assert span.start == pytest.approx(time.time(), abs=1)
+    assert span.duration_in_secs == pytest.approx(0.25)
+    assert span.attributes == {"changed_mask": 1}
+
+
+def test_last_traces_first():
+    tracer = Tracer(tracer_app(TRACING_MAX_SPANS=10))
+    for correlation_id in ("a", "b", "a", "c"):
+        tracer.record(correlation_id, "span", start=time.time(), duration_in_secs=0)
+    traces = tracer.get_traces(limit=2)
+    assert list(traces) == ["c", "a"]
+    assert len(traces["a"]) == 2
+
+
+def test_spans_exported_as_json_lines(tmp_path):
+    export_file = tmp_path / "spans.jsonl"
+    tracer = Tracer(tracer_app(TRACING_EXPORT_FILE=str(export_file)))
+    tracer.record("9f1c2d", "mqtt.receive", start=100.0, duration_in_secs=0.5, topic="command")
+    deadline = time.monotonic() + 2
+    while not export_file.exists() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert json.loads(export_file.read_text()) == {
+        "correlation_id": "9f1c2d",
+        "name": "mqtt.receive",
+        "start": 100.0,
+        "duration_in_secs": 0.5,
+        "attributes": {"topic": "command"},
+    }
@@ -0,0 +1,155 @@
+"""
+Shared fixtures
+
+The app is created once per session on a simulated I2C bus (two relays boards), connected to a
+local MQTT broker stand-in
+"""
+
+import os
+import threading
+import time
+import paho.mqtt.client as mqtt
+import pytest
+import yaml
+from server.app import create_app
+from server.interfaces.mqtt import RelaysStatus
+from server.relays_manager import relays_manager_service
+from server.relays_manager.service import STAGE_RELAYS_STATUS
+from test_scripts.local_broker import LocalBroker
+
+CONFIG_DIR = os.path.join(os.path.dirname(__file__), "..", "server", "config")
+RELAYS_NUMBER = 8
+
+# App configuration overridden for the tests, MQTT_BROKER_PORT is the local broker port
+CONFIG_OVERRIDES = {
+    "MQTT_BROKER_ADDRESS": "127.0.0.1",
+    "RELAYS_BUS_BACKEND": "simulated",
+    "RELAYS_SIMULATED_BUS_LATENCY_IN_SECS": 0,
+    "RELAYS_SIMULATED_BUS_JITTER_IN_SECS": 0,
+    "RELAYS_BOARDS": [
+        {"name": "panel", "bus": 1, "address": 0x20, "relays_bits": [5, 4, 3, 2, 1, 0]},
+        {"name": "extension", "bus": 1, "address": 0x21, "relays_bits": [0, 1]},
+    ],
+    "RELAYS_PRESETS": {
+        "all_off": {"relays_off": list(range(RELAYS_NUMBER))},
+        "evening": {"relays_on": [0, 6], "relays_off": [1]},
+    },
+    "RELAYS_SELF_TEST_ENABLED": False,
+    "RELAYS_WARMUP_RETRY_DELAY_IN_SECS": 0.1,
+    "RELAYS_JOURNAL_FILE": None,
+    "RELAYS_STATUS_NOTIFICATION_MODE": "on_change",
+    "RELAYS_STATUS_HEARTBEAT_MIN_PERIOD_IN_SECS": 60,
+    "RELAYS_STATUS_HEARTBEAT_MAX_PERIOD_IN_SECS": 60,
+    "RELAYS_STREAM_KEEPALIVE_PERIOD_IN_SECS": 0.1,
+    "RELAYS_LONG_POLL_MAX_TIMEOUT_IN_SECS": 1,
+    "TRACING_EXPORT_FILE": None,
+    "LOGGING_ASYNC_ENABLED": False,
+}
+# The loggers of the test session are kept
+LOGGING_CONFIG = {"version": 1, "disable_existing_loggers": False}
+
+
+@pytest.fixture(scope="session")
+def mqtt_broker():
+    broker = LocalBroker().start()
+    yield broker
+    broker.stop()
+
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory, mqtt_broker):
+    """App connected to the local broker, once its warm up is done"""
+
+    with open(os.path.join(CONFIG_DIR, "rpi-electrical-panel-config.yml")) as stream:
+        config = yaml.full_load(stream)
+    config.update(CONFIG_OVERRIDES, MQTT_BROKER_PORT=mqtt_broker.port)
+    config_dir = tmp_path_factory.mktemp("config")
+    with open(config_dir / "rpi-electrical-panel-config.yml", "w") as stream:
+        yaml.dump(config, stream)
+    with open(config_dir / "logging-config.yml", "w") as stream:
+        yaml.dump(LOGGING_CONFIG, stream)
+
+    app = create_app(config_dir=str(config_dir))
+    deadline = time.monotonic() + 10
+    while not (
+        relays_manager_service.startup_stages.is_done(STAGE_RELAYS_STATUS)
+        and relays_manager_service.mqtt_client.connected
+    ):
+        assert time.monotonic() < deadline, "Relays manager not ready"
+        time.sleep(0.01)
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def relays_off(app):
+    """Set every relay OFF before the test"""
+
+    relays_manager_service.set_relays_statuses(
+        RelaysStatus.from_mask(
+            status_mask=0,
+            validity_mask=relays_manager_service.relays_bitmask.relays_mask,
+            command=True,
+        ),
+    )
+
+
+class MQTTSubscriber:
+    """Client recording the messages received on its subscriptions"""
+
+    def __init__(self, broker_port: int, topic: str):
+        self.messages = []
+        self._received = threading.Condition()
+        self._client = mqtt.Client()
+        self._client.on_message = self._on_message
+        subscribed = threading.Event()
+        self._client.on_subscribe = lambda *_: subscribed.set()
+        self._client.connect("127.0.0.1", broker_port)
+        self._client.loop_start()
+        self._client.subscribe(topic, qos=1)
+        assert subscribed.wait(timeout=5)
+
+    def _on_message(self, client, userdata, message: mqtt.MQTTMessage):
+        with self._received:
+            self.messages.append(message)
+            self._received.notify_all()
+
+    def wait_messages(self, predicate, timeout: float = 2) -> list:
+        """Wait for the messages matching predicate, return them"""
+
+        with self._received:
+            self._received.wait_for(
+                lambda: any(predicate(message) for message in self.messages), timeout
+            )
+            return [message for message in self.messages if predicate(message)]
+
+    def clear(self):
+        with self._received:
+            self.messages.clear()
+
+    def publish(self, topic: str, payload: bytes):
+        self._client.publish(topic, payload, qos=1).wait_for_publish()
+
+    def stop(self):
+        self._client.disconnect()
+        self._client.loop_stop()
+
+
+@pytest.fixture
+def mqtt_subscriber(mqtt_broker):
+    """Start MQTT subscribers to a topic"""
+
+    subscribers = []
+
+    def subscribe(topic: str) -> MQTTSubscriber:
+        subscriber = MQTTSubscriber(mqtt_broker.port, topic)
+        subscribers.append(subscriber)
+        return subscriber
+
+    yield subscribe
+    for subscriber in subscribers:
+        subscriber.stop()
@@ -0,0 +1,58 @@
+"""I2C bus backends tests"""
+
+import pytest
+from server.interfaces.i2c import (
+    I2CBusBackend,
+    RecordingBusBackend,
+    SimulatedBusBackend,
+    create_bus_backend,
+)
+
+
+def test_bus_backend_interface_is_abstract():
+    with pytest.raises(TypeError):
+        I2CBusBackend()
+
+
+def test_simulated_expander_reads_last_write():
+    backend = SimulatedBusBackend()
+    # Power on state: all pins high
+    assert backend.read_byte(0x20) == 0xFF
+    backend.write_byte(0x20, 0x1A5)
+    assert backend.read_byte(0x20) == 0xA5
+    assert backend.read_byte(0x21) == 0xFF
+    backend.set_register(0x21, 0x0F)
+    assert backend.read_byte(0x21) == 0x0F
+
+
+def test_simulated_errors():
+    backend = SimulatedBusBackend(error_rate=1, seed=0)
+    with pytest.raises(OSError):
+        backend.write_byte(0x20, 0x00)
+    with pytest.raises(OSError):
+        backend.read_byte(0x20)
+
+
+def test_recording_backend_records_transactions():
+    backend = RecordingBusBackend(SimulatedBusBackend(), max_transactions=2)
+    backend.write_byte(0x20, 0x01)
+    backend.read_byte(0x20)
+    backend.read_byte(0x21)
+    assert [
+        (transaction.operation, transaction.address, transaction.value, transaction.error)
+        for transaction in backend.transactions
+    ] == [("read", 0x20, 0x01, None), ("read", 0x21, 0xFF, None)]
+
+
+def test_recording_backend_records_errors():
+    backend = RecordingBusBackend(SimulatedBusBackend(error_rate=1, seed=0))
+    with pytest.raises(OSError):
+        backend.write_byte(0x20, 0x01)
+    assert backend.transactions[0].error is not None
+    backend.clear()
+    assert backend.transactions == []
+
+
+def test_recording_backend_can_not_record_itself():
+    with pytest.raises(ValueError):
+        create_bus_backend("recording", recorded_backend="recording")
@@ -0,0 +1,157 @@
+"""MQTT client outbound pipeline tests"""
+
+import threading
+import time
+import paho.mqtt.client as mqtt
+import pytest
+from server.interfaces.mqtt import MQTTPublishError, mqtt_client_interface
+
+PUBLISH_TIMEOUT_IN_SECS = 0.1
+
+
+class FakeMessageInfo:
+    """Message info of the paho client"""
+
+    def __init__(self, mid: int, rc: int):
+        self.mid = mid
+        self.rc = rc
+        self.published = False
+
+    def is_published(self) -> bool:
+        return self.published
+
+
+class FakeNetworkLoop:
+    """Stands for the paho client publish, records the messages"""
+
+    def __init__(self, rc: int = mqtt.MQTT_ERR_SUCCESS):
+        self.rc = rc
+        self.messages = []
+        self.sent = threading.Condition()
+
+    def publish(self, topic, payload, qos, retain):
+        with self.sent:
+            message_info = FakeMessageInfo(len(self.messages) + 1, self.rc)
+            self.messages.append((topic, payload, qos, retain, message_info))
+            self.sent.notify_all()
+            return message_info
+
+    def wait_messages(self, count: int):
+        with self.sent:
+            assert self.sent.wait_for(lambda: len(self.messages) >= count, timeout=2)
+
+
+@pytest.fixture
+def network_loop():
+    return FakeNetworkLoop()
+
+
+@pytest.fixture
+def mqtt_client(network_loop):
+    client = mqtt_client_interface(
+        broker_address="127.0.0.1",
+        username="test",
+        publish_timeout_in_secs=PUBLISH_TIMEOUT_IN_SECS,
+        max_pending_messages=2,
+    )
+    client._client.publish = network_loop.publish
+    return client
+
+
+def connect(mqtt_client):
+    mqtt_client._client.on_connect(mqtt_client._client, None, {}, 0)
+
+
+def disconnect(mqtt_client):
+    mqtt_client._client.on_disconnect(mqtt_client._client, None, 0)
+
+
+def acknowledge(mqtt_client, message_info: FakeMessageInfo):
+    message_info.published = True
+    mqtt_client._client.on_publish(mqtt_client._client, None, message_info.mid)
+
+
+def test_future_resolved_on_puback(mqtt_client, network_loop):
+    connect(mqtt_client)
+    future = mqtt_client.publish_payload("status/relays", b"1", retain=True)
+    network_loop.wait_messages(1)
+    assert network_loop.messages[0][:4] == ("status/relays", b"1", 1, True)
+    acknowledge(mqtt_client, network_loop.messages[0][4])
+    assert future.result(timeout=1) == 1
+
+
+def test_future_failed_without_puback(mqtt_client, network_loop):
+    connect(mqtt_client)
+    future = mqtt_client.publish_payload("status/relays", b"1")
+    with pytest.raises(MQTTPublishError):
+        future.result(timeout=1)
+
+
+def test_messages_buffered_until_connected(mqtt_client, network_loop):
+    future = mqtt_client.publish_payload("status/relays", b"1")
+    time.sleep(2 * PUBLISH_TIMEOUT_IN_SECS)
+    assert network_loop.messages == []
+    assert not future.done()
+    connect(mqtt_client)
+    network_loop.wait_messages(1)
+    acknowledge(mqtt_client, network_loop.messages[0][4])
+    assert future.result(timeout=1) == 1
+
+
+def test_message_held_while_disconnected_not_failed(mqtt_client, network_loop):
+    connect(mqtt_client)
+    # Disconnected before the message is written: held by the network loop
+    network_loop.rc = mqtt.MQTT_ERR_NO_CONN
+    future = mqtt_client.publish_payload("status/relays", b"1")
+    network_loop.wait_messages(1)
+    disconnect(mqtt_client)
+    time.sleep(3 * PUBLISH_TIMEOUT_IN_SECS)
+    assert not future.done()
+
+    # Sent again on reconnection, the PUBACK timeout starts
+    connect(mqtt_client)
+    acknowledge(mqtt_client, network_loop.messages[0][4])
+    assert future.result(timeout=1) == 1
+
+
+def test_message_sent_then_disconnected_not_failed(mqtt_client, network_loop):
+    connect(mqtt_client)
+    future = mqtt_client.publish_payload("status/relays", b"1")
+    network_loop.wait_messages(1)
+    disconnect(mqtt_client)
+    time.sleep(3 * PUBLISH_TIMEOUT_IN_SECS)
+    assert not future.done()
+    connect(mqtt_client)
+    # Not acknowledged after the reconnection
+    with pytest.raises(MQTTPublishError):
+        future.result(timeout=1)
+
+
+def test_publish_error(mqtt_client, network_loop):
+    network_loop.rc = mqtt.MQTT_ERR_PAYLOAD_SIZE
+    connect(mqtt_client)
+    with pytest.raises(MQTTPublishError):
+        mqtt_client.publish_payload("status/relays", b"1").result(timeout=1)
+
+
+def test_oldest_message_dropped_when_queue_full(mqtt_client, network_loop):
+    futures = [mqtt_client.publish_payload(f"status/relays/{index}", b"1") for index in range(3)]
+    with pytest.raises(MQTTPublishError):
+        futures[0].result(timeout=1)
+    assert not futures[1].done()
+    connect(mqtt_client)
+    network_loop.wait_messages(2)
+    assert [message[0] for message in network_loop.messages] == [
+        "status/relays/1",
+        "status/relays/2",
+    ]
+
+
+def test_pending_message_replaced(mqtt_client, network_loop):
+    first = mqtt_client.publish_payload("status/relays", b"1", replace=True)
+    second = mqtt_client.publish_payload("status/relays", b"2", replace=True)
+    connect(mqtt_client)
+    network_loop.wait_messages(1)
+    acknowledge(mqtt_client, network_loop.messages[0][4])
+    assert first.result(timeout=1) == second.result(timeout=1) == 1
+    assert [message[1] for message in network_loop.messages] == [b"2"]
@@ -0,0 +1,120 @@
+"""MQTT messages codecs tests"""
+
+from datetime import datetime
+import bson
+import pytest
+from server.interfaces.mqtt.codec import (
+    BSON_CODEC,
+    COMPACT_CODEC,
+    Codec,
+    CompactCodec,
+    deserialize,
+    detect_codec,
+    get_codec,
+    serialize,
+)
+from server.interfaces.mqtt.model import RelaysScheduleCommand, RelaysStatus, SingleRelayStatus
+
+TIMESTAMP = datetime(2022, 7, 1, 12, 30, 15, 250000)
+
+
+def relays_status(correlation_id=None, relays_number=6) -> RelaysStatus:
+    return RelaysStatus.from_mask(
+        status_mask=0b101,
+        validity_mask=(1 << relays_number) - 1,
+        command=True,
+        timestamp=TIMESTAMP,
+        correlation_id=correlation_id,
+    )
+
+
+def assert_same_relays_status(decoded: RelaysStatus, expected: RelaysStatus):
+    assert decoded.status_mask == expected.status_mask
+    assert decoded.validity_mask == expected.validity_mask
+    assert decoded.command == expected.command
+    assert decoded.timestamp_ms() == expected.timestamp_ms()
+    assert decoded.correlation_id == expected.correlation_id
+
+
+@pytest.mark.parametrize("codec", [BSON_CODEC, COMPACT_CODEC])
+@pytest.mark.parametrize("correlation_id", [None, "9f1c2d"])
+@pytest.mark.parametrize("relays_number", [6, 12, 70])
+def test_round_trip(codec, correlation_id, relays_number):
+    message = relays_status(correlation_id, relays_number)
+    payload = serialize(message, codec)
+    assert detect_codec(payload).name == codec
+    assert_same_relays_status(deserialize(payload), message)
+
+
+def test_round_trip_relay_statuses():
+    message = RelaysStatus(
+        relay_statuses=[
+            SingleRelayStatus.of(relay_number=1, status=True),
+            SingleRelayStatus.of(relay_number=4, status=False),
+        ],
+        command=False,
+        timestamp=TIMESTAMP,
+    )
+    for codec in (BSON_CODEC, COMPACT_CODEC):
+        decoded = deserialize(serialize(message, codec))
+        assert_same_relays_status(decoded, message)
+        assert decoded.relay_statuses == message.relay_statuses
+
+
+def test_compact_payload_size():
+    payload = serialize(relays_status(), COMPACT_CODEC)
+    assert len(payload) == CompactCodec.HEADER.size + 2
+    assert len(payload) < len(serialize(relays_status(), BSON_CODEC))
+
+
+def test_bson_payload_starting_with_compact_version():
+    # A BSON document of 0xC1 bytes starts with the compact version byte
+    document = {"padding": ""}
+    document["padding"] = "x" * (CompactCodec.VERSION - len(bson.dumps(document)))
+    payload = bson.dumps(document)
+    assert payload[0] == CompactCodec.VERSION
+    assert detect_codec(payload).name == BSON_CODEC
+
+
+def test_schedule_command_is_bson_only():
+    schedule_command = RelaysScheduleCommand(
+        relay_statuses=[SingleRelayStatus.of(relay_number=1, status=True)],
+        delay_in_secs=5,
+        duration_in_secs=10,
+        timestamp=TIMESTAMP,
+    )
+    decoded = deserialize(serialize(schedule_command, BSON_CODEC), RelaysScheduleCommand)
+    assert decoded.relay_statuses == schedule_command.relay_statuses
+    assert (decoded.delay_in_secs, decoded.duration_in_secs) == (5, 10)
+    assert decoded.timestamp == TIMESTAMP
+    with pytest.raises(ValueError):
+        get_codec(COMPACT_CODEC).decode(
+            serialize(relays_status(), COMPACT_CODEC), RelaysScheduleCommand
+        )
+
+
+def test_compact_unsupported_version():
+    payload = bytearray(serialize(relays_status(), COMPACT_CODEC))
+    payload[0] = 0xC2
+    with pytest.raises(ValueError):
+        get_codec(COMPACT_CODEC).decode(bytes(payload))
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        get_codec("json")
+    with pytest.raises(ValueError):
+        serialize(relays_status(), "json")
+
+
+@pytest.mark.parametrize("correlation_id", [None, "9f1c2d"])
+def test_compact_truncated_payload(correlation_id):
+    payload = serialize(relays_status(correlation_id, relays_number=12), COMPACT_CODEC)
+    for size in range(len(payload)):
+        with pytest.raises(ValueError):
+            get_codec(COMPACT_CODEC).decode(payload[:size])
+
+
+def test_codec_interface_is_abstract():
+    with pytest.raises(TypeError):
+        Codec()
@@ -0,0 +1,69 @@
+"""MQTT messages model tests"""
+
+from datetime import datetime
+import pytest
+from server.interfaces.mqtt.model import MAX_RELAYS_NUMBER, RelaysStatus, SingleRelayStatus
+
+TIMESTAMP = datetime(2022, 7, 1, 12, 30, 15)
+
+
+def relays_status_json(*relay_statuses) -> dict:
+    return {
+        "relay_statuses": [
+            {"relay_number": relay_number, "status": status}
+            for relay_number, status in relay_statuses
+        ],
+        "command": True,
+        "timestamp": TIMESTAMP.isoformat(),
+    }
+
+
+def test_single_relay_status_shared_and_immutable():
+    relay_status = SingleRelayStatus.of(relay_number=3, status=1)
+    assert relay_status is SingleRelayStatus.of(relay_number=3, status=True)
+    assert relay_status.status is True
+    with pytest.raises(AttributeError):
+        relay_status.status = False
+
+
+def test_masks_from_relay_statuses():
+    relays_status = RelaysStatus.from_json(relays_status_json((0, True), (2, False), (0, False)))
+    # The last status of a relay wins
+    assert relays_status.status_mask == 0
+    assert relays_status.validity_mask == 0b101
+    assert relays_status.timestamp == TIMESTAMP
+
+
+def test_relay_statuses_from_masks():
+    relays_status = RelaysStatus.from_mask(status_mask=0b1001, validity_mask=0b1011, command=False)
+    assert relays_status.relay_statuses == [
+        SingleRelayStatus.of(0, True),
+        SingleRelayStatus.of(1, False),
+        SingleRelayStatus.of(3, True),
+    ]
+    # Status bits out of the validity mask are ignored
+    assert RelaysStatus.from_mask(0b11, 0b01, command=False).status_mask == 0b01
+
+
+@pytest.mark.parametrize(
+    "relay_number", [-1, -64, MAX_RELAYS_NUMBER, 10**9, "1", 1.0, None, True]
+)
+def test_invalid_relay_numbers_dropped(relay_number):
+    relays_status = RelaysStatus.from_json(relays_status_json((relay_number, True), (1, True)))
+    assert relays_status.relay_statuses == [SingleRelayStatus.of(1, True)]
+    assert relays_status.status_mask == relays_status.validity_mask == 0b10
+
+
+def test_json_round_trip():
+    relays_status = RelaysStatus.from_mask(
+        status_mask=0b01,
+        validity_mask=0b11,
+        command=True,
+        timestamp=TIMESTAMP,
+        correlation_id="9f1c2d",
+    )
+    decoded = RelaysStatus.from_json(relays_status.to_json())
+    assert decoded.relay_statuses == relays_status.relay_statuses
+    assert decoded.timestamp == TIMESTAMP
+    assert decoded.command
+    assert decoded.correlation_id == "9f1c2d"
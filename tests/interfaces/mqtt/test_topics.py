@@ -0,0 +1,104 @@
+"""MQTT topics trie tests"""
+
+import pytest
+from server.interfaces.mqtt.topics import TopicTrie, validate_topic_filter
+
+
+@pytest.fixture
+def topic_trie():
+    trie = TopicTrie()
+    for topic_filter in (
+        "command/relays",
+        "command/relays/relay/+",
+        "command/relays/schedule",
+        "command/#",
+        "+/relays",
+        "status/+/+",
+    ):
+        trie.insert(topic_filter, topic_filter.upper())
+    return trie
+
+
+def matched_filters(trie: TopicTrie, topic: str):
+    return [topic_filter for topic_filter, _ in trie.match(topic)]
+
+
+def test_exact_and_wildcard_matches(topic_trie):
+    # The filters without wildcard at a level come first, # filters last
+    assert matched_filters(topic_trie, "command/relays") == [
+        "command/relays",
+        "+/relays",
+        "command/#",
+    ]
+    assert topic_trie.match("command/relays/schedule") == (
+        ("command/relays/schedule", "COMMAND/RELAYS/SCHEDULE"),
+        ("command/#", "COMMAND/#"),
+    )
+
+
+def test_single_level_wildcard(topic_trie):
+    assert matched_filters(topic_trie, "command/relays/relay/3") == [
+        "command/relays/relay/+",
+        "command/#",
+    ]
+    # + matches a whole level, not several levels
+    assert matched_filters(topic_trie, "command/relays/relay/3/4") == ["command/#"]
+    assert matched_filters(topic_trie, "status/relays/3") == ["status/+/+"]
+    assert matched_filters(topic_trie, "status/relays") == ["+/relays"]
+
+
+def test_multi_level_wildcard_matches_parent_level(topic_trie):
+    assert matched_filters(topic_trie, "command") == ["command/#"]
+
+
+def test_no_match(topic_trie):
+    assert topic_trie.match("other/topic") == ()
+
+
+def test_broker_topics_not_matched_by_leading_wildcard():
+    trie = TopicTrie()
+    trie.insert("#", 1)
+    trie.insert("+/broker", 2)
+    trie.insert("$SYS/#", 3)
+    assert trie.match("$SYS/broker") == (("$SYS/#", 3),)
+    assert matched_filters(trie, "any/broker") == ["+/broker", "#"]
+
+
+def test_remove_prunes_and_resets_cache(topic_trie):
+    assert matched_filters(topic_trie, "command/relays/relay/1") == [
+        "command/relays/relay/+",
+        "command/#",
+    ]
+    assert topic_trie.remove("command/relays/relay/+")
+    assert not topic_trie.remove("command/relays/relay/+")
+    assert not topic_trie.remove("unknown/topic")
+    assert matched_filters(topic_trie, "command/relays/relay/1") == ["command/#"]
+    assert topic_trie.get("command/relays/relay/+") is None
+    assert len(topic_trie) == 5
+
+
+def test_insert_replaces_value(topic_trie):
+    topic_trie.insert("command/relays", "replaced")
+    assert len(topic_trie) == 6
+    assert topic_trie.get("command/relays") == "replaced"
+    assert ("command/relays", "replaced") in topic_trie.match("command/relays")
+
+
+def test_cache_size_bounded():
+    trie = TopicTrie(cache_size=2)
+    trie.insert("status/+", 1)
+    for relay_number in range(10):
+        assert trie.match(f"status/{relay_number}") == (("status/+", 1),)
+
+
+@pytest.mark.parametrize("topic_filter", ["", "a/#/b", "a/b#", "a/+b", "a+/b"])
+def test_invalid_topic_filters(topic_filter):
+    with pytest.raises(ValueError):
+        validate_topic_filter(topic_filter)
+    with pytest.raises(ValueError):
+        TopicTrie().insert(topic_filter, None)
+
+
+@pytest.mark.parametrize("topic_filter", ["a", "a/b", "+", "#", "a/+/b", "a/+/#", "/a"])
+def test_valid_topic_filters(topic_filter):
+    validate_topic_filter(topic_filter)
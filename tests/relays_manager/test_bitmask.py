@@ -0,0 +1,82 @@
+"""Relays bitmask engine tests"""
+
+import pytest
+from server.interfaces.mqtt import SingleRelayStatus
+from server.relays_manager.bitmask import HardwareBitmask, RelaysBitmask, bits_in_mask
+
+
+def test_bits_in_mask():
+    assert bits_in_mask(0) == []
+    assert bits_in_mask(0b101001) == [0, 3, 5]
+
+
+def test_is_valid_relay():
+    relays_bitmask = RelaysBitmask(relays_number=6)
+    assert relays_bitmask.relays_mask == 0b111111
+    assert relays_bitmask.is_valid_relay(0)
+    assert relays_bitmask.is_valid_relay(5)
+    assert not relays_bitmask.is_valid_relay(6)
+    assert not relays_bitmask.is_valid_relay(-1)
+
+
+def test_compile_last_status_wins():
+    relays_bitmask = RelaysBitmask(relays_number=6)
+    set_mask, clear_mask = relays_bitmask.compile(
+        [
+            SingleRelayStatus.of(relay_number=0, status=True),
+            SingleRelayStatus.of(relay_number=1, status=True),
+            SingleRelayStatus.of(relay_number=0, status=False),
+            SingleRelayStatus.of(relay_number=2, status=False),
+            SingleRelayStatus.of(relay_number=2, status=True),
+        ]
+    )
+    assert set_mask == 0b110
+    assert clear_mask == 0b001
+
+
+def test_compile_ignores_invalid_relays():
+    relays_bitmask = RelaysBitmask(relays_number=6)
+    assert relays_bitmask.compile(
+        [
+            SingleRelayStatus.of(relay_number=6, status=True),
+            SingleRelayStatus.of(relay_number=9, status=False),
+        ]
+    ) == (0, 0)
+
+
+def test_compile_masks():
+    relays_bitmask = RelaysBitmask(relays_number=6)
+    set_mask, clear_mask = relays_bitmask.compile_masks(
+        status_mask=0b1000101, validity_mask=0b1001111
+    )
+    assert set_mask == 0b000101
+    assert clear_mask == 0b001010
+
+
+def test_apply_toggle_diff():
+    relays_bitmask = RelaysBitmask(relays_number=6)
+    assert relays_bitmask.apply(0b110000, set_mask=0b000011, clear_mask=0b010000) == 0b100011
+    assert relays_bitmask.toggle(0b000011, 0b1000110) == 0b000101
+    assert relays_bitmask.diff(0b1000011, 0b000110) == 0b000101
+
+
+def test_relays_in_mask_and_to_dict():
+    relays_bitmask = RelaysBitmask(relays_number=3)
+    assert relays_bitmask.relays_in_mask(0b1101) == [0, 2]
+    assert relays_bitmask.to_dict(0b101) == {0: True, 1: False, 2: True}
+
+
+def test_hardware_mapping():
+    hardware_bitmask = HardwareBitmask(relays_bits=(7, 6, 5, 4, 3, 2))
+    assert hardware_bitmask.hardware_relays_mask == 0b11111100
+    assert hardware_bitmask.to_hardware(0b000011) == 0b11000000
+    # Bits not mapped to relays are kept
+    assert hardware_bitmask.to_hardware(0b000001, raw=0b11) == 0b10000011
+    for mask in range(1 << hardware_bitmask.relays_number):
+        assert hardware_bitmask.from_hardware(hardware_bitmask.to_hardware(mask)) == mask
+
+
+@pytest.mark.parametrize("relays_bits", [(0, 0, 1), (0, 8)])
+def test_hardware_invalid_mapping(relays_bits):
+    with pytest.raises(ValueError):
+        HardwareBitmask(relays_bits=relays_bits)
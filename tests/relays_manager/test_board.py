@@ -0,0 +1,76 @@
+"""Relays boards tests"""
+
+import threading
+import time
+import pytest
+from server.interfaces.i2c import SimulatedBusBackend
+from server.relays_manager.board import RelaysBoard, RelaysBoardsExecutor
+
+
+def relays_board(name: str, bus_number: int, address: int, first_relay: int, bus=None):
+    return RelaysBoard(
+        name=name,
+        bus_number=bus_number,
+        address=address,
+        relays_bits=[5, 4, 3, 2, 1, 0],
+        first_relay=first_relay,
+        bus=bus or SimulatedBusBackend(),
+    )
+
+
+def test_board_global_relays():
+    board = relays_board("extension", bus_number=1, address=0x21, first_relay=6)
+    assert board.relays_number == 6
+    assert board.global_relays_mask == 0b111111 << 6
+    # Relay 6 is the first relay of the board, driven by bit 5
+    assert board.to_global_mask(0b100000) == 1 << 6
+    assert board.to_status_raw(1 << 7, status_raw=0b11000000) == 0b11010000
+
+
+def test_board_relays_active_low():
+    bus = SimulatedBusBackend()
+    board = relays_board("panel", bus_number=1, address=0x20, first_relay=0, bus=bus)
+    # Expander pins high at power on: relays OFF
+    assert board.read_status_raw() == 0
+    board.write_status_raw(0b100001)
+    assert bus.read_byte(0x20) == 0b11011110
+    assert board.read_status_raw() == 0b100001
+
+
+def test_boards_of_different_buses_run_in_parallel():
+    boards = [
+        relays_board("panel", bus_number=1, address=0x20, first_relay=0),
+        relays_board("extension", bus_number=1, address=0x21, first_relay=6),
+        relays_board("garage", bus_number=2, address=0x20, first_relay=12),
+    ]
+    boards_executor = RelaysBoardsExecutor(boards)
+    buses_running = set()
+    max_buses_running = []
+    lock = threading.Lock()
+
+    def operation(board: RelaysBoard):
+        with lock:
+            buses_running.add(board.bus_number)
+            max_buses_running.append(len(buses_running))
+        time.sleep(0.05)
+        with lock:
+            buses_running.discard(board.bus_number)
+        return board.address
+
+    results = boards_executor.run(boards, operation)
+    assert results == {boards[0]: 0x20, boards[1]: 0x21, boards[2]: 0x20}
+    assert max(max_buses_running) == 2
+
+
+def test_boards_executor_propagates_errors():
+    boards = [
+        relays_board("panel", bus_number=1, address=0x20, first_relay=0),
+        relays_board("garage", bus_number=2, address=0x20, first_relay=6),
+    ]
+
+    def operation(board: RelaysBoard):
+        if board.bus_number == 2:
+            raise OSError("I2C failure")
+
+    with pytest.raises(OSError):
+        RelaysBoardsExecutor(boards).run(boards, operation)
@@ -0,0 +1,303 @@
+"""Relays commands queue tests"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+import pytest
+from server.relays_manager.command_queue import (
+    COMMANDS_COALESCED,
+    COMMANDS_DROPPED,
+    COMMANDS_DUPLICATED,
+    RecentCommands,
+    RelaysCommandQueue,
+    discard_stale_relays,
+    merge_relays_commands,
+)
+from server.interfaces.mqtt import RelaysStatus
+
+START = datetime(2022, 7, 1, 12, 0, 0)
+
+
+def command(
+    status_mask: int, validity_mask: int, offset_in_secs: float = 0, correlation_id=None
+) -> RelaysStatus:
+    return RelaysStatus.from_mask(
+        status_mask=status_mask,
+        validity_mask=validity_mask,
+        command=True,
+        timestamp=START + timedelta(seconds=offset_in_secs),
+        correlation_id=correlation_id,
+    )
+
+
+def masks(relays_status: RelaysStatus):
+    return relays_status.status_mask, relays_status.validity_mask
+
+
+@pytest.fixture
+def applied_commands():
+    return []
+
+
+def commands_queue(applied_commands, **kwargs) -> RelaysCommandQueue:
+    return RelaysCommandQueue(
+        apply_command=applied_commands.append, coalescing_window_in_secs=0, **kwargs
+    )
+
+
+def drain(relays_command_queue: RelaysCommandQueue):
+    """Apply the commands put before the worker starts, in a single batch"""
+    relays_command_queue.start()
+    relays_command_queue.stop()
+
+
+def test_merge_latest_status_wins():
+    merged_command = merge_relays_commands(
+        [
+            command(0b011, 0b011, correlation_id="first"),
+            command(0b100, 0b101, offset_in_secs=1),
+            command(0b000, 0b010, offset_in_secs=2),
+        ]
+    )
+    assert masks(merged_command) == (0b100, 0b111)
+    assert merged_command.command
+    assert merged_command.timestamp == START + timedelta(seconds=2)
+    # Correlation id of the latest command giving one
+    assert merged_command.correlation_id == "first"
+
+
+def test_commands_coalesced(applied_commands):
+    relays_command_queue = commands_queue(applied_commands)
+    relays_command_queue.put(command(0b01, 0b01, offset_in_secs=0))
+    relays_command_queue.put(command(0b00, 0b01, offset_in_secs=1))
+    relays_command_queue.put(command(0b10, 0b10, offset_in_secs=2))
+    assert relays_command_queue.qsize() == 3
+    drain(relays_command_queue)
+    assert [masks(applied_command) for applied_command in applied_commands] == [(0b10, 0b11)]
+    assert relays_command_queue.qsize() == 0
+
+
+def test_full_queue_merges_into_newest_command(applied_commands):
+    relays_command_queue = commands_queue(applied_commands, max_size=2)
+    coalesced = COMMANDS_COALESCED.labels().value
+    dropped = COMMANDS_DROPPED.labels().value
+    for relay_number in range(3):
+        relays_command_queue.put(
+            command(1 << relay_number, 1 << relay_number, offset_in_secs=relay_number)
+        )
+    assert relays_command_queue.qsize() == 2
+    assert COMMANDS_COALESCED.labels().value == coalesced + 1
+    assert COMMANDS_DROPPED.labels().value == dropped
+    drain(relays_command_queue)
+    # No relay change is lost
+    assert [masks(applied_command) for applied_command in applied_commands] == [(0b111, 0b111)]
+
+
+def test_single_command_applied_without_coalescing_delay():
+    applied = threading.Event()
+    relays_command_queue = RelaysCommandQueue(
+        apply_command=lambda _: applied.set(), coalescing_window_in_secs=1
+    )
+    relays_command_queue.start()
+    try:
+        # Let the worker wait for a command
+        time.sleep(0.05)
+        start = time.monotonic()
+        relays_command_queue.put(command(0b1, 0b1))
+        assert applied.wait(timeout=0.5)
+        assert time.monotonic() - start < 0.5
+    finally:
+        relays_command_queue.stop()
+
+
+def test_burst_collected_within_coalescing_window():
+    applied_commands = []
+    first_applied = threading.Event()
+    release = threading.Event()
+
+    def apply_command(relays_status: RelaysStatus):
+        applied_commands.append(relays_status)
+        first_applied.set()
+        release.wait(timeout=2)
+
+    relays_command_queue = RelaysCommandQueue(
+        apply_command=apply_command, coalescing_window_in_secs=0.2
+    )
+    relays_command_queue.start()
+    try:
+        relays_command_queue.put(command(0b001, 0b001, offset_in_secs=0))
+        assert first_applied.wait(timeout=1)
+        # Pending while the first command is applied: a burst, the next command received within
+        # the coalescing window joins it
+        relays_command_queue.put(command(0b010, 0b010, offset_in_secs=1))
+        relays_command_queue.put(command(0b100, 0b100, offset_in_secs=2))
+        release.set()
+        time.sleep(0.05)
+        relays_command_queue.put(command(0b000, 0b001, offset_in_secs=3))
+    finally:
+        relays_command_queue.stop()
+    assert [masks(applied_command) for applied_command in applied_commands] == [
+        (0b001, 0b001),
+        (0b110, 0b111),
+    ]
+
+
+def test_commands_dropped_while_stopping(applied_commands):
+    dropped = COMMANDS_DROPPED.labels().value
+    release = threading.Event()
+
+    def apply_command(relays_status: RelaysStatus):
+        release.wait(timeout=2)
+        applied_commands.append(relays_status)
+
+    relays_command_queue = RelaysCommandQueue(apply_command=apply_command)
+    relays_command_queue.start()
+    relays_command_queue.put(command(0b1, 0b1))
+    stopping = threading.Thread(target=relays_command_queue.stop)
+    stopping.start()
+    time.sleep(0.05)
+    relays_command_queue.put(command(0b10, 0b10))
+    release.set()
+    stopping.join()
+    assert COMMANDS_DROPPED.labels().value == dropped + 1
+    assert [masks(applied_command) for applied_command in applied_commands] == [(0b1, 0b1)]
+
+
+def test_failed_command_does_not_stop_worker():
+    applied_commands = []
+
+    def apply_command(relays_status: RelaysStatus):
+        applied_commands.append(relays_status)
+        if len(applied_commands) == 1:
+            raise RuntimeError("I2C failure")
+
+    relays_command_queue = RelaysCommandQueue(apply_command=apply_command)
+    relays_command_queue.put(command(0b1, 0b1, offset_in_secs=0))
+    drain(relays_command_queue)
+    relays_command_queue.put(command(0b10, 0b10, offset_in_secs=1))
+    drain(relays_command_queue)
+    assert [masks(applied_command) for applied_command in applied_commands] == [
+        (0b1, 0b1),
+        (0b10, 0b10),
+    ]
+
+
+def test_discard_stale_relays():
+    relays_timestamps = {}
+    fresh_commands = discard_stale_relays(
+        [
+            command(0b01, 0b01, offset_in_secs=2),
+            command(0b10, 0b11, offset_in_secs=1),
+            command(0b00, 0b01, offset_in_secs=1),
+            command(0b01, 0b01, offset_in_secs=3),
+        ],
+        relays_timestamps,
+    )
+    # Relay 0 of the second command is older than the first command, the third command is dropped
+    assert [masks(fresh_command) for fresh_command in fresh_commands] == [
+        (0b01, 0b01),
+        (0b10, 0b10),
+        (0b01, 0b01),
+    ]
+    assert relays_timestamps == {
+        0: command(0, 0, offset_in_secs=3).timestamp_ms(),
+        1: command(0, 0, offset_in_secs=1).timestamp_ms(),
+    }
+
+
+def test_recent_commands_bounded():
+    recent_commands = RecentCommands(max_size=2)
+    assert recent_commands.add("a")
+    assert recent_commands.add("b")
+    assert not recent_commands.add("a")
+    # "b" is the least recently seen
+    assert recent_commands.add("c")
+    assert recent_commands.add("b")
+    assert not recent_commands.add("c")
+
+
+def test_duplicated_command_dropped(applied_commands):
+    relays_command_queue = commands_queue(applied_commands)
+    duplicated = COMMANDS_DUPLICATED.labels().value
+    relays_command_queue.put(command(0b1, 0b1))
+    relays_command_queue.put(command(0b1, 0b1))
+    assert relays_command_queue.qsize() == 1
+    assert COMMANDS_DUPLICATED.labels().value == duplicated + 1
+
+
+def test_deduplication_disabled(applied_commands):
+    relays_command_queue = commands_queue(applied_commands, deduplication_size=0)
+    relays_command_queue.put(command(0b1, 0b1))
+    relays_command_queue.put(command(0b1, 0b1))
+    assert relays_command_queue.qsize() == 2
+
+
+def test_stale_relays_discarded(applied_commands):
+    relays_command_queue = commands_queue(applied_commands)
+    relays_command_queue.put(command(0b01, 0b01, offset_in_secs=2))
+    relays_command_queue.put(command(0b10, 0b11, offset_in_secs=1))
+    drain(relays_command_queue)
+    assert [masks(applied_command) for applied_command in applied_commands] == [(0b11, 0b11)]
+
+    # The timestamps of the relays applied are kept for the next batches
+    relays_command_queue.put(command(0b00, 0b01, offset_in_secs=1.5))
+    relays_command_queue.put(command(0b00, 0b10, offset_in_secs=1.5))
+    drain(relays_command_queue)
+    assert [masks(applied_command) for applied_command in applied_commands[1:]] == [(0b00, 0b10)]
+
+
+def test_stale_check_disabled(applied_commands):
+    relays_command_queue = commands_queue(applied_commands, discard_stale=False)
+    relays_command_queue.put(command(0b1, 0b1, offset_in_secs=2))
+    relays_command_queue.put(command(0b0, 0b1, offset_in_secs=1))
+    drain(relays_command_queue)
+    assert [masks(applied_command) for applied_command in applied_commands] == [(0b0, 0b1)]
+
+
+def test_failed_command_relays_not_recorded():
+    applied_commands = []
+
+    def apply_command(relays_status: RelaysStatus):
+        applied_commands.append(relays_status)
+        if len(applied_commands) == 1:
+            raise RuntimeError("I2C failure")
+
+    relays_command_queue = RelaysCommandQueue(apply_command=apply_command)
+    relays_command_queue.put(command(0b1, 0b1, offset_in_secs=1))
+    drain(relays_command_queue)
+    # Older than the failed command, not stale
+    relays_command_queue.put(command(0b0, 0b1, offset_in_secs=0))
+    drain(relays_command_queue)
+    assert [masks(applied_command) for applied_command in applied_commands] == [
+        (0b1, 0b1),
+        (0b0, 0b1),
+    ]
+
+
+def test_commands_timestamped_on_reception_not_checked(applied_commands):
+    relays_command_queue = commands_queue(applied_commands)
+    # Sender clock ahead of the panel clock
+    relays_command_queue.put(command(0b1, 0b1, offset_in_secs=60))
+    reception_command = command(0b0, 0b1)
+    relays_command_queue.put(reception_command, sender_clock=False)
+    # Neither deduplicated
+    relays_command_queue.put(reception_command, sender_clock=False)
+    assert relays_command_queue.qsize() == 3
+    drain(relays_command_queue)
+    assert [masks(applied_command) for applied_command in applied_commands] == [(0b0, 0b1)]
+
+    # Nor recorded as the last command applied to the relay
+    relays_command_queue.put(command(0b1, 0b1, offset_in_secs=61))
+    drain(relays_command_queue)
+    assert [masks(applied_command) for applied_command in applied_commands[1:]] == [(0b1, 0b1)]
+
+
+def test_full_queue_merge_keeps_reception_commands_unchecked(applied_commands):
+    relays_command_queue = commands_queue(applied_commands, max_size=1)
+    relays_command_queue.put(command(0b1, 0b1, offset_in_secs=60))
+    drain(relays_command_queue)
+    relays_command_queue.put(command(0b10, 0b10, offset_in_secs=61))
+    # Merged into the pending command, the merged command has the panel timestamp
+    relays_command_queue.put(command(0b0, 0b1), sender_clock=False)
+    drain(relays_command_queue)
+    assert [masks(applied_command) for applied_command in applied_commands[1:]] == [(0b10, 0b11)]
@@ -0,0 +1,106 @@
+"""Relays I2C executor tests"""
+
+import threading
+import pytest
+from server.interfaces.i2c import RecordingBusBackend, SimulatedBusBackend
+from server.relays_manager.board import RelaysBoard
+from server.relays_manager.executor import I2C_WRITES_SKIPPED, RelaysI2CExecutor
+from server.relays_manager.history import STATE_SOURCE_BUS, STATE_SOURCE_COMMAND
+
+
+@pytest.fixture
+def bus():
+    return RecordingBusBackend(SimulatedBusBackend())
+
+
+@pytest.fixture
+def state_changes():
+    return []
+
+
+@pytest.fixture
+def relays_executor(bus, state_changes):
+    boards = [
+        RelaysBoard(
+            name=name,
+            bus_number=1,
+            address=address,
+            relays_bits=[5, 4, 3, 2, 1, 0],
+            first_relay=first_relay,
+            bus=bus,
+        )
+        for name, address, first_relay in (("panel", 0x20, 0), ("extension", 0x21, 6))
+    ]
+    relays_executor = RelaysI2CExecutor(
+        boards, on_state_change=lambda state, source: state_changes.append((state, source))
+    )
+    relays_executor.start()
+    relays_executor.refresh().result(timeout=1)
+    bus.clear()
+    yield relays_executor
+    relays_executor.stop()
+
+
+def writes(bus: RecordingBusBackend):
+    return [
+        (transaction.address, transaction.value)
+        for transaction in bus.transactions
+        if transaction.operation == "write"
+    ]
+
+
+def test_state_read_on_refresh(relays_executor, state_changes):
+    state = relays_executor.state
+    assert (state.version, state.status_mask, state.boards_status_raw) == (0, 0, (0, 0))
+    assert state_changes == [(state, STATE_SOURCE_BUS)]
+
+
+def test_only_targeted_boards_written(relays_executor, bus, state_changes):
+    state, changed_mask = relays_executor.apply(set_mask=1 << 6, clear_mask=0b1).result(timeout=1)
+    assert changed_mask == 1 << 6
+    assert (state.version, state.status_mask) == (1, 1 << 6)
+    # Relay 6 is bit 5 of the extension board, relays active low
+    assert writes(bus) == [(0x21, 0b11011111)]
+    assert state_changes[-1] == (state, STATE_SOURCE_COMMAND)
+
+
+def test_board_already_in_status_not_written(relays_executor, bus):
+    relays_executor.apply(set_mask=0b1, clear_mask=0).result(timeout=1)
+    skipped = I2C_WRITES_SKIPPED.labels().value
+    state, changed_mask = relays_executor.apply(set_mask=0b1, clear_mask=0b10).result(timeout=1)
+    assert changed_mask == 0
+    assert state.version == 1
+    assert I2C_WRITES_SKIPPED.labels().value == skipped + 1
+    assert len(writes(bus)) == 1
+
+
+def test_commands_applied_in_order(relays_executor):
+    futures = [
+        relays_executor.apply(set_mask=1 << relay_number, clear_mask=0)
+        for relay_number in range(12)
+    ]
+    futures.append(relays_executor.apply(set_mask=0, clear_mask=0b1))
+    states = [future.result(timeout=1)[0] for future in futures]
+    # No lost update
+    assert states[-2].status_mask == 0xFFF
+    assert states[-1].status_mask == 0xFFE
+    assert [state.version for state in states] == list(range(1, 14))
+
+
+def test_wait_for_change(relays_executor):
+    assert relays_executor.wait_for_change(version=0, timeout=0.05).version == 0
+    threading.Timer(0.05, relays_executor.apply, (0b1, 0)).start()
+    assert relays_executor.wait_for_change(version=0, timeout=1).version == 1
+    # Another version: the current state at once
+    assert relays_executor.wait_for_change(version=None, timeout=1).version == 1
+
+
+def test_failed_write_revalidates_state(relays_executor, bus):
+    bus.backend.error_rate = 1
+    with pytest.raises(OSError):
+        relays_executor.apply(set_mask=0b1, clear_mask=0).result(timeout=1)
+    bus.backend.error_rate = 0
+    # Changed out of the executor, read back before the next operation
+    bus.backend.set_register(0x20, 0b11111110)
+    state, _ = relays_executor.apply(set_mask=1 << 6, clear_mask=0).result(timeout=1)
+    assert state.status_mask == 1 << 6 | 1 << 5
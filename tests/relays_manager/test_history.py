@@ -0,0 +1,92 @@
+"""Relays state history tests"""
+
+import pytest
+from server.relays_manager.history import (
+    STATE_SOURCE_BUS,
+    STATE_SOURCE_COMMAND,
+    RelaysHistory,
+    RelaysTransition,
+)
+
+
+@pytest.fixture
+def relays_history():
+    history = RelaysHistory(capacity=16, relays_number=6)
+    history.record(100.0, 0b01, STATE_SOURCE_BUS)
+    history.record(105.0, 0b11, STATE_SOURCE_COMMAND)
+    history.record(110.0, 0b10, STATE_SOURCE_COMMAND)
+    return history
+
+
+def test_record_ignores_unchanged_status(relays_history):
+    relays_history.record(111.0, 0b10, STATE_SOURCE_BUS)
+    assert len(relays_history) == 3
+
+
+def test_ring_buffer_overwrites_oldest():
+    history = RelaysHistory(capacity=3, relays_number=6)
+    for timestamp in range(5):
+        history.record(float(timestamp), timestamp + 1, STATE_SOURCE_COMMAND)
+    assert len(history) == 3
+    initial, transitions = history.get_transitions(0.0, 10.0)
+    assert initial is None
+    assert [transition.status_mask for transition in transitions] == [3, 4, 5]
+
+
+@pytest.mark.parametrize("relays_number", [6, 12, 24, 40])
+def test_status_mask_stored(relays_number):
+    history = RelaysHistory(capacity=10, relays_number=relays_number)
+    history.record(0.0, (1 << relays_number) - 1, STATE_SOURCE_BUS)
+    assert history.get_transitions(-1.0, 1.0)[1][0].status_mask == (1 << relays_number) - 1
+
+
+def test_size_in_bytes():
+    # Timestamp (8 bytes), status mask (1 byte up to 8 relays) and source (1 byte)
+    assert RelaysHistory(capacity=10, relays_number=6).size_in_bytes == 100
+
+
+def test_get_transitions(relays_history):
+    initial, transitions = relays_history.get_transitions(103.0, 110.0)
+    assert initial == RelaysTransition(100.0, 0b01, STATE_SOURCE_BUS)
+    assert transitions == [
+        RelaysTransition(105.0, 0b11, STATE_SOURCE_COMMAND),
+        RelaysTransition(110.0, 0b10, STATE_SOURCE_COMMAND),
+    ]
+    # The window excludes its start
+    initial, transitions = relays_history.get_transitions(105.0, 106.0)
+    assert initial.timestamp == 105.0
+    assert transitions == []
+
+
+def test_get_transitions_before_history(relays_history):
+    initial, transitions = relays_history.get_transitions(90.0, 101.0)
+    assert initial is None
+    assert [transition.timestamp for transition in transitions] == [100.0]
+
+
+def test_duty_cycles(relays_history):
+    duty_cycles = relays_history.get_duty_cycles(100.0, 120.0, 4, [0, 1, 2])
+    assert duty_cycles == {
+        0: [1.0, 1.0, 0.0, 0.0],
+        1: [0.0, 1.0, 1.0, 1.0],
+        2: [0.0, 0.0, 0.0, 0.0],
+    }
+
+
+def test_duty_cycles_partial_buckets(relays_history):
+    duty_cycles = relays_history.get_duty_cycles(102.0, 112.0, 2, [0, 1])
+    assert duty_cycles[0] == pytest.approx([1.0, 0.6])
+    assert duty_cycles[1] == pytest.approx([0.4, 1.0])
+
+
+def test_duty_cycles_unknown_before_history(relays_history):
+    duty_cycles = relays_history.get_duty_cycles(90.0, 110.0, 4, [0])
+    # Unknown before the first transition, the time before it is not accounted
+    assert duty_cycles[0] == [None, None, 1.0, 1.0]
+    duty_cycles = relays_history.get_duty_cycles(95.0, 105.0, 2, [0])
+    assert duty_cycles[0] == [None, 1.0]
+
+
+def test_duty_cycles_empty_history():
+    history = RelaysHistory(capacity=4, relays_number=6)
+    assert history.get_duty_cycles(0.0, 10.0, 2, [0]) == {0: [None, None]}
@@ -0,0 +1,147 @@
+"""Relays state journal tests"""
+
+import os
+import pytest
+from server.relays_manager.bitmask import RelaysBitmask
+from server.relays_manager.journal import (
+    JOURNAL_HEADER,
+    JOURNAL_RECORD,
+    JournalRecord,
+    RelaysStateJournal,
+    compile_relays_restore_policy,
+)
+
+
+@pytest.fixture
+def journal_path(tmp_path):
+    return str(tmp_path / "journal" / "relays-state.journal")
+
+
+def write_journal(path: str, status_masks, fsync_period_in_secs: float = 0, max_records=4096):
+    journal = RelaysStateJournal(
+        path, fsync_period_in_secs=fsync_period_in_secs, max_records=max_records
+    )
+    journal.recover()
+    journal.start()
+    for status_mask in status_masks:
+        journal.append(status_mask)
+    journal.stop()
+    return journal
+
+
+def test_recover_missing_journal(journal_path):
+    journal = RelaysStateJournal(journal_path)
+    assert journal.recover() is None
+    journal.stop()
+    with open(journal_path, "rb") as journal_file:
+        assert journal_file.read() == JOURNAL_HEADER
+
+
+def test_recover_last_record(journal_path):
+    write_journal(journal_path, [0b1, 0b11, 0b11, 0b10])
+
+    journal = RelaysStateJournal(journal_path)
+    last_record = journal.recover()
+    journal.stop()
+    assert last_record.status_mask == 0b10
+    # The status repeated is not journaled
+    assert last_record.sequence == 3
+    assert os.path.getsize(journal_path) == len(JOURNAL_HEADER) + 3 * JOURNAL_RECORD.size
+
+
+def test_stop_writes_pending_records(journal_path):
+    write_journal(journal_path, [0b1, 0b101], fsync_period_in_secs=3600)
+
+    journal = RelaysStateJournal(journal_path)
+    assert journal.recover().status_mask == 0b101
+    journal.stop()
+
+
+def test_recover_truncates_torn_record(journal_path):
+    write_journal(journal_path, [0b1, 0b11])
+    torn_record = JournalRecord(sequence=3, timestamp_ms=0, status_mask=0b111).pack()
+    with open(journal_path, "ab") as journal_file:
+        journal_file.write(torn_record[:10])
+
+    journal = RelaysStateJournal(journal_path)
+    assert journal.recover().status_mask == 0b11
+    journal.stop()
+    assert os.path.getsize(journal_path) == len(JOURNAL_HEADER) + 2 * JOURNAL_RECORD.size
+
+
+def test_recover_truncates_corrupted_records(journal_path):
+    write_journal(journal_path, [0b1, 0b11, 0b111])
+    with open(journal_path, "r+b") as journal_file:
+        # Flip a status mask bit of the second record, the records after it are dropped
+        offset = len(JOURNAL_HEADER) + JOURNAL_RECORD.size + 16
+        journal_file.seek(offset)
+        byte = journal_file.read(1)[0]
+        journal_file.seek(offset)
+        journal_file.write(bytes([byte ^ 0x80]))
+
+    journal = RelaysStateJournal(journal_path)
+    last_record = journal.recover()
+    assert last_record.status_mask == 0b1
+    assert os.path.getsize(journal_path) == len(JOURNAL_HEADER) + JOURNAL_RECORD.size
+
+    # The sequence continues after the last valid record
+    journal.start()
+    journal.append(0b1000)
+    journal.stop()
+    journal = RelaysStateJournal(journal_path)
+    last_record = journal.recover()
+    journal.stop()
+    assert (last_record.sequence, last_record.status_mask) == (2, 0b1000)
+
+
+def test_recover_rejects_out_of_order_sequence(journal_path):
+    write_journal(journal_path, [0b1])
+    with open(journal_path, "ab") as journal_file:
+        journal_file.write(JournalRecord(sequence=1, timestamp_ms=0, status_mask=0b10).pack())
+
+    journal = RelaysStateJournal(journal_path)
+    assert journal.recover().status_mask == 0b1
+    journal.stop()
+
+
+def test_recover_invalid_header(journal_path):
+    os.makedirs(os.path.dirname(journal_path))
+    with open(journal_path, "wb") as journal_file:
+        journal_file.write(b"NOTAJRNL" + JournalRecord(1, 0, 0b1).pack())
+
+    journal = RelaysStateJournal(journal_path)
+    assert journal.recover() is None
+    journal.stop()
+    with open(journal_path, "rb") as journal_file:
+        assert journal_file.read() == JOURNAL_HEADER
+
+
+def test_compaction(journal_path):
+    write_journal(journal_path, range(1, 11), max_records=4)
+
+    assert os.path.getsize(journal_path) <= len(JOURNAL_HEADER) + 4 * JOURNAL_RECORD.size
+    journal = RelaysStateJournal(journal_path)
+    last_record = journal.recover()
+    journal.stop()
+    assert last_record.status_mask == 10
+    assert last_record.sequence == 10
+
+
+def test_restore_policy():
+    restore_policy = compile_relays_restore_policy(
+        "last", {1: "force_on", 2: "force_off"}, RelaysBitmask(relays_number=4)
+    )
+    assert restore_policy.initial_status_mask(0b1111) == 0b1011
+    assert restore_policy.initial_status_mask(0b0100) == 0b0010
+    # Without last status, the relays restored are OFF
+    assert restore_policy.initial_status_mask(None) == 0b0010
+
+
+@pytest.mark.parametrize(
+    "default_policy, relays_policies", [("last", {4: "force_on"}), ("last", {0: "on"}), ("x", {})]
+)
+def test_invalid_restore_policy(default_policy, relays_policies):
+    with pytest.raises(ValueError):
+        compile_relays_restore_policy(
+            default_policy, relays_policies, RelaysBitmask(relays_number=4)
+        )
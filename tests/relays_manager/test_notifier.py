@@ -0,0 +1,120 @@
+"""Relays status notifier tests"""
+
+import threading
+import time
+import pytest
+from server.relays_manager.notifier import RelaysStatusNotifier
+
+
+class RelaysPanel:
+    """Relays status read by the notifier, records the publications"""
+
+    def __init__(self):
+        self.status_mask = 0
+        self.bus_reads = 0
+        self.publications = []
+        self.published = threading.Condition()
+
+    def read_status(self, refresh: bool) -> int:
+        if refresh:
+            self.bus_reads += 1
+        return self.status_mask
+
+    def publish_status(self):
+        with self.published:
+            self.publications.append((time.monotonic(), self.status_mask))
+            self.published.notify_all()
+
+    def wait_publications(self, count: int, timeout: float = 2):
+        with self.published:
+            assert self.published.wait_for(lambda: len(self.publications) >= count, timeout)
+
+
+@pytest.fixture
+def relays_panel():
+    return RelaysPanel()
+
+
+@pytest.fixture
+def start_notifier(relays_panel):
+    notifiers = []
+
+    def start(**kwargs):
+        notifier = RelaysStatusNotifier(
+            publish_status=relays_panel.publish_status,
+            read_status=relays_panel.read_status,
+            **kwargs,
+        )
+        notifier.start()
+        notifiers.append(notifier)
+        return notifier
+
+    yield start
+    for notifier in notifiers:
+        notifier.stop()
+
+
+def test_status_published_on_start_and_on_change(start_notifier, relays_panel):
+    notifier = start_notifier(heartbeat_min_period_in_secs=60, heartbeat_max_period_in_secs=60)
+    relays_panel.wait_publications(1)
+    start = time.monotonic()
+    relays_panel.status_mask = 0b1
+    notifier.status_changed()
+    relays_panel.wait_publications(2)
+    assert relays_panel.publications[1][1] == 0b1
+    assert relays_panel.publications[1][0] - start < 1
+    # The watcher is disabled
+    assert relays_panel.bus_reads == 0
+
+
+def test_heartbeat_period_grows_while_quiet(start_notifier, relays_panel):
+    start_notifier(heartbeat_min_period_in_secs=0.05, heartbeat_max_period_in_secs=0.2)
+    relays_panel.wait_publications(6)
+    times = [published_at for published_at, _ in relays_panel.publications]
+    periods = [later - earlier for earlier, later in zip(times, times[1:])]
+    assert periods[0] == pytest.approx(0.05, abs=0.04)
+    assert periods[1] == pytest.approx(0.1, abs=0.04)
+    assert periods[4] == pytest.approx(0.2, abs=0.04)
+
+
+def test_heartbeat_period_reset_on_change(start_notifier, relays_panel):
+    notifier = start_notifier(heartbeat_min_period_in_secs=0.05, heartbeat_max_period_in_secs=1)
+    relays_panel.wait_publications(4)
+    relays_panel.status_mask = 0b10
+    notifier.status_changed()
+    relays_panel.wait_publications(6)
+    changed_at, heartbeat_at = (published_at for published_at, _ in relays_panel.publications[4:6])
+    assert heartbeat_at - changed_at == pytest.approx(0.05, abs=0.04)
+
+
+def test_watcher_detects_changes_not_signaled(start_notifier, relays_panel):
+    start_notifier(
+        heartbeat_min_period_in_secs=60,
+        heartbeat_max_period_in_secs=60,
+        watcher_period_in_secs=0.05,
+    )
+    relays_panel.wait_publications(1)
+    time.sleep(0.2)
+    # Unchanged: read but not published
+    assert relays_panel.bus_reads >= 2
+    assert len(relays_panel.publications) == 1
+    relays_panel.status_mask = 0b100
+    relays_panel.wait_publications(2)
+    assert relays_panel.publications[1][1] == 0b100
+
+
+def test_publication_failure_does_not_stop_notifier(start_notifier, relays_panel):
+    publish_status = relays_panel.publish_status
+    calls = []
+
+    def failing_publish_status():
+        calls.append(None)
+        if len(calls) == 1:
+            raise RuntimeError("Broker unreachable")
+        publish_status()
+
+    relays_panel.publish_status = failing_publish_status
+    notifier = start_notifier(heartbeat_min_period_in_secs=60, heartbeat_max_period_in_secs=60)
+    time.sleep(0.05)
+    notifier.status_changed()
+    relays_panel.wait_publications(1)
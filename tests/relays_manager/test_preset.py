@@ -0,0 +1,33 @@
+"""Relays presets tests"""
+
+import pytest
+from server.relays_manager.bitmask import RelaysBitmask
+from server.relays_manager.preset import compile_relays_presets
+
+
+def test_presets_compiled_into_masks():
+    presets = compile_relays_presets(
+        {"evening": {"relays_on": [0, 2]}, "away": {"relays_on": [5], "relays_off": [0, 1, 2]}},
+        RelaysBitmask(relays_number=6),
+    )
+    evening, away = presets["evening"], presets["away"]
+    assert (evening.set_mask, evening.clear_mask) == (0b101, 0)
+    assert (away.set_mask, away.clear_mask) == (0b100000, 0b111)
+    assert (away.relays_on, away.relays_off) == ([5], [0, 1, 2])
+
+    relays_status = away.to_relays_status()
+    assert relays_status.command
+    assert (relays_status.status_mask, relays_status.validity_mask) == (0b100000, 0b100111)
+
+
+def test_no_presets():
+    assert compile_relays_presets(None, RelaysBitmask(relays_number=6)) == {}
+
+
+@pytest.mark.parametrize(
+    "preset_config",
+    [{"relays_on": [6]}, {"relays_off": [-1]}, {"relays_on": [1, 2], "relays_off": [2]}],
+)
+def test_invalid_preset(preset_config):
+    with pytest.raises(ValueError):
+        compile_relays_presets({"invalid": preset_config}, RelaysBitmask(relays_number=6))
@@ -0,0 +1,73 @@
+"""Retained relays status and per relay MQTT topics tests"""
+
+import time
+from server.interfaces.mqtt.codec import deserialize
+from server.relays_manager import relays_manager_service
+
+
+def wait_until(predicate, timeout: float = 2) -> bool:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def relays_status_mask() -> int:
+    return relays_manager_service.get_relays_state().status_mask
+
+
+def test_relays_status_retained(client, relays_off, mqtt_subscriber):
+    status_subscriber = mqtt_subscriber("status/relays")
+    client.post("/relays/?relay_2=true")
+    assert status_subscriber.wait_messages(
+        lambda message: not message.retain and deserialize(message.payload).status_mask == 0b100
+    )
+
+    # A new subscriber gets the last status at once
+    late_subscriber = mqtt_subscriber("status/relays")
+    retained = late_subscriber.wait_messages(lambda message: message.retain)
+    assert deserialize(retained[-1].payload).status_mask == 0b100
+
+
+def test_changed_relays_published_on_their_topic(client, relays_off, mqtt_subscriber):
+    relay_subscriber = mqtt_subscriber("status/relays/+")
+    # The status of every relay is retained
+    assert wait_until(
+        lambda: {message.topic for message in relay_subscriber.messages if message.retain}
+        == {f"status/relays/{relay_number}" for relay_number in range(8)}
+    )
+    # Publications of the relays set OFF before the test
+    time.sleep(0.2)
+    relay_subscriber.clear()
+
+    client.post("/relays/?relay_7=true")
+    published = relay_subscriber.wait_messages(lambda message: True)
+    assert [(message.topic, message.payload) for message in published] == [
+        ("status/relays/7", b"1")
+    ]
+    client.post("/relays/?relay_7=false&relay_0=true")
+    assert wait_until(lambda: len(relay_subscriber.messages) == 3)
+    # Only the relays changed are published
+    time.sleep(0.1)
+    assert sorted((message.topic, message.payload) for message in relay_subscriber.messages) == [
+        ("status/relays/0", b"1"),
+        ("status/relays/7", b"0"),
+        ("status/relays/7", b"1"),
+    ]
+
+
+def test_relay_command_topics(relays_off, mqtt_subscriber):
+    commander = mqtt_subscriber("command/relays/relay/unused")
+    commander.publish("command/relays/relay/6", b"1")
+    assert wait_until(lambda: relays_status_mask() == 1 << 6)
+    commander.publish("command/relays/relay/1", b"\x01")
+    commander.publish("command/relays/relay/6", b"\x00")
+    assert wait_until(lambda: relays_status_mask() == 1 << 1)
+
+    # Rejected: unknown relay, invalid payload
+    commander.publish("command/relays/relay/8", b"1")
+    commander.publish("command/relays/relay/2", b"on")
+    commander.publish("command/relays/relay/3", b"1")
+    assert wait_until(lambda: relays_status_mask() == 1 << 1 | 1 << 3)
@@ -0,0 +1,128 @@
+"""Relays scheduler tests"""
+
+import queue
+import time
+import pytest
+from server.relays_manager.scheduler import RelaysScheduler
+
+
+@pytest.fixture
+def applied_commands():
+    return queue.Queue()
+
+
+@pytest.fixture
+def relays_scheduler(applied_commands):
+    scheduler = RelaysScheduler(
+        apply_command=lambda set_mask, clear_mask: applied_commands.put((set_mask, clear_mask)),
+        max_schedules=3,
+        merge_window_in_secs=0.05,
+    )
+    yield scheduler
+    scheduler.stop()
+
+
+def next_command(applied_commands: queue.Queue):
+    return applied_commands.get(timeout=2)
+
+
+def test_schedule_applied_once(relays_scheduler, applied_commands):
+    schedule = relays_scheduler.add_schedule(set_mask=0b01, clear_mask=0b10)
+    assert relays_scheduler.get_schedule(schedule.schedule_id) is schedule
+    assert schedule.relays_on == [0]
+    assert schedule.relays_off == [1]
+    relays_scheduler.start()
+    assert next_command(applied_commands) == (0b01, 0b10)
+    # A schedule without duration nor period is done once applied
+    assert relays_scheduler.get_schedule(schedule.schedule_id) is None
+
+
+def test_schedules_due_together_are_merged(relays_scheduler, applied_commands):
+    relays_scheduler.add_schedule(set_mask=0b011, clear_mask=0b100, delay_in_secs=0.1)
+    relays_scheduler.add_schedule(set_mask=0b100, clear_mask=0b001, delay_in_secs=0.11)
+    relays_scheduler.start()
+    # The latest schedule wins for relay 0 and relay 2
+    assert next_command(applied_commands) == (0b110, 0b001)
+    assert applied_commands.empty()
+
+
+def test_pulse_reverted_after_duration(relays_scheduler, applied_commands):
+    relays_scheduler.start()
+    schedule = relays_scheduler.add_schedule(set_mask=0b1, clear_mask=0, duration_in_secs=0.1)
+    start = time.monotonic()
+    assert next_command(applied_commands) == (0b1, 0)
+    assert next_command(applied_commands) == (0, 0b1)
+    assert time.monotonic() - start >= 0.1 - relays_scheduler.merge_window_in_secs
+    assert relays_scheduler.get_schedules() == []
+    assert relays_scheduler.get_schedule(schedule.schedule_id) is None
+
+
+def test_periodic_schedule(relays_scheduler, applied_commands):
+    relays_scheduler.start()
+    schedule = relays_scheduler.add_schedule(
+        set_mask=0b1, clear_mask=0, duration_in_secs=0.05, period_in_secs=0.2
+    )
+    for _ in range(2):
+        assert next_command(applied_commands) == (0b1, 0)
+        assert next_command(applied_commands) == (0, 0b1)
+    assert relays_scheduler.get_schedules() == [schedule]
+    relays_scheduler.cancel_schedule(schedule.schedule_id)
+    time.sleep(0.3)
+    while not applied_commands.empty():
+        # At most the revert of the period in progress
+        assert applied_commands.get_nowait() == (0, 0b1)
+
+
+def test_cancelled_schedule_not_applied(relays_scheduler, applied_commands):
+    schedule = relays_scheduler.add_schedule(set_mask=0b1, clear_mask=0, delay_in_secs=0.1)
+    relays_scheduler.add_schedule(set_mask=0b10, clear_mask=0, delay_in_secs=0.2)
+    assert relays_scheduler.cancel_schedule(schedule.schedule_id) is schedule
+    assert relays_scheduler.cancel_schedule(schedule.schedule_id) is None
+    relays_scheduler.start()
+    assert next_command(applied_commands) == (0b10, 0)
+
+
+def test_max_schedules(relays_scheduler):
+    for _ in range(relays_scheduler.max_schedules):
+        relays_scheduler.add_schedule(set_mask=0b1, clear_mask=0, delay_in_secs=60)
+    with pytest.raises(ValueError):
+        relays_scheduler.add_schedule(set_mask=0b1, clear_mask=0, delay_in_secs=60)
+    # A cancelled schedule frees its place
+    relays_scheduler.cancel_schedule(relays_scheduler.get_schedules()[0].schedule_id)
+    relays_scheduler.add_schedule(set_mask=0b1, clear_mask=0, delay_in_secs=60)
+
+
+@pytest.mark.parametrize("duration_in_secs, period_in_secs", [(None, 0), (10, 10), (10, 5)])
+def test_period_shorter_than_duration(relays_scheduler, duration_in_secs, period_in_secs):
+    with pytest.raises(ValueError):
+        relays_scheduler.add_schedule(
+            set_mask=0b1,
+            clear_mask=0,
+            duration_in_secs=duration_in_secs,
+            period_in_secs=period_in_secs,
+        )
+
+
+def test_periodic_job(relays_scheduler, applied_commands):
+    runs = queue.Queue()
+    relays_scheduler.add_job("test", lambda: runs.put(time.monotonic()), period_in_secs=0.05)
+    relays_scheduler.start()
+    for _ in range(3):
+        runs.get(timeout=2)
+    assert applied_commands.empty()
+
+
+def test_failing_command_does_not_stop_scheduler(applied_commands):
+    def apply_command(set_mask, clear_mask):
+        applied_commands.put((set_mask, clear_mask))
+        raise RuntimeError("I2C failure")
+
+    scheduler = RelaysScheduler(apply_command=apply_command)
+    scheduler.start()
+    try:
+        scheduler.add_schedule(set_mask=0b1, clear_mask=0)
+        scheduler.add_schedule(set_mask=0b10, clear_mask=0, delay_in_secs=0.1)
+        assert next_command(applied_commands) == (0b1, 0)
+        assert next_command(applied_commands) == (0b10, 0)
+    finally:
+        scheduler.stop()
@@ -0,0 +1,41 @@
+"""Relays manager service tests (without app)"""
+
+from server.interfaces.mqtt import RelaysStatus
+from server.relays_manager.bitmask import RelaysBitmask
+from server.relays_manager.command_queue import RelaysCommandQueue
+from server.relays_manager.service import RelaysManager
+
+
+def relays_manager(relays_number: int = 6) -> RelaysManager:
+    manager = RelaysManager()
+    manager.relays_bitmask = RelaysBitmask(relays_number=relays_number)
+    manager.relays_command_queue = RelaysCommandQueue(apply_command=lambda _: None)
+    return manager
+
+
+def pending_masks(manager: RelaysManager):
+    return [
+        (command.status_mask, command.validity_mask)
+        for _, command, _ in manager.relays_command_queue._pending
+    ]
+
+
+def test_relays_command_unknown_relays_dropped():
+    manager = relays_manager()
+    manager.on_relays_command(
+        RelaysStatus.from_mask(status_mask=0b1000001, validity_mask=0b11000011, command=True)
+    )
+    assert pending_masks(manager) == [(0b000001, 0b000011)]
+
+
+def test_relays_command_without_known_relay_dropped():
+    manager = relays_manager()
+    manager.on_relays_command(RelaysStatus.from_mask(0b1 << 6, 0b11 << 6, command=True))
+    assert pending_masks(manager) == []
+
+
+def test_relays_command_queued():
+    manager = relays_manager()
+    command = RelaysStatus.from_mask(0b10, 0b110, command=True, correlation_id="9f1c2d")
+    manager.on_relays_command(command)
+    assert manager.relays_command_queue._pending[0][1] is command
@@ -0,0 +1,100 @@
+"""Relays manager startup stages tests"""
+
+import threading
+from concurrent.futures import Future
+from unittest.mock import Mock
+from server.relays_manager import service
+from server.relays_manager.bitmask import RelaysBitmask
+from server.relays_manager.journal import RelaysStateJournal
+from server.relays_manager.service import (
+    OPTIONAL_STARTUP_STAGES,
+    STAGE_MQTT,
+    STAGE_RELAYS_BOARDS,
+    STAGE_RELAYS_STATUS,
+    STAGE_SELF_TEST,
+    STARTUP_STAGES,
+    RelaysManager,
+)
+from server.relays_manager.startup import STAGE_FAILED, StartupStages
+
+
+def test_ready_when_every_stage_done_or_skipped():
+    startup_stages = StartupStages(["boards", "self_test"])
+    assert not startup_stages.ready
+    startup_stages.done("boards")
+    assert not startup_stages.ready
+    startup_stages.skip("self_test")
+    assert startup_stages.ready
+
+
+def test_failed_stage_blocks_readiness_unless_optional():
+    startup_stages = StartupStages(["boards", "self_test"], optional_names=["self_test"])
+    startup_stages.done("boards")
+    startup_stages.start("self_test")
+    assert not startup_stages.ready
+    startup_stages.fail("self_test", "Relay 2 not switched")
+    assert startup_stages.ready
+    startup_stages.fail("boards", "I2C failure")
+    assert not startup_stages.ready
+
+
+def warming_up_relays_manager() -> RelaysManager:
+    """Relays manager whose warm up stages succeed, except the self test"""
+
+    manager = RelaysManager()
+    manager.startup_stages = StartupStages(STARTUP_STAGES, OPTIONAL_STARTUP_STAGES)
+    manager.startup_stages.done(STAGE_MQTT)
+    manager.relays_warmup_retry_delay_in_secs = 0
+    manager.relays_self_test_enabled = True
+    refreshed = Future()
+    refreshed.set_result(None)
+    manager.relays_i2c_executor = Mock(**{"refresh.return_value": refreshed})
+    manager.test_relays_status = Mock(side_effect=RuntimeError("Relay 2 not switched"))
+    manager.relays_journal_file = None
+    manager.init_relays_status = Mock()
+    manager.relays_command_queue = Mock()
+    manager.relays_scheduler = Mock()
+    manager.start_relays_status_notification = Mock()
+    return manager
+
+
+def test_failed_self_test_does_not_block_readiness():
+    manager = warming_up_relays_manager()
+    manager.warm_up()
+    stages = {stage["name"]: stage for stage in manager.startup_stages.to_json()}
+    assert stages[STAGE_SELF_TEST]["state"] == STAGE_FAILED
+    assert stages[STAGE_SELF_TEST]["error"] == "Relay 2 not switched"
+    assert manager.startup_stages.is_done(STAGE_RELAYS_BOARDS)
+    assert manager.startup_stages.is_done(STAGE_RELAYS_STATUS)
+    assert manager.startup_stages.ready
+    manager.relays_command_queue.start.assert_called_once()
+
+
+def test_journal_recovered_once_when_relays_status_retried(tmp_path, monkeypatch):
+    journal_path = str(tmp_path / "relays-state.journal")
+    journal = RelaysStateJournal(journal_path, fsync_period_in_secs=0)
+    journal.recover()
+    journal.start()
+    journal.append(0b101)
+    journal.stop()
+
+    exit_callbacks = []
+    monkeypatch.setattr(service.atexit, "register", exit_callbacks.append)
+    manager = warming_up_relays_manager()
+    manager.relays_self_test_enabled = False
+    manager.relays_bitmask = RelaysBitmask(relays_number=6)
+    manager.relays_journal_file = journal_path
+    manager.relays_journal_fsync_period_in_secs = 0
+    manager.relays_journal_max_records = 4096
+    manager.init_relays_status = Mock(side_effect=[RuntimeError("I2C failure"), None])
+    manager.warm_up()
+    try:
+        assert manager.init_relays_status.call_count == 2
+        manager.init_relays_status.assert_called_with(0b101)
+        # A single journal writer
+        assert len(exit_callbacks) == 1
+        assert exit_callbacks[0] == manager.relays_state_journal.stop
+        writers = [thread for thread in threading.enumerate() if thread.name == "relays-journal"]
+        assert len(writers) == 1
+    finally:
+        manager.relays_state_journal.stop()
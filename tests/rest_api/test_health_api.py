@@ -0,0 +1,46 @@
+"""Health REST API tests"""
+
+import pytest
+from server.relays_manager import relays_manager_service
+from server.relays_manager.service import STAGE_MQTT, STAGE_SELF_TEST
+
+
+@pytest.fixture
+def startup_stages(app):
+    startup_stages = relays_manager_service.startup_stages
+    yield startup_stages
+    startup_stages.skip(STAGE_SELF_TEST)
+    startup_stages.done(STAGE_MQTT)
+
+
+def test_live(client):
+    response = client.get("/health/live")
+    assert response.status_code == 200
+    assert response.json["alive"]
+
+
+def test_ready(client):
+    response = client.get("/health/ready")
+    assert response.status_code == 200
+    assert response.json["ready"]
+    assert {stage["name"]: stage["state"] for stage in response.json["stages"]} == {
+        "relays_boards": "done",
+        "mqtt": "done",
+        "self_test": "skipped",
+        "relays_status": "done",
+    }
+
+
+def test_failed_self_test_still_ready(client, startup_stages):
+    startup_stages.fail(STAGE_SELF_TEST, "Relay 2 not switched")
+    response = client.get("/health/ready")
+    assert response.status_code == 200
+    self_test = next(stage for stage in response.json["stages"] if stage["name"] == STAGE_SELF_TEST)
+    assert (self_test["state"], self_test["error"]) == ("failed", "Relay 2 not switched")
+
+
+def test_not_ready_without_broker(client, startup_stages):
+    startup_stages.fail(STAGE_MQTT, "Not connected to broker")
+    response = client.get("/health/ready")
+    assert response.status_code == 503
+    assert not response.json["ready"]
@@ -0,0 +1,20 @@
+"""Metrics REST API tests"""
+
+
+def samples(client) -> dict:
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type == "text/plain; version=0.0.4; charset=utf-8"
+    return dict(
+        line.rsplit(" ", 1) for line in response.data.decode().splitlines() if line[0] != "#"
+    )
+
+
+def test_metrics_scraped(client, relays_off):
+    client.post("/relays/?relay_1=true&relay_6=true")
+    metrics = samples(client)
+    assert metrics["relays_status_mask"] == str(1 << 1 | 1 << 6)
+    board_writes = 'relays_i2c_transaction_duration_seconds_count{operation="write",board="panel"}'
+    assert int(metrics[board_writes]) >= 1
+    route_count = 'http_request_duration_seconds_count{method="POST",route="/relays/",status="200"}'
+    assert int(metrics[route_count]) >= 1
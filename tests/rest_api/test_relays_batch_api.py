@@ -0,0 +1,64 @@
+"""Relays batch and presets REST API tests"""
+
+from server.relays_manager.board import I2C_TRANSACTION_DURATION
+
+
+def board_writes(board_name: str) -> int:
+    return I2C_TRANSACTION_DURATION.labels("write", board_name).count
+
+
+def relays_on(client) -> list:
+    return [
+        relay_status["relay_number"]
+        for relay_status in client.get("/relays/").json["relay_statuses"]
+        if relay_status["status"]
+    ]
+
+
+def test_batch_single_write_per_board(client, relays_off):
+    panel_writes, extension_writes = board_writes("panel"), board_writes("extension")
+    response = client.post(
+        "/relays/batch",
+        json={
+            "relay_statuses": [
+                {"relay_number": 0, "status": True},
+                {"relay_number": 2, "status": True},
+                {"relay_number": 7, "status": True},
+                # The last status of a relay wins
+                {"relay_number": 2, "status": False},
+            ]
+        },
+    )
+    assert response.status_code == 200
+    assert relays_on(client) == [0, 7]
+    assert board_writes("panel") == panel_writes + 1
+    assert board_writes("extension") == extension_writes + 1
+
+
+def test_batch_invalid(client):
+    response = client.post(
+        "/relays/batch", json={"relay_statuses": [{"relay_number": 8, "status": True}]}
+    )
+    assert response.status_code == 400
+    assert client.post("/relays/batch", json={"relay_statuses": []}).status_code == 422
+
+
+def test_presets(client):
+    response = client.get("/relays/presets/")
+    assert response.status_code == 200
+    assert {preset["name"]: preset for preset in response.json}["evening"] == {
+        "name": "evening",
+        "relays_on": [0, 6],
+        "relays_off": [1],
+    }
+    assert client.get("/relays/presets/evening").json["relays_on"] == [0, 6]
+    assert client.get("/relays/presets/unknown").status_code == 400
+
+
+def test_preset_applied(client, relays_off):
+    client.post("/relays/?relay_1=true&relay_2=true")
+    response = client.post("/relays/presets/evening")
+    assert response.status_code == 200
+    # The relays not listed keep their status
+    assert relays_on(client) == [0, 2, 6]
+    assert client.post("/relays/presets/unknown").status_code == 400
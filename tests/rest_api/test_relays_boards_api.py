@@ -0,0 +1,58 @@
+"""Relays boards REST API tests"""
+
+from server.relays_manager import relays_manager_service
+
+
+def board_register(address: int) -> int:
+    return relays_manager_service.buses[1].read_byte(address)
+
+
+def test_boards(client):
+    response = client.get("/relays/boards/")
+    assert response.status_code == 200
+    assert response.json == [
+        {"name": "panel", "bus_number": 1, "address": 0x20, "first_relay": 0, "relays_number": 6},
+        {
+            "name": "extension",
+            "bus_number": 1,
+            "address": 0x21,
+            "first_relay": 6,
+            "relays_number": 2,
+        },
+    ]
+
+
+def test_board_relay_has_global_number(client, relays_off):
+    response = client.post("/relays/boards/extension/1?status=true")
+    assert response.status_code == 200
+    assert response.json == {"relay_number": 7, "status": True}
+    # Relay 1 of the extension board is its bit 1, active low
+    assert board_register(0x21) == 0b11111101
+    assert board_register(0x20) == 0xFF
+
+    assert client.get("/relays/single/7").json == {"relay_number": 7, "status": True}
+    assert client.get("/relays/boards/extension/1").json == {"relay_number": 7, "status": True}
+
+
+def test_relays_of_all_boards_set_at_once(client, relays_off):
+    response = client.post("/relays/?relay_0=true&relay_6=true")
+    assert response.status_code == 200
+    assert board_register(0x20) == 0b11011111
+    assert board_register(0x21) == 0b11111110
+    relay_statuses = client.get("/relays/").json["relay_statuses"]
+    assert [relay_status["status"] for relay_status in relay_statuses] == [
+        True,
+        False,
+        False,
+        False,
+        False,
+        False,
+        True,
+        False,
+    ]
+
+
+def test_invalid_board_relay(client):
+    assert client.get("/relays/boards/garage/0").status_code == 400
+    assert client.get("/relays/boards/extension/2").status_code == 400
+    assert client.post("/relays/?relay_8=true").status_code == 400
@@ -0,0 +1,29 @@
+"""Relays status conditional GET tests"""
+
+from werkzeug.http import parse_date
+
+
+def test_not_modified_until_relays_change(client, relays_off):
+    response = client.get("/relays/")
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    assert response.headers["Cache-Control"] == "no-cache"
+    assert parse_date(response.headers["Last-Modified"]) is not None
+
+    response = client.get("/relays/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+    # The ETag is the relays state one, shared by the single relay status
+    assert client.get("/relays/single/1", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/relays/boards/panel/1", headers={"If-None-Match": etag}).status_code == 304
+
+    client.post("/relays/?relay_1=true")
+    response = client.get("/relays/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_command_without_change_keeps_etag(client, relays_off):
+    etag = client.get("/relays/").headers["ETag"]
+    client.post("/relays/?relay_1=false")
+    assert client.get("/relays/", headers={"If-None-Match": etag}).status_code == 304
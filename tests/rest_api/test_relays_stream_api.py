@@ -0,0 +1,95 @@
+"""Relays state stream and long polling REST API tests"""
+
+import json
+import threading
+import time
+from server.interfaces.mqtt import RelaysStatus
+from server.relays_manager import relays_manager_service
+
+KEEPALIVE = b": keepalive\n\n"
+
+
+def switch_relay_on_later(relay_number: int, delay_in_secs: float = 0.1):
+    """Switch a relay ON from another thread"""
+
+    relays_status = RelaysStatus.from_mask(
+        status_mask=1 << relay_number, validity_mask=1 << relay_number, command=True
+    )
+    threading.Timer(
+        delay_in_secs, relays_manager_service.set_relays_statuses, (relays_status,)
+    ).start()
+
+
+def parse_event(chunk: bytes) -> dict:
+    fields = dict(line.split(": ", 1) for line in chunk.decode().strip().split("\n"))
+    return {"id": int(fields["id"]), "event": fields["event"], "data": json.loads(fields["data"])}
+
+
+def next_event(chunks) -> dict:
+    chunk = next(chunks)
+    while chunk == KEEPALIVE:
+        chunk = next(chunks)
+    return parse_event(chunk)
+
+
+def test_stream_sends_current_state_then_changes(client, relays_off):
+    state = relays_manager_service.get_relays_state()
+    response = client.get("/relays/stream", buffered=False)
+    try:
+        assert response.status_code == 200
+        assert response.mimetype == "text/event-stream"
+        chunks = iter(response.response)
+        assert parse_event(next(chunks)) == {
+            "id": state.version,
+            "event": "relays",
+            "data": state.to_json(),
+        }
+        # Nothing changed within the keepalive period
+        assert next(chunks) == KEEPALIVE
+
+        switch_relay_on_later(4)
+        event = next_event(chunks)
+        assert event["id"] == state.version + 1
+        assert event["data"]["status_mask"] == 1 << 4
+    finally:
+        response.close()
+
+
+def test_stream_resumed_from_last_event_id(client, relays_off):
+    state = relays_manager_service.get_relays_state()
+    response = client.get(
+        "/relays/stream", headers={"Last-Event-ID": str(state.version)}, buffered=False
+    )
+    try:
+        chunks = iter(response.response)
+        # The current state was already received
+        assert next(chunks) == KEEPALIVE
+        switch_relay_on_later(5, delay_in_secs=0)
+        assert next_event(chunks)["id"] == state.version + 1
+    finally:
+        response.close()
+
+
+def test_poll_returns_current_state_without_version(client):
+    response = client.get("/relays/poll")
+    assert response.status_code == 200
+    assert response.json == relays_manager_service.get_relays_state().to_json()
+
+
+def test_poll_waits_for_change(client, relays_off):
+    version = relays_manager_service.get_relays_state().version
+    switch_relay_on_later(3)
+    start = time.monotonic()
+    response = client.get(f"/relays/poll?version={version}&timeout=5")
+    assert time.monotonic() - start < 1
+    assert response.json["version"] == version + 1
+    assert response.json["status_mask"] == 1 << 3
+
+
+def test_poll_timeout_capped(client, relays_off):
+    version = relays_manager_service.get_relays_state().version
+    start = time.monotonic()
+    # Capped by RELAYS_LONG_POLL_MAX_TIMEOUT_IN_SECS (1 s)
+    response = client.get(f"/relays/poll?version={version}&timeout=30")
+    assert 0.9 < time.monotonic() - start < 3
+    assert response.json["version"] == version
@@ -0,0 +1,32 @@
+"""Tracing REST API tests"""
+
+CORRELATION_ID_HEADER = "X-Correlation-ID"
+
+
+def test_command_traced_with_request_correlation_id(client, relays_off):
+    response = client.post("/relays/?relay_3=true", headers={CORRELATION_ID_HEADER: "9f1c2d"})
+    assert response.headers[CORRELATION_ID_HEADER] == "9f1c2d"
+
+    response = client.get("/traces/9f1c2d")
+    assert response.status_code == 200
+    assert response.json["correlation_id"] == "9f1c2d"
+    span_names = [span["name"] for span in response.json["spans"]]
+    for span_name in ("i2c.queue", "i2c.write", "relays.apply", "rest.request"):
+        assert span_name in span_names
+    rest_request = next(span for span in response.json["spans"] if span["name"] == "rest.request")
+    assert rest_request["attributes"]["status"] == 200
+
+    traces = client.get("/traces/?limit=1").json
+    assert [trace["correlation_id"] for trace in traces] == ["9f1c2d"]
+
+
+def test_correlation_id_generated_and_bounded(client):
+    generated = client.get("/relays/").headers[CORRELATION_ID_HEADER]
+    assert generated
+    assert client.get("/relays/").headers[CORRELATION_ID_HEADER] != generated
+    response = client.get("/relays/", headers={CORRELATION_ID_HEADER: "a" * 100})
+    assert response.headers[CORRELATION_ID_HEADER] == "a" * 64
+
+
+def test_unknown_trace(client):
+    assert client.get("/traces/unknown").status_code == 404